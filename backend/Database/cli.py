@@ -1,43 +1,89 @@
+import os
+import sys
 import sqlite3
+import time
 import click
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import MigrationError, current_version, check_query_plans
+from sqlalchemy import func, select
+import repository
+from sharding import open_repository, sqlite_paths
+import archive
+import maintenance
+import ratings
+import ann
+import backfill
+import perceptual_hash
+import text_embeddings
+import prompt_similarity
+import minhash
+import numpy as np
+from embeddings import model_version, get_model
+from vector_store import VectorStore
+from quantization import CODECS
+
 DB_NAME = 'game_database.db'
+DATABASE_URL = os.environ.get("DATABASE_URL", f"sqlite:///{DB_NAME}")
+SHARD_COUNT = int(os.environ.get("GAME_SHARDS", "0"))
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Images")
+
+def get_repo():
+    return open_repository(DATABASE_URL, SHARD_COUNT)
+
+def sqlite_files():
+    """The SQLite files behind DATABASE_URL, catalog first, for the commands that work on the files directly."""
+    paths = sqlite_paths(DATABASE_URL, SHARD_COUNT)
+    if not paths:
+        raise click.ClickException("This command needs a SQLite DATABASE_URL")
+    return paths
+
+def sqlite_file():
+    return sqlite_files()[0]
 
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    conn.commit()
-    conn.close()
+    repo = get_repo()
+    try:
+        repo.migrate()
+    except MigrationError as e:
+        raise click.ClickException(str(e))
+    finally:
+        repo.dispose()
+
+# Work on a database whose pending migrations cannot be applied yet, to fix what blocks them
+NO_MIGRATE_COMMANDS = {"rename-user"}
 
 @click.group()
-def cli():
+@click.pass_context
+def cli(ctx):
     """CLI application to view the game database."""
-    init_db()
+    if ctx.invoked_subcommand not in NO_MIGRATE_COMMANDS:
+        init_db()
 
 @cli.command()
 def users():
     """View all users."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM Users")
-    users = cursor.fetchall()
-    conn.close()
+    users = get_repo().list_users()
     
     click.echo("Users:")
     for user in users:
         click.echo(f"ID: {user[0]}, Name: {user[1]}")
 
+@cli.command()
+@click.argument('user_id', type=int)
+@click.argument('name')
+def rename_user(user_id, name):
+    """Rename a user, e.g. one of several accounts sharing a name."""
+    try:
+        get_repo().rename_user(user_id, name)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"User {user_id} is now {name}")
+
 @cli.command()
 def games():
     """View all games."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
-    SELECT Game.Id, Users.Name
-    FROM Game
-    LEFT JOIN Users ON Game.Winner_Id = Users.Id
-    """)
-    games = cursor.fetchall()
-    conn.close()
+    games = get_repo().list_games()
     
     click.echo("Games:")
     for game in games:
@@ -48,17 +94,10 @@ def games():
 @click.argument('game_id', type=int)
 def game_details(game_id):
     """View details of a specific game."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    repo = get_repo()
     
     # Get game info
-    cursor.execute("""
-    SELECT Game.Id, Users.Name
-    FROM Game
-    LEFT JOIN Users ON Game.Winner_Id = Users.Id
-    WHERE Game.Id = ?
-    """, (game_id,))
-    game = cursor.fetchone()
+    game = repo.get_game(game_id)
     
     if not game:
         click.echo(f"No game found with ID {game_id}")
@@ -68,49 +107,45 @@ def game_details(game_id):
     click.echo(f"Game ID: {game[0]}, Winner: {winner}")
     
     # Get participants
-    cursor.execute("""
-    SELECT Users.Name
-    FROM GameParticipants
-    JOIN Users ON GameParticipants.User_Id = Users.Id
-    WHERE GameParticipants.Game_Id = ?
-    """, (game_id,))
-    participants = cursor.fetchall()
+    participants = repo.get_participant_names(game_id)
     
     click.echo("Participants:")
     for participant in participants:
-        click.echo(f"- {participant[0]}")
+        click.echo(f"- {participant}")
     
     # Get images
-    cursor.execute("""
-    SELECT Images.Id, Images.Prompt, Users.Name
-    FROM Images
-    JOIN Users ON Images.User_Id = Users.Id
-    WHERE Images.Game_Id = ?
-    """, (game_id,))
-    images = cursor.fetchall()
+    images = repo.get_game_images(game_id)
     
     click.echo("Images:")
     for image in images:
         click.echo(f"Image ID: {image[0]}, Prompt: {image[1]}, Created by: {image[2]}")
     
-    conn.close()
+    # Get round outcomes
+    rounds = repo.get_round_results(game_id)
+    names = repo.get_user_names(row[1] for row in rounds)
+    
+    click.echo("Rounds:")
+    for round_number, user_id, votes, won in rounds:
+        marker = " (winner)" if won else ""
+        click.echo(f"Round {round_number + 1}: {names.get(user_id, user_id)} got {votes} votes{marker}")
+
+@cli.command()
+@click.argument('user_id', type=int)
+def vote_history(user_id):
+    """View every vote a user has cast."""
+    repo = get_repo()
+    votes = repo.get_user_votes(user_id)
+    names = repo.get_user_names(row[2] for row in votes)
+    
+    click.echo(f"Votes cast by user {user_id}:")
+    for game_id, round_number, voted_for_id in votes:
+        click.echo(f"Game ID: {game_id}, Round {round_number + 1}: voted for {names.get(voted_for_id, voted_for_id)}")
 
 @cli.command()
 @click.argument('image_id', type=int)
 def image_details(image_id):
     """View details of a specific image."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-    SELECT Images.Id, Images.Prompt, Users.Name, Game.Id, VectorIndex.Id
-    FROM Images
-    JOIN Users ON Images.User_Id = Users.Id
-    JOIN Game ON Images.Game_Id = Game.Id
-    LEFT JOIN VectorIndex ON Images.Vector_Id = VectorIndex.Id
-    WHERE Images.Id = ?
-    """, (image_id,))
-    image = cursor.fetchone()
+    image = get_repo().get_image_details(image_id)
     
     if not image:
         click.echo(f"No image found with ID {image_id}")
@@ -121,8 +156,261 @@ def image_details(image_id):
     click.echo(f"Created by: {image[2]}")
     click.echo(f"Game ID: {image[3]}")
     click.echo(f"Vector ID: {image[4] if image[4] else 'Not available'}")
+    vector = get_repo().get_vectors([image_id]).get(image_id)
+    if vector:
+        click.echo(f"Vector: {vector[1]} float32 values, model {vector[2]}")
+
+@cli.command()
+def shards():
+    """View how games and images are spread over the shards."""
+    repo = get_repo()
+    if SHARD_COUNT <= 1:
+        click.echo("Sharding is disabled (set GAME_SHARDS to more than 1).")
+        return
     
+    game_counts = dict(repo.query_all_shards(select(func.count()).select_from(repository.games)))
+    image_counts = dict(repo.query_all_shards(select(func.count()).select_from(repository.images)))
+    
+    click.echo("Shards:")
+    for shard in range(SHARD_COUNT):
+        click.echo(f"Shard {shard}: {game_counts[shard][0]} games, {image_counts[shard][0]} images")
+
+@cli.command()
+@click.option('--limit', type=int, default=repository.LEADERBOARD_PAGE_SIZE, help='Number of users to show.')
+def leaderboard(limit):
+    """View the top users by wins."""
+    rows = get_repo().get_leaderboard(limit)
+    
+    click.echo("Leaderboard:")
+    for rank, row in enumerate(rows, start=1):
+        click.echo(f"{rank}. {row['Name']}: {row['Wins']} wins in {row['Games_Played']} games, "
+                   f"{row['Votes_Received']} votes in {row['Rounds_Played']} rounds")
+
+@cli.command()
+def rebuild_stats():
+    """Recompute every user's stats from the game history."""
+    count = get_repo().rebuild_user_stats()
+    click.echo(f"Rebuilt stats for {count} users")
+
+@cli.command(name="ratings")
+@click.option('--limit', type=int, default=20, help='Number of users to show.')
+def show_ratings(limit):
+    """View the highest rated users."""
+    repo = get_repo()
+    users = dict(repo.list_users())
+    top = sorted(repo.get_ratings(users).items(), key=lambda item: item[1][0], reverse=True)[:limit]
+    
+    click.echo("Ratings:")
+    for user_id, (rating, games) in top:
+        click.echo(f"{users[user_id]}: {rating:.0f} after {games} games")
+
+@cli.command()
+def recompute_ratings():
+    """Replay the whole game history to recompute every rating."""
+    count = ratings.recompute_ratings(get_repo())
+    click.echo(f"Recomputed ratings for {count} users")
+
+@cli.command()
+@click.option('--distance', type=int, default=perceptual_hash.DUPLICATE_DISTANCE, help='Maximum differing pHash bits.')
+@click.option('--limit', type=int, default=50, help='Number of groups to show.')
+def duplicates(distance, limit):
+    """List groups of near-duplicate images by perceptual hash."""
+    ids, _, phashes = get_repo().load_image_hashes()
+    index = perceptual_hash.HashIndex(distance)
+    index.add_many(ids.tolist(), phashes.tolist())
+    grouped, shown = set(), 0
+    for image_id, phash in zip(ids.tolist(), phashes.tolist()):
+        if image_id in grouped:
+            continue
+        group = [other for other, _ in index.near(phash) if other not in grouped]
+        grouped.update(group)
+        if len(group) > 1:
+            click.echo(f"{len(group)} images: {', '.join(map(str, group))}")
+            shown += 1
+            if shown >= limit:
+                break
+    if not shown:
+        click.echo(f"No near-duplicates among {len(ids)} hashed images")
+
+@cli.command()
+def embed_prompts():
+    """Embed every stored prompt that has no text vector yet."""
+    total = text_embeddings.backfill_prompt_vectors(get_repo())
+    click.echo(f"Embedded {total} prompts with {text_embeddings.text_model_version()}")
+
+@cli.command()
+@click.argument('image_id', type=int)
+@click.option('--limit', type=int, default=10, help='Number of prompts to show.')
+def similar_prompts(image_id, limit):
+    """Show the stored prompts closest to an image's prompt."""
+    repo = get_repo()
+    ids, matrix = repo.load_prompt_vectors(text_embeddings.text_model_version())
+    row = np.flatnonzero(ids == image_id)
+    if not len(row):
+        click.echo(f"Image {image_id} has no prompt vector, run embed-prompts first")
+        return
+    scores = text_embeddings.cross_similarities(matrix[row], matrix)[0]
+    best = [i for i in np.argsort(-scores)[:limit + 1] if ids[i] != image_id][:limit]
+    prompts = repo.get_prompts(ids[best].tolist())
+    for i in best:
+        click.echo(f"{scores[i]:.3f}  image {ids[i]}: {prompts.get(int(ids[i]), '')[:100]}")
+
+@cli.command()
+def fit_tfidf():
+    """Refit the TF-IDF prompt vocabulary on every stored prompt."""
+    model = prompt_similarity.fit_from_repository(get_repo())
+    click.echo(f"Fitted {len(model)} n-grams on {model.documents} prompts")
+
+@cli.command()
+@click.option('--limit', type=int, default=20, help='Number of players to show.')
+def prompt_scores(limit):
+    """Score every player prompt in the history against its round's target prompt."""
+    repo = get_repo()
+    model = prompt_similarity.load_or_fit(repo)
+    if model is None:
+        click.echo("No prompts to score")
+        return
+    start = time.perf_counter()
+    scores = prompt_similarity.score_history(model, *repo.list_prompts())
+    click.echo(f"Scored {len(scores.scores)} prompts in {time.perf_counter() - start:.2f}s")
+    if not len(scores.scores):
+        return
+    users, inverse, counts = np.unique(scores.user_ids, return_inverse=True, return_counts=True)
+    means = np.bincount(inverse, weights=scores.scores) / counts
+    names = repo.get_user_names(users.tolist())
+    for i in np.argsort(-means)[:limit]:
+        click.echo(f"{means[i]:.3f}  {names.get(int(users[i]), users[i])} ({counts[i]} prompts)")
+
+@cli.command()
+def index_prompts():
+    """Add MinHash signatures of player prompts that are not indexed yet."""
+    total = minhash.backfill_signatures(get_repo())
+    click.echo(f"Indexed {total} prompts")
+
+@cli.command()
+@click.argument('prompt')
+@click.option('--threshold', type=float, default=minhash.COPY_THRESHOLD, help='Minimum estimated similarity.')
+def check_prompt(prompt, threshold):
+    """Look up the closest indexed prompt that PROMPT copies."""
+    repo = get_repo()
+    match = minhash.find_copy(repo, minhash.signatures([prompt])[0], threshold)
+    if match is None:
+        click.echo(f"No indexed prompt at or above {threshold}")
+        return
+    click.echo(f"{match.similarity:.3f}  image {match.image_id} by user {match.user_id}: "
+               f"{repo.get_prompts([match.image_id]).get(match.image_id, '')[:100]}")
+
+@cli.command()
+@click.option('--workers', type=int, default=None, help='Worker processes (default: one per core).')
+@click.option('--batch-size', type=int, default=backfill.BACKFILL_BATCH, help='Images per transaction.')
+@click.option('--limit', type=int, default=None, help='Stop after this many images.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint and start from the first image.')
+def backfill_embeddings(workers, batch_size, limit, restart):
+    """Embed images that have no vector of the current model version."""
+    repo = get_repo()
+    report = backfill.backfill_embeddings(repo, IMAGES_DIR, workers, batch_size, restart=restart, limit=limit)
+    click.echo(f"Embedded {report.embedded} images ({report.missing} without a file, {report.failed} failed) "
+               f"in {report.seconds:.1f}s: {report.images_per_second:.1f} images/s, "
+               f"{report.images_per_second_per_core:.1f} per core on {report.workers} workers")
+    if report.embedded:
+        added, _ = VectorStore(model_version(), get_model().dim).sync(repo)
+        click.echo(f"Added {added} vectors to the vector store")
+
+@cli.command()
+@click.option('--compact', is_flag=True, help='Also drop replaced and removed rows.')
+def sync_vectors(compact):
+    """Bring the memory-mapped vector store in step with VectorIndex."""
+    store = VectorStore(model_version(), get_model().dim)
+    added, removed = store.sync(get_repo())
+    if compact:
+        store.compact()
+    click.echo(f"Vector store {store.name}: {added} added, {removed} removed, {len(store)} rows")
+
+@cli.command()
+@click.option('--codec', type=click.Choice(list(CODECS)), default=None, help='Quantize the index lists.')
+def build_ann(codec):
+    """Rebuild the similar-image index from the vector store."""
+    store = VectorStore(model_version(), get_model().dim)
+    repo = get_repo()
+    store.sync(repo)
+    try:
+        index = ann.build_from_repository(repo, model_version(), store=store, codec=codec)
+    except ValueError as e:
+        click.echo(str(e))
+        return
+    click.echo(f"Indexed {len(index)} images in {len(index.centroids)} lists, {index.bytes_per_vector:.0f} bytes/vector")
+
+@cli.command()
+def schema_version():
+    """Show the applied schema version."""
+    conn = sqlite3.connect(sqlite_file())
+    click.echo(f"Schema version: {current_version(conn)}")
+    conn.close()
+
+@cli.command()
+def check_indexes():
+    """Verify that every hot query is answered through an index."""
+    conn = sqlite3.connect(sqlite_file())
+    failures = check_query_plans(conn)
     conn.close()
+    
+    if failures:
+        click.echo("Queries scanning a table:")
+        for failure in failures:
+            click.echo(f"- {failure}")
+        sys.exit(1)
+    click.echo("All hot queries use an index.")
+
+@cli.command(name="archive")
+@click.option('--days', type=int, default=archive.ARCHIVE_AFTER_DAYS, help='Archive games finished more than this many days ago.')
+def archive_games(days):
+    """Move old finished games and their images into monthly archive files."""
+    if SHARD_COUNT > 1:
+        click.echo("Archiving is only supported for a single SQLite database.")
+        sys.exit(1)
+    archived = archive.archive_finished_games(sqlite_file(), IMAGES_DIR, older_than_days=days)
+    
+    if not archived:
+        click.echo("No games to archive.")
+    for month, count in archived.items():
+        click.echo(f"{month}: archived {count} games")
+
+@cli.command()
+@click.argument('game_id', type=int)
+def restore(game_id):
+    """Bring an archived game back into the live database."""
+    if archive.restore_game(sqlite_file(), IMAGES_DIR, game_id):
+        click.echo(f"Restored game {game_id}")
+    else:
+        click.echo(f"Game {game_id} is not archived")
+
+@cli.command()
+@click.option('--days', type=int, default=archive.RETENTION_DAYS, help='Delete archive months older than this many days.')
+def purge_archives(days):
+    """Delete archive months past the retention period."""
+    months = archive.purge_archives(sqlite_file(), older_than_days=days)
+    
+    if not months:
+        click.echo("No archives past retention.")
+    for month in months:
+        click.echo(f"Purged {month}")
+
+@cli.command(name="maintenance")
+@click.argument('jobs', nargs=-1, type=click.Choice(list(maintenance.JOBS)))
+def run_maintenance(jobs):
+    """Run maintenance jobs now (all of them by default) on every database file and show their timings."""
+    for path in sqlite_files():
+        for job in jobs or maintenance.JOBS:
+            run = maintenance.run_job(job, path)
+            outcome = f"failed: {run.error}" if run.error else run.result
+            click.echo(f"{path} {job}: {run.seconds * 1000:.1f} ms, {outcome}")
+
+@cli.command()
+def enable_incremental_vacuum():
+    """Switch the database files to incremental auto-vacuum (rewrites them; stop the server first)."""
+    for path in sqlite_files():
+        maintenance.enable_incremental_vacuum(path)
+        click.echo(f"{path}: auto_vacuum set to INCREMENTAL")
 
 if __name__ == '__main__':
     cli()
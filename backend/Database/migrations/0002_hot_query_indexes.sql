@@ -0,0 +1,13 @@
+-- login: WHERE Name = ? AND Password = ?
+-- Users.Name becomes unique; migrations.py refuses to apply this while names are shared
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_name ON Users(Name);
+
+-- game-details: images of a game (GameParticipants is covered by its primary key)
+CREATE INDEX IF NOT EXISTS idx_images_game_id ON Images(Game_Id);
+
+-- per-user image and participation history
+CREATE INDEX IF NOT EXISTS idx_images_user_id ON Images(User_Id);
+CREATE INDEX IF NOT EXISTS idx_gameparticipants_user_id ON GameParticipants(User_Id);
+
+-- vector lookups by image
+CREATE INDEX IF NOT EXISTS idx_vectorindex_image_id ON VectorIndex(Image_Id);
@@ -0,0 +1,16 @@
+-- When a game ended (UTC, "YYYY-MM-DD HH:MM:SS"); archival picks games by this
+ALTER TABLE Game ADD COLUMN Finished_At TEXT;
+
+-- Games that already have a winner count as finished as of this migration
+UPDATE Game SET Finished_At = CURRENT_TIMESTAMP WHERE Winner_Id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_game_finished_at ON Game(Finished_At);
+
+-- Directory of games moved to cold storage, so restore knows which archive file to open
+CREATE TABLE IF NOT EXISTS ArchivedGames (
+    Game_Id INTEGER PRIMARY KEY,
+    Month TEXT NOT NULL,
+    Archived_At TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_archivedgames_month ON ArchivedGames(Month);
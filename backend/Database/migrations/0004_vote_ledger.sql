@@ -0,0 +1,31 @@
+-- Every ballot of every decided round
+CREATE TABLE IF NOT EXISTS Votes (
+    Id INTEGER PRIMARY KEY AUTOINCREMENT,
+    Game_Id INTEGER NOT NULL,
+    Round INTEGER NOT NULL,
+    Voter_Id INTEGER NOT NULL,
+    Voted_For_Id INTEGER NOT NULL,
+    FOREIGN KEY (Game_Id) REFERENCES Game(Id),
+    FOREIGN KEY (Voter_Id) REFERENCES Users(Id),
+    FOREIGN KEY (Voted_For_Id) REFERENCES Users(Id)
+);
+
+-- per-user vote history, newest game first
+CREATE INDEX IF NOT EXISTS idx_votes_voter_id ON Votes(Voter_Id, Game_Id, Round);
+-- ballots of one round
+CREATE INDEX IF NOT EXISTS idx_votes_game_round ON Votes(Game_Id, Round);
+
+-- Outcome of each decided round, one row per player
+CREATE TABLE IF NOT EXISTS RoundResults (
+    Game_Id INTEGER NOT NULL,
+    Round INTEGER NOT NULL,
+    User_Id INTEGER NOT NULL,
+    Votes INTEGER NOT NULL,
+    Won INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (Game_Id, Round, User_Id),
+    FOREIGN KEY (Game_Id) REFERENCES Game(Id),
+    FOREIGN KEY (User_Id) REFERENCES Users(Id)
+);
+
+-- per-user round history
+CREATE INDEX IF NOT EXISTS idx_roundresults_user_id ON RoundResults(User_Id, Game_Id);
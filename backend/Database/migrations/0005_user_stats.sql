@@ -0,0 +1,26 @@
+-- Per-user totals, kept up to date when rounds are tallied and games end
+CREATE TABLE IF NOT EXISTS UserStats (
+    User_Id INTEGER PRIMARY KEY,
+    Games_Played INTEGER NOT NULL DEFAULT 0,
+    Wins INTEGER NOT NULL DEFAULT 0,
+    Rounds_Played INTEGER NOT NULL DEFAULT 0,
+    Rounds_Won INTEGER NOT NULL DEFAULT 0,
+    Votes_Received INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (User_Id) REFERENCES Users(Id)
+);
+
+-- leaderboard pages: ORDER BY Wins DESC, Votes_Received DESC, User_Id DESC with a keyset cursor
+CREATE INDEX IF NOT EXISTS idx_userstats_leaderboard ON UserStats(Wins, Votes_Received, User_Id);
+
+-- Backfill from the games finished so far
+INSERT OR IGNORE INTO UserStats (User_Id, Games_Played, Wins, Rounds_Played, Rounds_Won, Votes_Received)
+SELECT GameParticipants.User_Id,
+       COUNT(*),
+       SUM(Game.Winner_Id = GameParticipants.User_Id),
+       COALESCE((SELECT COUNT(*) FROM RoundResults WHERE RoundResults.User_Id = GameParticipants.User_Id), 0),
+       COALESCE((SELECT SUM(Won) FROM RoundResults WHERE RoundResults.User_Id = GameParticipants.User_Id), 0),
+       COALESCE((SELECT SUM(Votes) FROM RoundResults WHERE RoundResults.User_Id = GameParticipants.User_Id), 0)
+FROM GameParticipants
+JOIN Game ON Game.Id = GameParticipants.Game_Id
+WHERE Game.Winner_Id IS NOT NULL
+GROUP BY GameParticipants.User_Id;
@@ -0,0 +1,10 @@
+-- Skill rating per user, updated when a game ends (see ratings.py)
+CREATE TABLE IF NOT EXISTS Ratings (
+    User_Id INTEGER PRIMARY KEY,
+    Rating REAL NOT NULL,
+    Games INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (User_Id) REFERENCES Users(Id)
+);
+
+-- rating ranges for matchmaking and rating leaderboards
+CREATE INDEX IF NOT EXISTS idx_ratings_rating ON Ratings(Rating);
@@ -0,0 +1,10 @@
+-- Vector_embeddings holds little-endian float32 values; Dim and Version (model name/version)
+-- describe them so vectors from different models are never mixed
+ALTER TABLE VectorIndex ADD COLUMN Dim INTEGER;
+ALTER TABLE VectorIndex ADD COLUMN Version TEXT;
+
+-- Every vector written before this migration is a placeholder ('sample_vector_data' and the like)
+UPDATE Images SET Vector_Id = NULL WHERE Vector_Id IN (SELECT Id FROM VectorIndex WHERE Dim IS NULL);
+DELETE FROM VectorIndex WHERE Dim IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_vectorindex_version ON VectorIndex(Version, Image_Id);
@@ -0,0 +1,7 @@
+-- 64-bit perceptual hashes of the generated image (see perceptual_hash.py), stored as signed
+-- integers. NULL for prompt-only rows and for images generated before this migration.
+ALTER TABLE Images ADD COLUMN DHash INTEGER;
+ALTER TABLE Images ADD COLUMN PHash INTEGER;
+
+-- Finding an earlier image generated from exactly the same prompt
+CREATE INDEX IF NOT EXISTS idx_images_prompt ON Images(Prompt);
@@ -0,0 +1,10 @@
+-- Text embedding of an image's prompt (see text_embeddings.py), next to the image vector in
+-- VectorIndex. Little-endian float32 like Vector_embeddings; Version names the text model.
+CREATE TABLE IF NOT EXISTS PromptVectors (
+    Image_Id INTEGER PRIMARY KEY REFERENCES Images(Id),
+    Vector BLOB NOT NULL,
+    Dim INTEGER NOT NULL,
+    Version TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_promptvectors_version ON PromptVectors(Version, Image_Id);
@@ -0,0 +1,13 @@
+-- MinHash signatures of player prompts and their LSH buckets (see minhash.py), to find copied
+-- prompts without scanning Images.Prompt. Signature is little-endian uint32.
+CREATE TABLE IF NOT EXISTS PromptSignatures (
+    Image_Id INTEGER PRIMARY KEY REFERENCES Images(Id),
+    Signature BLOB NOT NULL
+);
+
+-- One row per band of a signature; Bucket hashes the band number and its slots
+CREATE TABLE IF NOT EXISTS PromptBuckets (
+    Bucket INTEGER NOT NULL,
+    Image_Id INTEGER NOT NULL REFERENCES Images(Id),
+    PRIMARY KEY (Bucket, Image_Id)
+);
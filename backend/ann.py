@@ -0,0 +1,400 @@
+import atexit
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from logger import game_logger
+from quantization import Codec, load_codec, train_codec
+
+# Inverted-file (IVF) index for cosine similarity over unit-length embeddings. Vectors are
+# clustered with spherical k-means; a query only scans the N_PROBE lists whose centroids are
+# closest to it. All list data lives in a few contiguous arrays ordered by list, so a query is
+# one small matrix product for the centroids plus one per probed list.
+#
+# With a codec (quantization.py) the lists hold uint8 codes of each vector's residual from its
+# list centroid instead of float32 vectors. A query scores the codes without decoding them, then
+# re-ranks the best RERANK_FACTOR * k candidates against the full-precision vectors, which stay
+# on disk in the vector store and are only read for those few rows.
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Database", "ann_index.npz")
+N_PROBE = 64
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 100_000
+# Above this many vectors added since the last build, lists get unbalanced enough to rebuild
+REBUILD_RATIO = 0.5
+RERANK_FACTOR = 10
+_CHUNK = 16384
+
+def default_list_count(n_vectors: int) -> int:
+    return int(np.clip(4 * np.sqrt(max(n_vectors, 1)), 1, 4096))
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return np.concatenate([np.argmax(vectors[i:i + _CHUNK] @ centroids.T, axis=1)
+                           for i in range(0, len(vectors), _CHUNK)]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+def train_centroids(vectors: np.ndarray, n_lists: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of the vectors."""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > KMEANS_SAMPLE:
+        vectors = vectors[rng.choice(len(vectors), KMEANS_SAMPLE, replace=False)]
+    n_lists = min(n_lists, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _assign(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=n_lists)
+        empty = counts == 0
+        starts = np.cumsum(counts) - counts
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(vectors[order], starts[~empty], axis=0)
+        # Re-seed empty lists with random vectors instead of letting them die
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = _normalize_rows(sums)
+    return centroids
+
+# Looks up full-precision vectors for re-ranking: image IDs -> (found mask, vectors)
+FullVectors = Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]
+
+def _encode_residuals(codec: Codec, vectors: np.ndarray, centroids: np.ndarray, assignment: np.ndarray) -> np.ndarray:
+    codes = np.empty((len(vectors), codec.code_size), dtype=np.uint8)
+    for i in range(0, len(vectors), _CHUNK):
+        chunk = _normalize_rows(vectors[i:i + _CHUNK])
+        codes[i:i + _CHUNK] = codec.encode(chunk - centroids[assignment[i:i + _CHUNK]])
+    return codes
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, vectors: np.ndarray, ids: np.ndarray, offsets: np.ndarray,
+                 version: str = "", n_probe: int = N_PROBE, codec: Optional[Codec] = None,
+                 full_vectors: Optional[FullVectors] = None):
+        self.centroids = centroids
+        # Vectors (or codec codes of their residuals) and IDs ordered by list; list k is rows offsets[k]:offsets[k + 1]
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+        self.version = version
+        self.n_probe = n_probe
+        self.codec = codec
+        # Without it a codec index returns its approximate scores as they are
+        self.full_vectors = full_vectors
+        # Vectors added since the build, per list, merged on the next compact()
+        self.pending: List[List[Tuple[int, np.ndarray]]] = [[] for _ in range(len(centroids))]
+        self.pending_count = 0
+        self.lock = threading.Lock()
+
+    @property
+    def dim(self) -> int:
+        return self.centroids.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.ids) + self.pending_count
+
+    @property
+    def bytes_per_vector(self) -> float:
+        return (self.vectors.nbytes + self.ids.nbytes) / max(len(self.ids), 1)
+
+    @classmethod
+    def build(cls, ids: np.ndarray, vectors: np.ndarray, n_lists: Optional[int] = None, version: str = "",
+              n_probe: int = N_PROBE, codec: Optional[str] = None, full_vectors: Optional[FullVectors] = None) -> "IVFIndex":
+        """Index the vectors, as float32 or, given a codec name, as codes. With a codec the input
+        is read in chunks and never copied whole, so it can be a memmap larger than RAM."""
+        ids = np.asarray(ids, dtype=np.int64)
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(len(vectors), min(len(vectors), KMEANS_SAMPLE), replace=False))
+        centroids = train_centroids(_normalize_rows(vectors[sample]), n_lists or default_list_count(len(vectors)))
+        # Scaling a row doesn't change which centroid has the largest dot product with it
+        assignment = _assign(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignment, minlength=len(centroids)))
+        if codec is None:
+            return cls(centroids, _normalize_rows(vectors)[order], ids[order], offsets, version, n_probe)
+        residuals = _normalize_rows(vectors[sample]) - centroids[assignment[sample]]
+        trained = train_codec(codec, residuals)
+        codes = _encode_residuals(trained, vectors, centroids, assignment)
+        return cls(centroids, codes[order], ids[order], offsets, version, n_probe, trained, full_vectors)
+
+    def add(self, image_id: int, vector: np.ndarray) -> None:
+        vector = _normalize_rows(np.asarray(vector).reshape(1, -1))[0]
+        list_id = int(np.argmax(self.centroids @ vector))
+        with self.lock:
+            self.pending[list_id].append((image_id, vector))
+            self.pending_count += 1
+
+    def contains(self, image_ids: np.ndarray) -> np.ndarray:
+        """Mask of the image IDs that are indexed, in the lists or pending."""
+        with self.lock:
+            pending = np.array([image_id for items in self.pending for image_id, _ in items], dtype=np.int64)
+            return np.isin(image_ids, np.concatenate([self.ids, pending]))
+
+    def needs_rebuild(self) -> bool:
+        return self.pending_count > REBUILD_RATIO * max(len(self.ids), 1)
+
+    def compact(self) -> None:
+        """Merge pending additions into the contiguous list arrays."""
+        with self.lock:
+            if not self.pending_count:
+                return
+            sizes = np.diff(self.offsets)
+            extra = np.array([len(items) for items in self.pending], dtype=np.int64)
+            offsets = np.zeros_like(self.offsets)
+            offsets[1:] = np.cumsum(sizes + extra)
+            vectors = np.empty((offsets[-1], self.vectors.shape[1]), dtype=self.vectors.dtype)
+            ids = np.empty(offsets[-1], dtype=np.int64)
+            for k in range(len(self.centroids)):
+                start, old_end = offsets[k], offsets[k] + sizes[k]
+                vectors[start:old_end] = self.vectors[self.offsets[k]:self.offsets[k + 1]]
+                ids[start:old_end] = self.ids[self.offsets[k]:self.offsets[k + 1]]
+                if not self.pending[k]:
+                    continue
+                added = np.stack([vector for _, vector in self.pending[k]])
+                if self.codec is not None:
+                    added = self.codec.encode(added - self.centroids[k])
+                vectors[old_end:offsets[k + 1]] = added
+                ids[old_end:offsets[k + 1]] = [image_id for image_id, _ in self.pending[k]]
+            self.vectors, self.ids, self.offsets = vectors, ids, offsets
+            self.pending = [[] for _ in range(len(self.centroids))]
+            self.pending_count = 0
+
+    def search(self, query: np.ndarray, k: int = 10, n_probe: Optional[int] = None,
+               rerank: Optional[int] = None) -> List[Tuple[int, float]]:
+        """The k most similar (image_id, cosine similarity) pairs, best first. A codec index
+        re-ranks its best `rerank` candidates (default RERANK_FACTOR * k, 0 to skip) exactly."""
+        query = _normalize_rows(np.asarray(query).reshape(1, -1))[0]
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        centroid_scores = self.centroids @ query
+        probes = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        # Residual codes: q . v == q . centroid + q . residual
+        scorer = self.codec.scorer(query) if self.codec is not None else None
+        with self.lock:
+            id_parts, score_parts = [], []
+            for list_id in probes:
+                start, end = self.offsets[list_id], self.offsets[list_id + 1]
+                if end > start:
+                    id_parts.append(self.ids[start:end])
+                    if scorer is None:
+                        score_parts.append(self.vectors[start:end] @ query)
+                    else:
+                        score_parts.append(scorer(self.vectors[start:end]) + centroid_scores[list_id])
+                if self.pending[list_id]:
+                    id_parts.append(np.array([image_id for image_id, _ in self.pending[list_id]], dtype=np.int64))
+                    score_parts.append(np.stack([vector for _, vector in self.pending[list_id]]) @ query)
+        if not id_parts:
+            return []
+        ids, scores = np.concatenate(id_parts), np.concatenate(score_parts)
+        rerank = RERANK_FACTOR * k if rerank is None else rerank
+        if self.codec is not None and self.full_vectors is not None and rerank > 0:
+            candidates = np.argpartition(-scores, min(rerank, len(scores)) - 1)[:rerank]
+            found, vectors = self.full_vectors(ids[candidates])
+            exact = _normalize_rows(vectors) @ query
+            ids, scores = ids[candidates], np.where(found, exact, scores[candidates])
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def save(self, path: str = INDEX_PATH) -> None:
+        self.compact()
+        partial = path + ".partial.npz"
+        codec = {}
+        if self.codec is not None:
+            codec = {f"codec_{key}": value for key, value in self.codec.params().items()}
+            codec["codec"] = np.array(self.codec.name)
+        with self.lock:
+            np.savez(partial, centroids=self.centroids, vectors=self.vectors, ids=self.ids,
+                     offsets=self.offsets, version=np.array(self.version), **codec)
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path: str = INDEX_PATH, n_probe: int = N_PROBE, full_vectors: Optional[FullVectors] = None) -> "IVFIndex":
+        with np.load(path) as data:
+            codec = None
+            if "codec" in data:
+                codec = load_codec(str(data["codec"]), {key[len("codec_"):]: data[key] for key in data.files if key.startswith("codec_")})
+            return cls(data["centroids"], data["vectors"], data["ids"], data["offsets"], str(data["version"]),
+                       n_probe, codec, full_vectors)
+
+    @property
+    def codec_name(self) -> str:
+        return self.codec.name if self.codec is not None else ""
+
+def brute_force(ids: np.ndarray, vectors: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    scores = vectors @ (query / np.linalg.norm(query))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return ids[top[np.argsort(-scores[top])]]
+
+def build_from_repository(repo, version: str, path: str = INDEX_PATH, store=None, codec: Optional[str] = None) -> IVFIndex:
+    """Build and save an index over every VectorIndex vector of the given model version,
+    read from the memory-mapped vector store when one is given. A codec index re-ranks
+    against the store; without one it returns approximate scores."""
+    start = time.perf_counter()
+    ids, vectors = store.snapshot() if store is not None else repo.load_vectors(version)
+    if not len(ids):
+        raise ValueError(f"No {version} vectors to index")
+    index = IVFIndex.build(ids, vectors, version=version, codec=codec,
+                           full_vectors=store.get if store is not None else None)
+    index.save(path)
+    game_logger.info(f"Built {codec or 'float32'} ANN index over {len(ids)} vectors in {len(index.centroids)} lists "
+                     f"({index.bytes_per_vector:.0f} bytes/vector) in {time.perf_counter() - start:.2f}s")
+    return index
+
+def add_missing(index: IVFIndex, repo, store=None) -> int:
+    """Add the vectors of the store (or VectorIndex) that the index lacks, e.g. those written after
+    it was saved. Returns the count."""
+    ids, vectors = store.snapshot() if store is not None else repo.load_vectors(index.version)
+    missing = np.flatnonzero(~index.contains(ids))
+    for row in missing.tolist():
+        index.add(int(ids[row]), vectors[row])
+    return len(missing)
+
+def load_or_build(repo, version: str, path: str = INDEX_PATH, store=None, codec: Optional[str] = None) -> Optional[IVFIndex]:
+    if os.path.exists(path):
+        index = IVFIndex.load(path, full_vectors=store.get if store is not None else None)
+        if index.version == version and index.codec_name == (codec or ""):
+            added = add_missing(index, repo, store)
+            if added:
+                game_logger.info(f"Added {added} vectors missing from the saved ANN index")
+            return index
+        game_logger.info(f"ANN index is {index.version} {index.codec_name or 'float32'}, "
+                         f"rebuilding as {version} {codec or 'float32'}")
+    try:
+        return build_from_repository(repo, version, path, store, codec)
+    except ValueError as e:
+        game_logger.info(f"Not building ANN index: {str(e)}")
+        return None
+
+class SimilarImages:
+    """Keeps an IVFIndex in step with VectorIndex for the current model version: loaded (or built)
+    in the background at startup, fed every new vector, rebuilt once enough vectors were added
+    that the lists have drifted, and saved at exit."""
+
+    def __init__(self, repo, version: str, path: str = INDEX_PATH, store=None, codec: Optional[str] = None):
+        self.repo = repo
+        self.version = version
+        self.path = path
+        # Optional vector_store.VectorStore, synced first and then used instead of the database
+        self.store = store
+        # Optional quantization codec name ("int8", "pq") for the index lists
+        self.codec = codec
+        self.index: Optional[IVFIndex] = None
+        self.rebuilding = threading.Lock()
+        # Guards swapping in a new index. While one is loaded or built, every added vector is also
+        # kept here and replayed into it, since its source snapshot may have been taken before.
+        self.lock = threading.Lock()
+        self.added: Optional[List[Tuple[int, np.ndarray]]] = []
+
+    def start(self) -> "SimilarImages":
+        threading.Thread(target=self._load, name="SimilarImages", daemon=True).start()
+        atexit.register(self.save)
+        return self
+
+    def _load(self) -> None:
+        index = None
+        try:
+            if self.store is not None:
+                self.store.sync(self.repo)
+            index = load_or_build(self.repo, self.version, self.path, self.store, self.codec)
+        finally:
+            self._install(index)
+
+    def _rebuild(self) -> None:
+        with self.rebuilding:
+            with self.lock:
+                self.added = []
+            index = None
+            try:
+                index = build_from_repository(self.repo, self.version, self.path, self.store, self.codec)
+            finally:
+                self._install(index)
+
+    def _install(self, index: Optional[IVFIndex]) -> None:
+        """Swap in a new index after replaying the vectors added while it was made. Without one
+        (the build failed) the current index stays."""
+        with self.lock:
+            added, self.added = self.added, None
+            if index is None:
+                return
+            if added:
+                known = index.contains(np.array([image_id for image_id, _ in added], dtype=np.int64))
+                for (image_id, vector), present in zip(added, known):
+                    if not present:
+                        index.add(image_id, vector)
+            self.index = index
+
+    def add(self, image_id: int, vector: np.ndarray) -> None:
+        with self.lock:
+            if self.added is not None:
+                self.added.append((image_id, vector))
+            index = self.index
+            if index is not None:
+                index.add(image_id, vector)
+        if index is not None and index.needs_rebuild() and not self.rebuilding.locked():
+            threading.Thread(target=self._rebuild, name="SimilarImagesRebuild", daemon=True).start()
+
+    def similar(self, image_id: int, k: int) -> Optional[List[Tuple[int, float]]]:
+        """Up to k other images most similar to this one; None while the index is not ready.
+        Raises KeyError when the image has no vector of the index's model version."""
+        index = self.index
+        if index is None:
+            return None
+        row = self.repo.get_vectors([image_id]).get(image_id)
+        if row is None or row[2] != self.version:
+            raise KeyError(image_id)
+        query = np.frombuffer(row[0], dtype="<f4")
+        return [(other, score) for other, score in index.search(query, k + 1) if other != image_id][:k]
+
+    def save(self) -> None:
+        if self.index is not None:
+            self.index.save(self.path)
+
+def _clustered_data(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = _normalize_rows(rng.standard_normal((clusters, dim)))
+    data = centers[rng.integers(0, clusters, n)] + rng.standard_normal((n, dim)).astype(np.float32) / np.sqrt(dim)
+    return _normalize_rows(data)
+
+def _measure(index: IVFIndex, query_vectors: np.ndarray, truth: List[set], k: int, **search_args) -> str:
+    latencies, hits = [], 0
+    for q, expected in zip(query_vectors, truth):
+        t = time.perf_counter()
+        found = index.search(q, k, **search_args)
+        latencies.append(time.perf_counter() - t)
+        hits += len(expected & {image_id for image_id, _ in found})
+    latencies = np.array(latencies) * 1000
+    return (f"recall@{k} {hits / (len(query_vectors) * k):.3f}, "
+            f"p50 {np.percentile(latencies, 50):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms")
+
+def benchmark(n: int = 1_000_000, dim: int = 160, queries: int = 200, k: int = 10, seed: int = 0) -> None:
+    """Query latency and recall@k against brute force on clustered synthetic vectors, for float32
+    lists over a range of n_probe and for each codec with and without re-ranking."""
+    vectors = _clustered_data(n, dim, max(n // 100, 1), seed)
+    ids = np.arange(n, dtype=np.int64)
+    rng = np.random.default_rng(seed + 1)
+    query_vectors = _normalize_rows(vectors[rng.integers(0, n, queries)] + 0.1 * rng.standard_normal((queries, dim)) / np.sqrt(dim))
+    truth = [set(brute_force(ids, vectors, q, k).tolist()) for q in query_vectors]
+    start = time.perf_counter()
+    for q in query_vectors:
+        brute_force(ids, vectors, q, k)
+    print(f"brute force: {(time.perf_counter() - start) / queries * 1000:.2f} ms/query, {vectors.nbytes / n:.0f} bytes/vector")
+
+    def full_vectors(image_ids):
+        return np.ones(len(image_ids), dtype=bool), vectors[image_ids]
+
+    for codec in (None, "int8", "pq"):
+        start = time.perf_counter()
+        index = IVFIndex.build(ids, vectors, codec=codec, full_vectors=full_vectors)
+        print(f"{codec or 'float32'}: built {len(index.centroids)} lists in {time.perf_counter() - start:.1f}s, "
+              f"{index.bytes_per_vector:.0f} bytes/vector with IDs")
+        if codec is None:
+            for n_probe in (8, 32, 64, 128, 256):
+                print(f"  n_probe={n_probe:>3}: {_measure(index, query_vectors, truth, k, n_probe=n_probe)}")
+        else:
+            print(f"  approximate: {_measure(index, query_vectors, truth, k, rerank=0)}")
+            print(f"  re-ranked:   {_measure(index, query_vectors, truth, k)}")
+
+if __name__ == "__main__":
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
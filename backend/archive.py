@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import time
+import zipfile
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from typing import Dict, List, Optional
+from PIL import Image
+from logger import game_logger
+from migrations import migrate
+from repository import TIMESTAMP_FORMAT, utc_timestamp
+
+# Finished games older than this move out of the live database
+ARCHIVE_AFTER_DAYS = 30
+# Archive months older than this are deleted for good; None keeps them forever
+RETENTION_DAYS: Optional[int] = 365 * 2
+# Archived images are re-encoded as lossless WebP (roughly 30% smaller than the PNGs)
+ARCHIVE_WEBP_OPTIONS = {"lossless": True, "quality": 100, "method": 6}
+
+# Game-scoped tables in copy order, with the rows that belong to the games in archive_batch.
+# Deletes run in reverse order. {db} is the schema the rows are read from.
+ARCHIVED_TABLES = [
+    ("Game", "Id IN (SELECT Game_Id FROM temp.archive_batch)"),
+    ("GameParticipants", "Game_Id IN (SELECT Game_Id FROM temp.archive_batch)"),
+    ("Images", "Game_Id IN (SELECT Game_Id FROM temp.archive_batch)"),
+    ("VectorIndex", "Image_Id IN (SELECT Id FROM {db}.Images WHERE Game_Id IN (SELECT Game_Id FROM temp.archive_batch))"),
+    ("PromptVectors", "Image_Id IN (SELECT Id FROM {db}.Images WHERE Game_Id IN (SELECT Game_Id FROM temp.archive_batch))"),
+    ("PromptSignatures", "Image_Id IN (SELECT Id FROM {db}.Images WHERE Game_Id IN (SELECT Game_Id FROM temp.archive_batch))"),
+    ("PromptBuckets", "Image_Id IN (SELECT Id FROM {db}.Images WHERE Game_Id IN (SELECT Game_Id FROM temp.archive_batch))"),
+    ("Votes", "Game_Id IN (SELECT Game_Id FROM temp.archive_batch)"),
+    ("RoundResults", "Game_Id IN (SELECT Game_Id FROM temp.archive_batch)"),
+]
+
+def default_archive_dir(db_path: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), "archive")
+
+def archive_db_path(archive_dir: str, month: str) -> str:
+    return os.path.join(archive_dir, f"games_{month.replace('-', '_')}.db")
+
+def image_bundle_path(archive_dir: str, month: str) -> str:
+    return os.path.join(archive_dir, f"images_{month.replace('-', '_')}.zip")
+
+def _columns(conn: sqlite3.Connection, db: str, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA {db}.table_info({table})")]
+
+def _copy_rows(conn: sqlite3.Connection, src: str, dst: str) -> None:
+    for table, condition in ARCHIVED_TABLES:
+        dst_columns = set(_columns(conn, dst, table))
+        columns = ", ".join(c for c in _columns(conn, src, table) if c in dst_columns)
+        conn.execute(f"INSERT OR REPLACE INTO {dst}.{table} ({columns}) "
+                     f"SELECT {columns} FROM {src}.{table} WHERE {condition.format(db=src)}")
+
+def _delete_rows(conn: sqlite3.Connection, db: str) -> None:
+    for table, condition in reversed(ARCHIVED_TABLES):
+        conn.execute(f"DELETE FROM {db}.{table} WHERE {condition.format(db=db)}")
+
+def _set_batch(conn: sqlite3.Connection, game_ids: List[int]) -> None:
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (Game_Id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.archive_batch")
+    conn.executemany("INSERT INTO temp.archive_batch (Game_Id) VALUES (?)", [(game_id,) for game_id in game_ids])
+
+def _open_archive(archive_dir: str, month: str) -> str:
+    os.makedirs(archive_dir, exist_ok=True)
+    path = archive_db_path(archive_dir, month)
+    with closing(sqlite3.connect(path)) as conn:
+        migrate(conn)
+    return path
+
+def _bundle_images(images_dir: str, bundle_path: str, image_ids: List[int]) -> List[str]:
+    """Append the images as WebP to the month's zip; returns the PNG paths that are now safe to delete."""
+    bundled = []
+    with zipfile.ZipFile(bundle_path, "a", compression=zipfile.ZIP_STORED) as bundle:
+        existing = set(bundle.namelist())
+        for image_id in image_ids:
+            png_path = os.path.join(images_dir, f"image_{image_id}.png")
+            if not os.path.isfile(png_path):
+                continue
+            name = f"image_{image_id}.webp"
+            if name not in existing:
+                buffered = BytesIO()
+                with Image.open(png_path) as img:
+                    img.save(buffered, format="WEBP", **ARCHIVE_WEBP_OPTIONS)
+                bundle.writestr(name, buffered.getvalue())
+            bundled.append(png_path)
+    return bundled
+
+def archive_finished_games(db_path: str, images_dir: str, archive_dir: Optional[str] = None,
+                           older_than_days: int = ARCHIVE_AFTER_DAYS) -> Dict[str, int]:
+    """Move games finished more than older_than_days ago into per-month archive files.
+
+    Rows are first copied and committed into the archive, then deleted from the live database,
+    so an interruption can leave a game in both places but never in neither. Re-running is safe.
+    """
+    archive_dir = archive_dir or default_archive_dir(db_path)
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime(TIMESTAMP_FORMAT)
+    archived = {}
+    with closing(sqlite3.connect(db_path)) as conn:
+        rows = conn.execute("SELECT Id, substr(Finished_At, 1, 7) FROM Game WHERE Finished_At < ?", (cutoff,)).fetchall()
+        by_month: Dict[str, List[int]] = {}
+        for game_id, month in rows:
+            by_month.setdefault(month, []).append(game_id)
+
+        for month, game_ids in sorted(by_month.items()):
+            start = time.perf_counter()
+            conn.execute("ATTACH DATABASE ? AS archive", (_open_archive(archive_dir, month),))
+            try:
+                with conn:
+                    _set_batch(conn, game_ids)
+                    image_ids = [row[0] for row in conn.execute(
+                        "SELECT Id FROM main.Images WHERE Game_Id IN (SELECT Game_Id FROM temp.archive_batch)")]
+                    _copy_rows(conn, "main", "archive")
+                bundled = _bundle_images(images_dir, image_bundle_path(archive_dir, month), image_ids)
+                with conn:
+                    _delete_rows(conn, "main")
+                    archived_at = utc_timestamp()
+                    conn.executemany("INSERT OR REPLACE INTO ArchivedGames (Game_Id, Month, Archived_At) VALUES (?, ?, ?)",
+                                     [(game_id, month, archived_at) for game_id in game_ids])
+            finally:
+                conn.execute("DETACH DATABASE archive")
+            for png_path in bundled:
+                os.remove(png_path)
+            archived[month] = len(game_ids)
+            game_logger.info(f"Archived {len(game_ids)} games and {len(bundled)} images for {month} "
+                             f"in {time.perf_counter() - start:.2f}s")
+    return archived
+
+def restore_game(db_path: str, images_dir: str, game_id: int, archive_dir: Optional[str] = None) -> bool:
+    archive_dir = archive_dir or default_archive_dir(db_path)
+    with closing(sqlite3.connect(db_path)) as conn:
+        row = conn.execute("SELECT Month FROM ArchivedGames WHERE Game_Id = ?", (game_id,)).fetchone()
+        if row is None:
+            return False
+        month = row[0]
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_db_path(archive_dir, month),))
+        try:
+            with conn:
+                _set_batch(conn, [game_id])
+                image_ids = [r[0] for r in conn.execute(
+                    "SELECT Id FROM archive.Images WHERE Game_Id IN (SELECT Game_Id FROM temp.archive_batch)")]
+                _copy_rows(conn, "archive", "main")
+            bundle_path = image_bundle_path(archive_dir, month)
+            if os.path.isfile(bundle_path):
+                with zipfile.ZipFile(bundle_path) as bundle:
+                    names = set(bundle.namelist())
+                    for image_id in image_ids:
+                        name = f"image_{image_id}.webp"
+                        if name in names:
+                            with Image.open(BytesIO(bundle.read(name))) as img:
+                                img.save(os.path.join(images_dir, f"image_{image_id}.png"), format="PNG")
+            with conn:
+                _delete_rows(conn, "archive")
+                conn.execute("DELETE FROM ArchivedGames WHERE Game_Id = ?", (game_id,))
+        finally:
+            conn.execute("DETACH DATABASE archive")
+    game_logger.info(f"Restored game {game_id} with {len(image_ids)} images from the {month} archive")
+    return True
+
+def purge_archives(db_path: str, archive_dir: Optional[str] = None,
+                   older_than_days: Optional[int] = RETENTION_DAYS) -> List[str]:
+    """Delete archive months whose newest possible game is older than the retention period."""
+    if older_than_days is None:
+        return []
+    archive_dir = archive_dir or default_archive_dir(db_path)
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime("%Y-%m")
+    with closing(sqlite3.connect(db_path)) as conn:
+        months = [row[0] for row in conn.execute(
+            "SELECT DISTINCT Month FROM ArchivedGames WHERE Month < ? ORDER BY Month", (cutoff,))]
+        for month in months:
+            for path in (archive_db_path(archive_dir, month), image_bundle_path(archive_dir, month)):
+                if os.path.exists(path):
+                    os.remove(path)
+            with conn:
+                conn.execute("DELETE FROM ArchivedGames WHERE Month = ?", (month,))
+            game_logger.info(f"Purged archive for {month}")
+    return months
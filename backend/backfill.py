@@ -0,0 +1,113 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from PIL import Image
+from embeddings import embed_image, get_model, model_version, to_blob
+from image_store import IMAGES_DIR
+from logger import game_logger
+
+# Embeds every image that has no vector of the current model version: the rows send_prompt
+# inserts, images from before embeddings were computed, and images embedded by an older model.
+# Workers decode and embed the PNGs; the parent writes one transaction per batch and then
+# moves the checkpoint, so a stopped run resumes after the last committed batch.
+BACKFILL_BATCH = 256
+CHECKPOINT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Database", "backfill_checkpoint.json")
+
+@dataclass
+class BackfillReport:
+    embedded: int = 0
+    # No PNG on disk, e.g. prompt-only rows or images of archived games
+    missing: int = 0
+    failed: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    workers: int = 1
+    last_id: int = 0
+
+    @property
+    def images_per_second(self) -> float:
+        return self.embedded / self.seconds if self.seconds else 0.0
+
+    @property
+    def images_per_second_per_core(self) -> float:
+        return self.images_per_second / self.workers
+
+def load_checkpoint(version: str, path: str = CHECKPOINT_PATH) -> int:
+    """Last image ID handled by a previous run for this model version, 0 to start over."""
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        checkpoint = json.load(f)
+    return checkpoint["last_id"] if checkpoint.get("version") == version else 0
+
+def save_checkpoint(version: str, last_id: int, path: str = CHECKPOINT_PATH) -> None:
+    partial = path + ".partial"
+    with open(partial, "w") as f:
+        json.dump({"version": version, "last_id": last_id}, f)
+    os.replace(partial, path)
+
+def _embed(image_id: int, path: str) -> Tuple[int, Optional[bytes], Optional[str]]:
+    """Runs in a worker process: (image_id, vector blob or None, error or None)."""
+    if not os.path.exists(path):
+        return image_id, None, None
+    try:
+        with Image.open(path) as img:
+            return image_id, to_blob(embed_image(img)), None
+    except Exception as e:
+        return image_id, None, str(e)
+
+def backfill_embeddings(repo, images_dir: str = IMAGES_DIR, workers: Optional[int] = None,
+                        batch_size: int = BACKFILL_BATCH, checkpoint_path: str = CHECKPOINT_PATH,
+                        restart: bool = False, limit: Optional[int] = None) -> BackfillReport:
+    """Embed images missing a vector of the current model version, `workers` processes at a time
+    (default: one per core). While one batch is written the next one is already being embedded.
+    Workers use the model registered at import time; a model set with set_model() only reaches
+    them when processes are forked."""
+    version, dim = model_version(), get_model().dim
+    workers = workers or os.cpu_count() or 1
+    report = BackfillReport(workers=workers, last_id=0 if restart else load_checkpoint(version, checkpoint_path))
+    game_logger.info(f"Backfilling {version} embeddings after image {report.last_id} with {workers} workers")
+    start = time.perf_counter()
+    queued = 0
+
+    def next_batch(after_id: int) -> List[int]:
+        nonlocal queued
+        size = batch_size if limit is None else min(batch_size, limit - queued)
+        batch = repo.list_images_to_embed(version, after_id, size) if size > 0 else []
+        queued += len(batch)
+        return batch
+
+    def submit(batch: List[int]):
+        paths = [os.path.join(images_dir, f"image_{image_id}.png") for image_id in batch]
+        return pool.map(_embed, batch, paths, chunksize=max(1, len(batch) // (4 * workers)))
+
+    with ProcessPoolExecutor(workers) as pool:
+        batch = next_batch(report.last_id)
+        pending = submit(batch)
+        while batch:
+            upcoming = next_batch(batch[-1])
+            upcoming_pending = submit(upcoming)
+            results, pending = list(pending), upcoming_pending
+            with repo.transaction() as conn:
+                for image_id, blob, error in results:
+                    if blob is not None:
+                        repo.insert_vector(image_id, blob, dim, version, conn)
+                        report.embedded += 1
+                    elif error is None:
+                        report.missing += 1
+                    else:
+                        report.failed += 1
+                        game_logger.warning(f"Could not embed image {image_id}: {error}")
+            save_checkpoint(version, batch[-1], checkpoint_path)
+            report.last_id = batch[-1]
+            report.batches += 1
+            report.seconds = time.perf_counter() - start
+            game_logger.info(f"Backfill through image {report.last_id}: {report.embedded} embedded, "
+                             f"{report.missing} missing, {report.failed} failed, "
+                             f"{report.images_per_second:.1f} images/s ({report.images_per_second_per_core:.1f} per core)")
+            batch = upcoming
+    report.seconds = time.perf_counter() - start
+    return report
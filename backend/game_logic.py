@@ -1,13 +1,27 @@
 import threading
-from image_generation import generate_image, generate_prompt 
+from image_generation import generate_image, generate_prompt, reuse_image
 from enum import Enum, auto
-from typing import Dict, List, Optional
-from dataclasses import dataclass
-import sqlite3
+from typing import Callable, Dict, List, Optional, Tuple
+from dataclasses import asdict, dataclass
 import hashlib
 import os
 import logging
 from logger import game_logger
+from sharding import open_repository
+from persistence import PersistenceWriter, DEFAULT_DURABILITY
+from image_store import image_path, image_ref
+from ratings import update_game
+from embeddings import to_blob, model_version, cosine_similarities
+from perceptual_hash import DUPLICATE_DISTANCE, HashIndex, hamming
+from text_embeddings import embed_prompts, text_model_version
+from prompt_similarity import TfidfModel
+import minhash
+from minhash import COPY_THRESHOLD, PromptMatch
+import numpy as np
+
+# Weight of the automatic similarity score next to the votes. With 1.0, an image identical to the
+# target earns as many points as getting every other player's vote; 0 keeps scoring to votes only.
+DEFAULT_SIMILARITY_WEIGHT = 0.0
 
 class GameStatus(Enum):
     SETUP = auto()
@@ -21,20 +35,31 @@ class GameStatus(Enum):
 @dataclass
 class ImgPrompt:
     prompt: str = ""
-    img: Optional[str] = None
+    image_id: Optional[int] = None
 
 @dataclass
 class Player:
     id: int
     name: str
-    score: int = 0
+    score: float = 0
     imgP: Optional[ImgPrompt] = None
     sendPrompt: bool = False
     vote: Optional[int] = None
+    similarity: Optional[float] = None
+    # TF-IDF similarity of the prompt to the round's target prompt
+    prompt_similarity: Optional[float] = None
+    # ID of an earlier player in the round whose image is a near-duplicate of this one
+    duplicate_of: Optional[int] = None
+    # Closest earlier image, from a past round or game, that this round's image nearly repeats
+    repeats_image: Optional[int] = None
+    # Earlier prompt (this round or any past one) that this round's prompt nearly repeats
+    copied_prompt: Optional[PromptMatch] = None
 
 class Game:
-    def __init__(self, n_players: int, db_path: str):
-        game_logger.info(f"Initializing game with {n_players} players and database at {db_path}")
+    def __init__(self, n_players: int, database_url: str, durability: str = DEFAULT_DURABILITY, shards: int = 0,
+                 similarity_weight: float = DEFAULT_SIMILARITY_WEIGHT, reuse_images: bool = False,
+                 copy_threshold: float = COPY_THRESHOLD):
+        game_logger.info(f"Initializing game with {n_players} players and database at {database_url}")
         self.status: GameStatus = GameStatus.SETUP
         self.players: Dict[int, Player] = {}
         self.current_round: int = 0
@@ -42,55 +67,70 @@ class Game:
         self.initImgPrompt: Optional[ImgPrompt] = None
         self.n_players: int = n_players
         self.votes: Dict[int, int] = {}
-        self.lock = threading.Lock()
-        self.db_path = db_path
+        self.round_results: List[Dict[str, any]] = []
+        # Blends the automatic image similarity into the score, see tally_votes
+        self.similarity_weight: float = similarity_weight
+        # Embeddings of this round's images, by image ID
+        self.image_vectors: Dict[int, np.ndarray] = {}
+        # Prompts of this round's generated images (target and players), by image ID
+        self.round_prompts: Dict[int, str] = {}
+        # pHashes of this round's images, by image ID
+        self.image_phashes: Dict[int, int] = {}
+        # pHashes of every image, flag_duplicates looks up past near-duplicates; the server loads the history into it
+        self.hash_index = HashIndex()
+        # Scores prompts against the target prompt; the server loads (or fits) it in the background
+        self.prompt_model: Optional[TfidfModel] = None
+        # MinHash similarity from which a prompt is flagged as copied
+        self.copy_threshold: float = copy_threshold
+        # MinHash signatures of this round's prompts, by user ID; their database rows may still be queued
+        self.round_signatures: Dict[int, np.ndarray] = {}
+        # Serve the earlier image for a prompt that was already generated instead of paying again
+        self.reuse_images: bool = reuse_images
+        # Called with (image_id, vector) for every new embedding, e.g. the ANN index and the vector store
+        self.vector_listeners: List[Callable[[int, np.ndarray], None]] = []
+        # Re-entrant: tally_votes resets the round while still holding the lock
+        self.lock = threading.RLock()
+        self.repo = open_repository(database_url, shards)
+        applied = self.repo.migrate()
+        if applied:
+            game_logger.info(f"Applied database migrations: {applied}")
+        # Writes nobody waits on go through the write-behind queue
+        self.writer = PersistenceWriter(self.repo, durability)
         self.game_id: Optional[int] = None
+        # Incremented on every client-visible state change, lets readers cache per version
+        self.version: int = 0
 
-    def _get_db_connection(self):
-        game_logger.debug("Getting database connection")
-        return sqlite3.connect(self.db_path)
+    def _bump_version(self) -> None:
+        # Must be called with self.lock held
+        self.version += 1
 
     def ensure_game_exists(self):
         game_logger.info("Ensuring game exists")
         if self.game_id is None:
-            with self._get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("INSERT INTO Game (Winner_Id) VALUES (NULL)")
-                self.game_id = cursor.lastrowid
-                conn.commit()
+            self.game_id = self.repo.create_game()
             game_logger.info(f"Created new game with ID: {self.game_id}")
 
-    def insert_into_index(self, prompt, path, user_id="0", vector_embeddings=""):
+    def insert_into_index(self, prompt, user_id="0", vector_embeddings=None, hashes=None):
         try:
-            with self._get_db_connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute("""
-                    INSERT INTO Images (Prompt, Game_Id, User_Id)
-                    VALUES (?, ?, ?)
-                """, (prompt, self.game_id, user_id))
-                
-                image_id = cursor.lastrowid
-                
-                vector_embeddings = b'sample_vector_data'  # Replace with actual vector data
-                
-                # Insert into VectorIndex table
-                cursor.execute("""
-                    INSERT INTO VectorIndex (Vector_embeddings, Image_Id)
-                    VALUES (?, ?)
-                """, (vector_embeddings, image_id))
-                
-                vector_id = cursor.lastrowid
-                
-                # Update Images table with Vector_Id
-                cursor.execute("""
-                    UPDATE Images
-                    SET Vector_Id = ?
-                    WHERE Id = ?
-                """, (vector_id, image_id))
-                
-                conn.commit()
-                return image_id, vector_id
+            # The image ID names the image file, so this insert has to happen right away
+            image_id = self.repo.insert_image(prompt, self.game_id, user_id)
+            self.round_prompts[image_id] = prompt
+            
+            if vector_embeddings is not None:
+                self.image_vectors[image_id] = vector_embeddings
+                for listener in self.vector_listeners:
+                    try:
+                        listener(image_id, vector_embeddings)
+                    except Exception as e:
+                        game_logger.error(f"Vector listener failed for image {image_id}: {str(e)}")
+                blob, dim, version = to_blob(vector_embeddings), len(vector_embeddings), model_version()
+                self.writer.submit(lambda conn: self.repo.insert_vector(image_id, blob, dim, version, conn))
+            if hashes is not None:
+                dhash, phash = hashes
+                self.image_phashes[image_id] = phash
+                self.hash_index.add(image_id, phash)
+                self.writer.submit(lambda conn: self.repo.set_image_hashes(image_id, dhash, phash, conn))
+            return image_id
         except Exception as e:
             game_logger.error(f"Error inserting into index: {str(e)}")
             raise
@@ -108,19 +148,15 @@ class Game:
             self.ensure_game_exists()
             
             try:
-                with self._get_db_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT Name FROM Users WHERE Id = ?", (user_id,))
-                    result = cursor.fetchone()
-                    if not result:
-                        game_logger.warning(f"Invalid user ID: {user_id}")
-                        raise ValueError("Invalid user ID")
-                    
-                    player_name = result[0]
-                    self.players[user_id] = Player(id=user_id, name=player_name)
-                    
-                    cursor.execute("INSERT INTO GameParticipants (Game_Id, User_Id) VALUES (?, ?)", (self.game_id, user_id))
-                    conn.commit()
+                player_name = self.repo.get_user_name(user_id)
+                if player_name is None:
+                    game_logger.warning(f"Invalid user ID: {user_id}")
+                    raise ValueError("Invalid user ID")
+                
+                self.players[user_id] = Player(id=user_id, name=player_name)
+                
+                game_id = self.game_id
+                self.writer.submit(lambda conn: self.repo.add_participant(game_id, user_id, conn))
                 game_logger.info(f"Added player {player_name} (ID: {user_id}) to game {self.game_id}")
             except Exception as e:
                 game_logger.error(f"Error adding player: {str(e)}")
@@ -129,38 +165,38 @@ class Game:
             if len(self.players) == self.n_players:
                 self.status = GameStatus.GENERATING_INITIAL_IMAGE
                 game_logger.info("All players added, moving to GENERATING_INITIAL_IMAGE status")
+            self._bump_version()
             
             return user_id
 
+    def register_user(self, username: str, password: str) -> int:
+        game_logger.info(f"Registering user: {username}")
+        try:
+            user_id = self.repo.create_user(username, password)
+        except ValueError:
+            game_logger.warning(f"Username already taken: {username}")
+            raise
+        game_logger.info(f"Registered user {username} with ID: {user_id}")
+        return user_id
+
     def login(self, username: str, password: str) -> Optional[int]:
         game_logger.info(f"Login attempt for user: {username}")
         hashed_password = hashlib.sha256(password.encode()).hexdigest()
         hashed_password = password  # Note: This line seems to override the hashing. Consider removing if not intended.
 
-        with self._get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT Id FROM Users WHERE Name = ? AND Password = ?",
-                (username, hashed_password)
-            )
-            result = cursor.fetchone()
-            
-            if result:
-                user_id = result[0]
-                game_logger.info(f"Successful login for user: {username} (ID: {user_id})")
-                return user_id
-            else:
-                game_logger.warning(f"Failed login attempt for user: {username}")
-                return None
+        user_id = self.repo.find_user(username, hashed_password)
+        if user_id:
+            game_logger.info(f"Successful login for user: {username} (ID: {user_id})")
+            return user_id
+        else:
+            game_logger.warning(f"Failed login attempt for user: {username}")
+            return None
 
     def user_exists(self, user_id):
         game_logger.debug(f"Checking if user exists: {user_id}")
-        with self._get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1 FROM Users WHERE Id = ?", (user_id,))
-            exists = cursor.fetchone() is not None
-            game_logger.debug(f"User {user_id} exists: {exists}")
-            return exists
+        exists = self.repo.user_exists(user_id)
+        game_logger.debug(f"User {user_id} exists: {exists}")
+        return exists
 
     def generate_initial_image(self) -> None:
         game_logger.info("Generating initial image")
@@ -168,9 +204,12 @@ class Game:
             if self.status != GameStatus.GENERATING_INITIAL_IMAGE:
                 game_logger.warning(f"Cannot generate initial image at this stage. Current status: {self.status}")
                 raise ValueError("Cannot generate initial image at this stage")
-            img = generate_image(generate_prompt(), self.insert_into_index, 0) 
-            self.initImgPrompt = ImgPrompt("Initial prompt", img)
+            prompt = generate_prompt()
+            image_id = generate_image(prompt, self.insert_into_index, 0)
+            # The target prompt stays on the server: clients only ever get the image
+            self.initImgPrompt = ImgPrompt(prompt, image_id)
             self.status = GameStatus.PROMPTING_PLAYERS
+            self._bump_version()
             game_logger.info("Initial image generated, moving to PROMPTING_PLAYERS status")
 
     def send_prompt(self, user_id: int, player_prompt: str) -> None:
@@ -185,17 +224,36 @@ class Game:
             player = self.players[user_id]
             player.imgP = ImgPrompt(player_prompt)
             player.sendPrompt = True
+            signature = minhash.signatures([player_prompt])[0]
+            player.copied_prompt = self.find_copied_prompt(user_id, signature)
+            self.round_signatures[user_id] = signature
             
-            with self._get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("INSERT INTO Images (Prompt, Game_Id, User_Id) VALUES (?, ?, ?)", 
-                               (player_prompt, self.game_id, user_id))
-                conn.commit()
-            game_logger.info(f"Prompt saved for user {user_id}")
+            game_id = self.game_id
+            def persist_prompt(conn):
+                image_id = self.repo.insert_image(player_prompt, game_id, user_id, conn)
+                self.repo.insert_prompt_signatures(minhash.signature_rows([image_id], signature[None, :]), conn)
+            self.writer.submit(persist_prompt)
+            game_logger.info(f"Prompt queued for saving for user {user_id}")
             
             if self.all_prompts_sent():
                 self.status = GameStatus.GENERATING_PLAYER_IMAGES
                 game_logger.info("All prompts sent, moving to GENERATING_PLAYER_IMAGES status")
+            self._bump_version()
+
+    def find_copied_prompt(self, user_id: int, signature: np.ndarray) -> Optional[PromptMatch]:
+        """Closest earlier prompt at or above copy_threshold, from the LSH index or another player this round."""
+        match = minhash.find_copy(self.repo, signature, self.copy_threshold)
+        others = [(other_id, other) for other_id, other in self.round_signatures.items()
+                  if other_id != user_id and not minhash.is_empty(other)]
+        if others and not minhash.is_empty(signature):
+            scores = minhash.similarities(signature, np.stack([other for _, other in others]))
+            best = int(np.argmax(scores))
+            # Prompt rows of this round are not written yet, hence no image ID
+            if scores[best] >= self.copy_threshold and (match is None or scores[best] >= match.similarity):
+                match = PromptMatch(None, others[best][0], round(float(scores[best]), 4))
+        if match is not None:
+            game_logger.info(f"Prompt repeats user {match.user_id}'s prompt (similarity {match.similarity})")
+        return match
 
     def generate_player_images(self) -> None:
         game_logger.info("Generating player images")
@@ -205,13 +263,85 @@ class Game:
                 raise ValueError("Cannot generate player images at this stage")
             for player in self.players.values():
                 if player.imgP and player.imgP.prompt:
-                    img = generate_image(player.imgP.prompt, self.insert_into_index, player.id)
-                    player.imgP.img = img
+                    player.imgP.image_id = self._player_image(player)
                     game_logger.debug(f"Generated image for player {player.id}")
-                    # TODO: Generate vector embeddings for the image
+            self.score_similarity()
+            self.score_prompts()
+            self.flag_duplicates()
+            self.embed_round_prompts()
             self.status = GameStatus.VOTING
+            self._bump_version()
             game_logger.info("All player images generated, moving to VOTING status")
 
+    def _player_image(self, player: Player) -> int:
+        if self.reuse_images:
+            source = self.repo.find_image_by_prompt(player.imgP.prompt)
+            if source is not None and os.path.exists(image_path(source)):
+                return reuse_image(source, player.imgP.prompt, self.insert_into_index, player.id)
+        return generate_image(player.imgP.prompt, self.insert_into_index, player.id)
+
+    def embed_round_prompts(self) -> None:
+        """Embed the round's prompts in one batch and queue them for PromptVectors."""
+        image_ids = list(self.round_prompts)
+        if not image_ids:
+            return
+        try:
+            vectors = embed_prompts([self.round_prompts[image_id] for image_id in image_ids])
+        except Exception as e:
+            game_logger.warning(f"Could not embed prompts, skipping: {str(e)}")
+            return
+        version, dim = text_model_version(), vectors.shape[1]
+        rows = [(image_id, to_blob(vector), dim, version) for image_id, vector in zip(image_ids, vectors)]
+        self.writer.submit(lambda conn: self.repo.insert_prompt_vectors(rows, conn))
+
+    def flag_duplicates(self) -> None:
+        """Mark players whose image is a near-duplicate of an earlier player's image this round,
+        or of any image from the history in hash_index."""
+        seen: List[Tuple[int, int]] = []
+        for player in self.players.values():
+            player.duplicate_of = None
+            player.repeats_image = None
+            phash = self.image_phashes.get(player.imgP.image_id) if player.imgP else None
+            if phash is None:
+                continue
+            # This round's images are in the index too, they are compared below
+            player.repeats_image = next((image_id for image_id, _ in self.hash_index.near(phash)
+                                         if image_id not in self.image_phashes), None)
+            if player.repeats_image is not None:
+                game_logger.info(f"Image of player {player.id} is a near-duplicate of earlier image {player.repeats_image}")
+            player.duplicate_of = next((other_id for other_id, other in seen if hamming(phash, other) <= DUPLICATE_DISTANCE), None)
+            if player.duplicate_of is not None:
+                game_logger.info(f"Image of player {player.id} is a near-duplicate of player {player.duplicate_of}'s")
+            seen.append((player.id, phash))
+
+    def score_similarity(self) -> None:
+        """Cosine similarity of every player image to the round's initial image, in one pass."""
+        target = self.image_vectors.get(self.initImgPrompt.image_id) if self.initImgPrompt else None
+        scored = [player for player in self.players.values()
+                  if player.imgP and player.imgP.image_id in self.image_vectors]
+        for player in self.players.values():
+            player.similarity = None
+        if target is None or not scored:
+            game_logger.warning("No embeddings available, skipping similarity scoring")
+            return
+        similarities = cosine_similarities(target, np.stack([self.image_vectors[p.imgP.image_id] for p in scored]))
+        for player, similarity in zip(scored, similarities.tolist()):
+            player.similarity = round(similarity, 4)
+        game_logger.info(f"Similarity to the initial image: { {p.id: p.similarity for p in scored} }")
+
+    def score_prompts(self) -> None:
+        """TF-IDF similarity of every player's prompt to the round's target prompt, in one pass."""
+        scored = [player for player in self.players.values() if player.imgP and player.imgP.prompt]
+        for player in self.players.values():
+            player.prompt_similarity = None
+        if self.prompt_model is None or not self.initImgPrompt or not scored:
+            game_logger.warning("No TF-IDF vocabulary or prompts, skipping prompt scoring")
+            return
+        similarities = self.prompt_model.score_round(self.initImgPrompt.prompt, [p.imgP.prompt for p in scored])
+        for player, similarity in zip(scored, similarities.tolist()):
+            player.prompt_similarity = round(similarity, 4)
+        game_logger.info(f"Prompt similarity to the target: { {p.id: p.prompt_similarity for p in scored} }")
+
     def cast_vote(self, voter_id: int, voted_for_id: int) -> bool:
         game_logger.info(f"Casting vote: voter {voter_id} for player {voted_for_id}")
         with self.lock:
@@ -234,27 +364,53 @@ class Game:
             if self.all_votes_cast():
                 self.status = GameStatus.TALLYING_VOTES
                 game_logger.info("All votes cast, moving to TALLYING_VOTES status")
+            self._bump_version()
             return True
 
-    def tally_votes(self) -> Optional[int]:
+    def round_winner(self) -> Tuple[int, bool]:
+        """(winner_id, tied) of the votes cast. A tie goes to the tied player whose image is most
+        similar to the target, then to the one who joined first, so every round has a winner."""
+        most = max(self.votes.values())
+        tied = [player_id for player_id in self.players if self.votes.get(player_id, 0) == most]
+        if len(tied) == 1:
+            return tied[0], False
+        similarity = {player_id: self.players[player_id].similarity for player_id in tied}
+        winner_id = max(tied, key=lambda player_id: similarity[player_id] if similarity[player_id] is not None else -2.0)
+        game_logger.info(f"Voting tied between players {tied}, player {winner_id} wins on similarity or join order")
+        return winner_id, True
+
+    def tally_votes(self) -> int:
         game_logger.info("Tallying votes")
         with self.lock:
             if self.status != GameStatus.TALLYING_VOTES:
                 game_logger.warning(f"Cannot tally votes at this stage. Current status: {self.status}")
                 raise ValueError("Cannot tally votes at this stage")
-            
-            winner_id = max(self.votes, key=self.votes.get)
-            winner_votes = self.votes[winner_id]
 
-            # Check for a tie
-            if list(self.votes.values()).count(winner_votes) > 1:
-                game_logger.info("Voting resulted in a tie")
-                return None  # Tie, no clear winner
+            winner_id, tied = self.round_winner()
 
             # Update scores
             for player_id, vote_count in self.votes.items():
                 self.players[player_id].score += vote_count
                 game_logger.debug(f"Updated score for player {player_id}: {self.players[player_id].score}")
+            if self.similarity_weight:
+                max_points = self.similarity_weight * (len(self.players) - 1)
+                for player in self.players.values():
+                    if player.similarity is not None:
+                        player.score = round(player.score + max_points * max(player.similarity, 0.0), 2)
+
+            self.round_results.append({"game_id": self.game_id, "round": self.current_round, "winner_id": winner_id,
+                                       "tie": tied, "votes": dict(self.votes),
+                                       "similarity": {pid: player.similarity for pid, player in self.players.items()},
+                                       "prompt_similarity": {pid: player.prompt_similarity for pid, player in self.players.items()}})
+
+            # The whole round goes to the ledger as one queued write, after /send_vote has answered
+            game_id, round_number = self.game_id, self.current_round
+            ballots = [(player.id, player.vote) for player in self.players.values() if player.vote is not None]
+            tallies = {player_id: self.votes.get(player_id, 0) for player_id in self.players}
+            def persist_round(conn):
+                self.repo.record_round(game_id, round_number, ballots, tallies, winner_id, conn)
+                self.repo.add_round_stats(tallies, winner_id, conn)
+            self.writer.submit(persist_round)
 
             # Reset votes for next round
             self.votes.clear()
@@ -262,6 +418,7 @@ class Game:
                 player.vote = None
 
             self.current_round += 1
+            self._bump_version()
             game_logger.info(f"Round {self.current_round} completed. Winner: Player {winner_id}")
             self.reset_for_next_round()
             return winner_id
@@ -278,16 +435,29 @@ class Game:
                 for player in self.players.values():
                     player.sendPrompt = False
                     player.imgP = None
+                    player.copied_prompt = None
                 self.initImgPrompt = None
+                self.image_vectors.clear()
+                self.image_phashes.clear()
+                self.round_prompts.clear()
+                self.round_signatures.clear()
                 game_logger.info("Reset complete, moving to GENERATING_INITIAL_IMAGE status")
+            self._bump_version()
 
     def end_game(self) -> None:
         game_logger.info("Ending game")
         winner_id = max(self.players.values(), key=lambda p: p.score).id
-        with self._get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE Game SET Winner_Id = ? WHERE Id = ?", (winner_id, self.game_id))
-            conn.commit()
+        game_id = self.game_id
+        player_ids = list(self.players)
+        rounds = [{player_id: result["votes"].get(player_id, 0) for player_id in player_ids}
+                  for result in self.round_results if result["game_id"] == game_id]
+        def persist_result(conn):
+            self.repo.set_winner(game_id, winner_id, conn)
+            self.repo.add_game_stats(player_ids, winner_id, conn)
+            # Read and write in the writer's transaction, so concurrent game ends cannot interleave
+            current = {user_id: rating for user_id, (rating, _) in self.repo.get_ratings(player_ids, conn).items()}
+            self.repo.save_game_ratings(update_game(current, rounds), conn)
+        self.writer.submit(persist_result)
         game_logger.info(f"Game ended. Winner: Player {winner_id}")
 
     def get_final_results(self) -> List[Dict[str, any]]:
@@ -318,19 +488,73 @@ class Game:
                 "number_of_players": len(self.players),
                 "current_round": self.current_round,
                 "max_rounds": self.max_rounds,
+                "version": self.version,
             }
             game_logger.debug(f"Game status: {status}")
             return status
 
-    def get_initial_image(self) -> Optional[str]:
+    def get_player_state(self, player_id: Optional[int] = None) -> Dict[str, any]:
+        """Everything a client screen needs in one snapshot; player fields are omitted for spectators."""
         with self.lock:
-            image = self.initImgPrompt.img if self.initImgPrompt else None
-            game_logger.debug(f"Initial image retrieved: {'Yes' if image else 'No'}")
-            return image
+            state = {
+                "game_id": self.game_id,
+                "status": self.status.name,
+                "version": self.version,
+                "number_of_players": len(self.players),
+                "current_round": self.current_round,
+                "max_rounds": self.max_rounds,
+                "initial_image": image_ref(self.initImgPrompt.image_id) if self.initImgPrompt else None,
+                "player_images": None,
+                "similarity": None,
+                "prompt_similarity": None,
+                "duplicates": None,
+                "repeated_images": None,
+                "copied_prompts": None,
+                "similarity_weight": self.similarity_weight,
+                "last_round": self.round_results[-1] if self.round_results else None,
+                "final_results": None,
+                "player": None,
+            }
+            if self.status == GameStatus.VOTING:
+                state["player_images"] = {pid: image_ref(player.imgP.image_id if player.imgP else None)
+                                          for pid, player in self.players.items()}
+                state["similarity"] = {pid: player.similarity for pid, player in self.players.items()}
+                state["prompt_similarity"] = {pid: player.prompt_similarity for pid, player in self.players.items()}
+                state["duplicates"] = {pid: player.duplicate_of for pid, player in self.players.items()
+                                       if player.duplicate_of is not None}
+                state["repeated_images"] = {pid: player.repeats_image for pid, player in self.players.items()
+                                            if player.repeats_image is not None}
+                state["copied_prompts"] = {pid: asdict(player.copied_prompt) for pid, player in self.players.items()
+                                           if player.copied_prompt is not None}
+            if self.status == GameStatus.DISPLAYING_RESULTS:
+                state["final_results"] = self.get_final_results()
+            player = self.players.get(player_id)
+            if player is not None:
+                state["player"] = {
+                    "id": player.id,
+                    "name": player.name,
+                    "score": player.score,
+                    "has_submitted": player.sendPrompt,
+                    "has_voted": player.vote is not None,
+                    "voted_for": player.vote,
+                }
+            return state
 
-    def get_player_images(self) -> Dict[int, Optional[str]]:
+    def get_initial_image(self) -> Optional[int]:
         with self.lock:
-            images = {player_id: player.imgP.img if player.imgP else None 
+            image_id = self.initImgPrompt.image_id if self.initImgPrompt else None
+            game_logger.debug(f"Initial image retrieved: {'Yes' if image_id is not None else 'No'}")
+            return image_id
+
+    def get_player_images(self) -> Dict[int, Optional[int]]:
+        with self.lock:
+            images = {player_id: player.imgP.image_id if player.imgP else None
                       for player_id, player in self.players.items()}
             game_logger.debug(f"Player images retrieved: {len(images)}")
             return images
+
+    def get_round_images(self) -> Tuple[Optional[int], int, Dict[int, Optional[int]]]:
+        with self.lock:
+            images = {player_id: player.imgP.image_id if player.imgP else None
+                      for player_id, player in self.players.items()}
+            return self.game_id, self.current_round, images
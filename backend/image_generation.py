@@ -1,12 +1,15 @@
 from PIL import Image
 import requests
-import base64
-from io import BytesIO
 import random
+import threading
 from langchain_ollama import OllamaLLM
 import os
 import logging
 from logger import ai_logger
+from image_store import image_path, pregenerate_derivatives
+from embeddings import embed_image, model_version
+from perceptual_hash import image_hashes
+import numpy as np
 
 LOCAL_IMAGE = False
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
@@ -40,14 +43,15 @@ def generate_prompt() -> str:
 def get_random_elements(list_of_elements, num=1):
     return random.sample(list_of_elements, min(num, len(list_of_elements)))
 
-def get_vector_embeddings(prompt):
-    pass #TODO
+def get_vector_embeddings(img: Image.Image) -> np.ndarray:
+    vector = embed_image(img)
+    ai_logger.info(f"Computed {model_version()} embedding with {len(vector)} dimensions")
+    return vector
 
-def generate_image(prompt: str, insert_index, user_id: int) -> str:
+def generate_image(prompt: str, insert_index, user_id: int) -> int:
     ai_logger.info(f"LOCAL_IMAGE is set to {LOCAL_IMAGE}")
     if LOCAL_IMAGE:
-        img = Image.open(path)
-        path = "../rawr.jpg" 
+        img = Image.open("../rawr.jpg")
     else:
         response = requests.post(
             "https://api.openai.com/v1/images/generations",
@@ -67,25 +71,34 @@ def generate_image(prompt: str, insert_index, user_id: int) -> str:
         ai_logger.info(response.headers)
         image_url = response.json()['data'][0]['url']
         img = Image.open(requests.get(image_url, stream=True).raw)
-        path = f"Images/image_{user_id}.png"
-        img.save(path)
-        ai_logger.info(f"Image has been saved")
 
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    
+    return store_image(img, prompt, insert_index, user_id)
+
+def reuse_image(source_id: int, prompt: str, insert_index, user_id: int) -> int:
+    """Store a copy of an earlier image under a new ID instead of paying for a new generation."""
+    with Image.open(image_path(source_id)) as source:
+        img = source.copy()
+    ai_logger.info(f"Reusing image {source_id} for prompt: {prompt}")
+    return store_image(img, prompt, insert_index, user_id)
+
+def store_image(img: Image.Image, prompt: str, insert_index, user_id: int) -> int:
     ai_logger.info(f"Inserting into index")
-    insert_index(prompt, path, user_id)
-    
-    return img_str
+    image_id = insert_index(prompt, user_id, get_vector_embeddings(img), image_hashes(img))
+
+    path = image_path(image_id)
+    img.save(path, format="PNG")
+    ai_logger.info(f"Image {image_id} has been saved to {path}")
+    threading.Thread(target=pregenerate_derivatives, args=(image_id,), daemon=True).start()
+
+    return image_id
 
 if __name__ == "__main__":
     prompt = generate_prompt()
     print(f"Generated prompt: {prompt}")
     
-    def dummy_func(prompt, path, user_id):
-        print(f"Image saved at {path} for user {user_id}")
+    def dummy_func(prompt, user_id, vector_embeddings, hashes):
+        print(f"Indexing image for user {user_id}")
+        return 12345
     
-    image_str = generate_image(prompt, dummy_func, 12345)
-    print(f"Generated image string (base64): {image_str[:50]}...")
+    image_id = generate_image(prompt, dummy_func, 12345)
+    print(f"Generated image saved at {image_path(image_id)}")
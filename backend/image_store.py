@@ -0,0 +1,168 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import List, Optional, Tuple
+from PIL import Image
+from logger import ai_logger
+
+IMAGES_DIR = "Images"
+
+# Generated images never change once written, so clients may cache them forever
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Derivatives: ?format= name -> (Pillow format, mimetype, save options)
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+    "avif": ("AVIF", "image/avif", {"quality": 60}),
+    "png": ("PNG", "image/png", {"optimize": True}),
+}
+DEFAULT_DERIVATIVE_FORMAT = "webp"
+MIN_DERIVATIVE_WIDTH = 16
+MAX_DERIVATIVE_WIDTH = 1024
+# Tile sizes used by the voting grid, rendered as soon as an image is created
+TILE_WIDTHS = (256, 512)
+DERIVATIVE_CACHE_BYTES = 64 * 1024 * 1024
+
+def image_path(image_id: int) -> str:
+    return os.path.join(IMAGES_DIR, f"image_{image_id}.png")
+
+def image_url(image_id: int) -> str:
+    return f"/images/{image_id}"
+
+def image_ref(image_id: Optional[int]) -> Optional[dict]:
+    if image_id is None:
+        return None
+    return {"image_id": image_id, "url": image_url(image_id)}
+
+def supported_formats() -> list:
+    Image.init()
+    return [name for name, (pil_format, _, _) in DERIVATIVE_FORMATS.items() if pil_format in Image.SAVE]
+
+class DerivativeCache:
+    """LRU cache of encoded derivatives, bounded by the total size of the stored bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key) -> Optional[bytes]:
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def put(self, key, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+derivative_cache = DerivativeCache(DERIVATIVE_CACHE_BYTES)
+
+def parse_derivative_args(width: Optional[str], fmt: Optional[str]) -> Tuple[Optional[int], str]:
+    fmt = (fmt or DEFAULT_DERIVATIVE_FORMAT).lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in supported_formats():
+        raise ValueError(f"Unsupported image format: {fmt}")
+    if width is None:
+        return None, fmt
+    try:
+        width = int(width)
+    except ValueError:
+        raise ValueError("Width must be an integer")
+    if not MIN_DERIVATIVE_WIDTH <= width <= MAX_DERIVATIVE_WIDTH:
+        raise ValueError(f"Width must be between {MIN_DERIVATIVE_WIDTH} and {MAX_DERIVATIVE_WIDTH}")
+    return width, fmt
+
+def encode_image(img: Image.Image, fmt: str) -> bytes:
+    pil_format, _, options = DERIVATIVE_FORMATS[fmt]
+    if pil_format == "JPEG" and img.mode != "RGB":
+        img = img.convert("RGB")
+    buffered = BytesIO()
+    img.save(buffered, format=pil_format, **options)
+    return buffered.getvalue()
+
+def render_derivative(image_id: int, width: Optional[int], fmt: str) -> bytes:
+    with Image.open(image_path(image_id)) as img:
+        img.load()
+        if width is not None and width < img.width:
+            img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+        return encode_image(img, fmt)
+
+def get_derivative(image_id: int, width: Optional[int], fmt: str) -> Tuple[bytes, str]:
+    key = (image_id, width, fmt)
+    data = derivative_cache.get(key)
+    if data is None:
+        data = render_derivative(image_id, width, fmt)
+        derivative_cache.put(key, data)
+    return data, DERIVATIVE_FORMATS[fmt][1]
+
+def pregenerate_derivatives(image_id: int) -> None:
+    try:
+        for width in TILE_WIDTHS:
+            get_derivative(image_id, width, DEFAULT_DERIVATIVE_FORMAT)
+        ai_logger.info(f"Pre-generated {len(TILE_WIDTHS)} tile derivatives for image {image_id}")
+    except Exception as e:
+        ai_logger.error(f"Error pre-generating derivatives for image {image_id}: {str(e)}")
+
+CONTACT_SHEET_TILE = 256
+CONTACT_SHEET_FORMAT = "webp"
+
+def contact_sheet_layout(entries: List[Tuple[int, int]], tile: int = CONTACT_SHEET_TILE) -> dict:
+    """Grid positions for (player_id, image_id) entries; every tile is a tile x tile box."""
+    columns = max(1, math.ceil(math.sqrt(len(entries))))
+    rows = max(1, math.ceil(len(entries) / columns))
+    tiles = []
+    for index, (player_id, image_id) in enumerate(entries):
+        row, column = divmod(index, columns)
+        tiles.append({"player_id": player_id, "image_id": image_id,
+                      "x": column * tile, "y": row * tile, "w": tile, "h": tile})
+    return {"width": columns * tile, "height": rows * tile, "tiles": tiles}
+
+def render_contact_sheet(layout: dict, fmt: str = CONTACT_SHEET_FORMAT) -> bytes:
+    sheet = Image.new("RGB", (layout["width"], layout["height"]), (0, 0, 0))
+    for tile in layout["tiles"]:
+        # The tile-width derivative is usually already cached from pregenerate_derivatives
+        data, _ = get_derivative(tile["image_id"], tile["w"], DEFAULT_DERIVATIVE_FORMAT)
+        with Image.open(BytesIO(data)) as img:
+            img = img.convert("RGB")
+            img.thumbnail((tile["w"], tile["h"]), Image.LANCZOS)
+            offset = (tile["x"] + (tile["w"] - img.width) // 2, tile["y"] + (tile["h"] - img.height) // 2)
+            sheet.paste(img, offset)
+    return encode_image(sheet, fmt)
+
+class ContactSheetCache:
+    """Holds the contact sheet of the current round only; a new round key replaces it."""
+
+    def __init__(self):
+        self.key = None
+        self.sheet: Optional[Tuple[bytes, dict]] = None
+        self.lock = threading.Lock()
+
+    def get(self, key, entries: List[Tuple[int, int]]) -> Tuple[bytes, dict]:
+        with self.lock:
+            if self.key != key:
+                layout = contact_sheet_layout(entries)
+                self.sheet = (render_contact_sheet(layout), layout)
+                self.key = key
+                ai_logger.info(f"Rendered contact sheet for {key} with {len(entries)} tiles")
+            return self.sheet
+
+contact_sheet_cache = ContactSheetCache()
+
+def contact_sheet_url(game_id: int, round_number: int) -> str:
+    return f"/contact_sheet/{game_id}/{round_number}"
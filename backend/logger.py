@@ -1,4 +1,8 @@
 import logging
+import os
+
+# Relative to this file so modules can be imported from any working directory (e.g. Database/cli.py)
+LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
 
 def setup_logger(name, log_file, level=logging.DEBUG):
     logger = logging.getLogger(name)
@@ -17,10 +21,10 @@ def setup_logger(name, log_file, level=logging.DEBUG):
     return logger
 
 # Configure AI logger
-ai_logger = setup_logger("AI", 'logs/AI.log')
+ai_logger = setup_logger("AI", os.path.join(LOG_DIR, 'AI.log'))
 
 # Configure MainGame logger
-game_logger = setup_logger("MainGame", 'logs/Game.log')
+game_logger = setup_logger("MainGame", os.path.join(LOG_DIR, 'Game.log'))
 
 # Configure Server logger
-server_logger = setup_logger("Server", 'logs/Server.log')
+server_logger = setup_logger("Server", os.path.join(LOG_DIR, 'Server.log'))
@@ -0,0 +1,155 @@
+import glob
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from db import apply_pragmas
+from logger import game_logger
+
+# Seconds between runs of each job
+OPTIMIZE_INTERVAL = 60 * 60
+CHECKPOINT_INTERVAL = 5 * 60
+VACUUM_INTERVAL = 6 * 60 * 60
+BACKUP_INTERVAL = 24 * 60 * 60
+
+# Rows PRAGMA optimize may sample per index, so ANALYZE stays cheap on large tables
+ANALYSIS_LIMIT = 400
+# Free pages returned to the OS per incremental_vacuum run
+VACUUM_PAGES = 1000
+# Once a passive checkpoint has copied everything back, a WAL larger than this is truncated
+WAL_TRUNCATE_PAGES = 10000
+# The backup copies this many pages per step and sleeps between steps, holding the read lock only briefly
+BACKUP_PAGES = 256
+BACKUP_SLEEP = 0.005
+BACKUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Database", "backups")
+BACKUPS_TO_KEEP = 7
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    # Autocommit, so PRAGMAs like wal_checkpoint are never wrapped in a transaction
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    apply_pragmas(conn)
+    return conn
+
+def optimize(conn: sqlite3.Connection, db_path: str) -> str:
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    has_stats = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+    if has_stats:
+        conn.execute("PRAGMA optimize")
+        return "optimized"
+    # First run: optimize only re-analyzes tables that already have statistics
+    conn.execute("ANALYZE")
+    return "analyzed"
+
+def checkpoint(conn: sqlite3.Connection, db_path: str) -> str:
+    # PASSIVE never waits on readers or writers; it copies whatever it can right now
+    busy, wal_pages, copied = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    if wal_pages < 0:
+        return "not in WAL mode"
+    if not busy and copied == wal_pages and wal_pages > WAL_TRUNCATE_PAGES:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return f"{copied}/{wal_pages} pages copied, WAL truncated"
+    return f"{copied}/{wal_pages} pages copied"
+
+def incremental_vacuum(conn: sqlite3.Connection, db_path: str) -> str:
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        return "skipped, auto_vacuum is not INCREMENTAL (run enable-incremental-vacuum once)"
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+    return f"released {min(free_pages, VACUUM_PAGES)} of {free_pages} free pages"
+
+def backup(conn: sqlite3.Connection, db_path: str, backup_dir: str = BACKUP_DIR) -> str:
+    os.makedirs(backup_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(db_path))[0]
+    target = os.path.join(backup_dir, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
+    partial = target + ".partial"
+    with closing(sqlite3.connect(partial)) as dest:
+        conn.backup(dest, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP)
+    os.replace(partial, target)
+    for old in sorted(glob.glob(os.path.join(backup_dir, f"{name}_[0-9]*.db")))[:-BACKUPS_TO_KEEP]:
+        os.remove(old)
+    return f"wrote {target} ({os.path.getsize(target) // 1024} KB)"
+
+def enable_incremental_vacuum(db_path: str) -> None:
+    """One-off: switch the file to auto_vacuum=INCREMENTAL. This rewrites the whole database
+    with VACUUM and blocks writers while it runs, so do it with the server stopped."""
+    with closing(_connect(db_path)) as conn:
+        conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+        conn.execute("VACUUM")
+
+JOBS: Dict[str, Callable[[sqlite3.Connection, str], str]] = {
+    "optimize": optimize,
+    "checkpoint": checkpoint,
+    "incremental_vacuum": incremental_vacuum,
+    "backup": backup,
+}
+INTERVALS = {
+    "optimize": OPTIMIZE_INTERVAL,
+    "checkpoint": CHECKPOINT_INTERVAL,
+    "incremental_vacuum": VACUUM_INTERVAL,
+    "backup": BACKUP_INTERVAL,
+}
+
+@dataclass
+class JobRun:
+    job: str
+    db_path: str
+    started_at: float
+    seconds: float
+    result: str
+    error: Optional[str] = None
+
+def run_job(job: str, db_path: str) -> JobRun:
+    started_at = time.time()
+    start = time.perf_counter()
+    result, error = "", None
+    try:
+        with closing(_connect(db_path)) as conn:
+            result = JOBS[job](conn, db_path)
+    except Exception as e:
+        error = str(e)
+    run = JobRun(job, db_path, started_at, time.perf_counter() - start, result, error)
+    if error:
+        game_logger.error(f"Maintenance {job} on {db_path} failed after {run.seconds * 1000:.1f} ms: {error}")
+    else:
+        game_logger.info(f"Maintenance {job} on {db_path} took {run.seconds * 1000:.1f} ms: {result}")
+    return run
+
+@dataclass
+class MaintenanceDaemon:
+    """Runs the maintenance jobs on their intervals in a background thread.
+    Each job opens its own connection, so request handling never waits on the pools."""
+
+    db_paths: List[str]
+    intervals: Dict[str, float] = field(default_factory=lambda: dict(INTERVALS))
+    last_runs: Dict[str, JobRun] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.stop_event = threading.Event()
+        # Stagger the first runs instead of doing everything at startup
+        now = time.monotonic()
+        self.next_run = {job: now + interval / 10 for job, interval in self.intervals.items()}
+        self.thread = threading.Thread(target=self._run, name="Maintenance", daemon=True)
+
+    def start(self) -> "MaintenanceDaemon":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def _run(self) -> None:
+        while not self.stop_event.is_set():
+            job = min(self.next_run, key=self.next_run.get)
+            if self.stop_event.wait(max(0.0, self.next_run[job] - time.monotonic())):
+                return
+            for db_path in self.db_paths:
+                self.last_runs[f"{job}:{db_path}"] = run_job(job, db_path)
+            self.next_run[job] = time.monotonic() + self.intervals[job]
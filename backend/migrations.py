@@ -0,0 +1,104 @@
+import os
+import re
+import sqlite3
+from typing import List, Tuple
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Database", "migrations")
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# Queries on the request path and in cli.py, with the table each one must reach through an index
+HOT_QUERIES = {
+    "login": ("Users", "SELECT Id FROM Users WHERE Name = ? AND Password = ?"),
+    "user_by_id": ("Users", "SELECT Name FROM Users WHERE Id = ?"),
+    "game_participants": ("GameParticipants", """
+        SELECT Users.Name
+        FROM GameParticipants
+        JOIN Users ON GameParticipants.User_Id = Users.Id
+        WHERE GameParticipants.Game_Id = ?"""),
+    "game_images": ("Images", """
+        SELECT Images.Id, Images.Prompt, Users.Name
+        FROM Images
+        JOIN Users ON Images.User_Id = Users.Id
+        WHERE Images.Game_Id = ?"""),
+    "image_by_prompt": ("Images", "SELECT Id FROM Images WHERE Prompt = ? AND PHash IS NOT NULL ORDER BY Id DESC LIMIT 1"),
+    "prompt_bucket": ("PromptBuckets", "SELECT Image_Id FROM PromptBuckets WHERE Bucket = ?"),
+    "vector_by_image": ("VectorIndex", "SELECT Id, Vector_embeddings FROM VectorIndex WHERE Image_Id = ?"),
+    "user_votes": ("Votes", "SELECT Game_Id, Round, Voted_For_Id FROM Votes WHERE Voter_Id = ? ORDER BY Game_Id DESC, Round"),
+    "round_results": ("RoundResults", "SELECT Round, User_Id, Votes, Won FROM RoundResults WHERE Game_Id = ?"),
+    "leaderboard_page": ("UserStats", """
+        SELECT UserStats.*, Users.Name
+        FROM UserStats
+        JOIN Users ON UserStats.User_Id = Users.Id
+        WHERE (Wins, Votes_Received, UserStats.User_Id) < (?, ?, ?)
+        ORDER BY Wins DESC, Votes_Received DESC, UserStats.User_Id DESC
+        LIMIT 20"""),
+}
+
+class MigrationError(Exception):
+    pass
+
+def _shared_user_names(conn: sqlite3.Connection) -> List[str]:
+    return [f"{name!r} (user IDs {ids})" for name, ids in conn.execute(
+        "SELECT Name, GROUP_CONCAT(Id, ', ') FROM Users GROUP BY Name HAVING COUNT(*) > 1 ORDER BY Name")]
+
+# Checked before a migration is applied: (what must hold, function listing the rows that break it).
+# These are fixed by hand, since only an operator can tell which account should keep a name.
+PRECONDITIONS = {
+    2: ("user names must be unique, rename or merge these accounts", _shared_user_names),
+}
+
+def available_migrations() -> List[Tuple[int, str, str]]:
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(migrations)
+
+def current_version(conn: sqlite3.Connection) -> int:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            Version INTEGER PRIMARY KEY,
+            Name TEXT NOT NULL,
+            Applied_At TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    return conn.execute("SELECT COALESCE(MAX(Version), 0) FROM schema_version").fetchone()[0]
+
+def migrate(conn: sqlite3.Connection) -> List[int]:
+    """Apply every migration newer than the recorded schema version, each in its own transaction."""
+    version = current_version(conn)
+    conn.commit()
+    applied = []
+    for number, name, path in available_migrations():
+        if number <= version:
+            continue
+        if number in PRECONDITIONS:
+            requirement, find_conflicts = PRECONDITIONS[number]
+            conflicts = find_conflicts(conn)
+            if conflicts:
+                raise MigrationError(f"Cannot apply migration {number:04d}_{name}: {requirement}: {'; '.join(conflicts)}")
+        with open(path) as f:
+            script = f.read()
+        try:
+            conn.executescript(
+                f"BEGIN;\n{script}\n"
+                f"INSERT INTO schema_version (Version, Name) VALUES ({number}, '{name}');\n"
+                "COMMIT;"
+            )
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        applied.append(number)
+    return applied
+
+def check_query_plans(conn: sqlite3.Connection) -> List[str]:
+    """Return the names of hot queries whose plan scans their table instead of searching an index."""
+    failures = []
+    for name, (table, sql) in HOT_QUERIES.items():
+        params = (None,) * sql.count("?")
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        if not any(detail.startswith(f"SEARCH {table} USING") for detail in plan):
+            failures.append(f"{name}: {'; '.join(plan)}")
+    return failures
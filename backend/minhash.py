@@ -0,0 +1,170 @@
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from logger import game_logger
+from prompt_similarity import ngram_codes
+
+# MinHash signatures of player prompts, to spot copied and resubmitted ones. The share of equal
+# slots in two signatures estimates the Jaccard similarity of the prompts' character shingles.
+# LSH banding cuts a signature into BANDS bands of ROWS slots and stores one bucket per band in
+# PromptBuckets: prompts sharing any bucket are candidates, so a lookup is BANDS index seeks
+# instead of a scan of Images.Prompt. With 16 bands of 4, a pair at similarity 0.8 shares a
+# bucket with probability ~1, at 0.5 with 0.64, at 0.3 with 0.12.
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# Estimated similarity from which a prompt counts as a copy. Below ~0.5 the banding starts to miss pairs.
+COPY_THRESHOLD = 0.8
+# Candidates scored per lookup, those sharing the most buckets first
+MAX_CANDIDATES = 200
+# Prompts without a single shingle (fewer than SHINGLE_SIZE bytes) get this in every slot and are not indexed
+EMPTY = np.uint32(0xFFFFFFFF)
+# Shingles hashed per pass, bounds the (shingles, NUM_PERM) temporary
+_BLOCK = 1 << 15
+# Fixed seed: signatures are persisted, so the permutations must never change
+_rng = np.random.default_rng(20240824)
+_MULTIPLIERS = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_OFFSETS = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, scrambles n-gram codes and band contents into well-spread 64-bit values."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def signatures(prompts: Sequence[str]) -> np.ndarray:
+    """(len(prompts), NUM_PERM) uint32 signatures. Permutation i maps a shingle to the top half of
+    a * x + b (mod 2^64), a multiply-shift hash; a slot keeps the minimum over the prompt."""
+    result = np.full((len(prompts), NUM_PERM), EMPTY, dtype=np.uint32)
+    rows, codes = ngram_codes(prompts, (SHINGLE_SIZE,))
+    mixed = _mix(codes)
+    with np.errstate(over="ignore"):
+        for start in range(0, len(rows), _BLOCK):
+            block_rows = rows[start:start + _BLOCK]
+            hashes = ((mixed[start:start + _BLOCK, None] * _MULTIPLIERS + _OFFSETS) >> np.uint64(32)).astype(np.uint32)
+            # Rows are ascending, so each prompt is one run; a run cut by the block edge is merged below
+            starts = np.flatnonzero(np.r_[True, block_rows[1:] != block_rows[:-1]])
+            run_rows = block_rows[starts]
+            result[run_rows] = np.minimum(result[run_rows], np.minimum.reduceat(hashes, starts, axis=0))
+    return result
+
+def band_buckets(signature_rows: np.ndarray) -> np.ndarray:
+    """(n, BANDS) bucket keys as signed 64-bit integers, for SQLite. The band number is mixed in,
+    so equal slices in different bands land in different buckets."""
+    bands = np.asarray(signature_rows, dtype=np.uint32).reshape(-1, BANDS, ROWS).astype(np.uint64)
+    keys = np.broadcast_to(_mix(np.arange(1, BANDS + 1, dtype=np.uint64)), bands.shape[:2])
+    with np.errstate(over="ignore"):
+        for j in range(ROWS):
+            keys = _mix(keys ^ bands[:, :, j])
+    return keys.view(np.int64)
+
+def similarities(signature: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Estimated Jaccard similarity of one signature to each of the others."""
+    return (np.asarray(others) == signature).mean(axis=1)
+
+def is_empty(signature: np.ndarray) -> bool:
+    return bool((signature == EMPTY).all())
+
+def to_blob(signature: np.ndarray) -> bytes:
+    return signature.astype("<u4").tobytes()
+
+def from_blobs(blobs: Sequence[bytes]) -> np.ndarray:
+    return np.frombuffer(b"".join(blobs), dtype="<u4").reshape(-1, NUM_PERM)
+
+def signature_rows(image_ids: Sequence[int], signature_matrix: np.ndarray) -> List[Tuple[int, bytes, List[int]]]:
+    """(image_id, signature blob, buckets) rows for insert_prompt_signatures, skipping empty signatures."""
+    buckets = band_buckets(signature_matrix)
+    return [(image_id, to_blob(signature), bucket_row.tolist())
+            for image_id, signature, bucket_row in zip(image_ids, signature_matrix, buckets)
+            if not is_empty(signature)]
+
+@dataclass
+class PromptMatch:
+    # None for a prompt of the current round that is not written yet
+    image_id: Optional[int]
+    user_id: int
+    similarity: float
+
+def find_copy(repo, signature: np.ndarray, threshold: float = COPY_THRESHOLD) -> Optional[PromptMatch]:
+    """The most similar indexed prompt at or above threshold, newest first among equals."""
+    if is_empty(signature):
+        return None
+    candidates = repo.find_prompt_candidates(band_buckets(signature[None, :])[0].tolist(), MAX_CANDIDATES)
+    if not candidates:
+        return None
+    scores = similarities(signature, from_blobs([blob for _, _, blob in candidates]))
+    best = max(range(len(candidates)), key=lambda i: (scores[i], candidates[i][0]))
+    if scores[best] < threshold:
+        return None
+    image_id, user_id, _ = candidates[best]
+    return PromptMatch(image_id, user_id, round(float(scores[best]), 4))
+
+def backfill_signatures(repo, batch_size: int = 1000) -> int:
+    """Sign and index every player prompt that is not indexed yet; returns the count."""
+    after_id, total = 0, 0
+    while True:
+        rows = repo.list_prompts_to_sign(after_id, batch_size)
+        if not rows:
+            return total
+        image_ids = [image_id for image_id, _ in rows]
+        repo.insert_prompt_signatures(signature_rows(image_ids, signatures([prompt for _, prompt in rows])))
+        after_id, total = image_ids[-1], total + len(rows)
+        game_logger.info(f"Indexed prompts through image {after_id} ({total} so far)")
+
+def benchmark(n: int = 1_000_000, queries: int = 1000, seed: int = 0) -> None:
+    """Signing, indexing and lookup times on n synthetic prompts in a scratch SQLite database,
+    against a NumPy scan over all signatures. Half the queries are edited copies of stored prompts."""
+    from repository import GameRepository, images
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    words = np.array(["".join(letters[rng.integers(0, 26, rng.integers(3, 10))]) for _ in range(5000)])
+    prompts = [" ".join(words[rng.integers(0, len(words), rng.integers(6, 14))]) for _ in range(n)]
+    start = time.perf_counter()
+    signature_matrix = signatures(prompts)
+    print(f"signatures: {(time.perf_counter() - start) / n * 1e6:.1f} us/prompt")
+    with tempfile.TemporaryDirectory() as directory:
+        repo = GameRepository.from_url(f"sqlite:///{os.path.join(directory, 'minhash.db')}")
+        repo.migrate()
+        game_id = repo.create_game()
+        start = time.perf_counter()
+        for low in range(0, n, 50_000):
+            with repo.transaction() as conn:
+                conn.execute(images.insert(), [{"Id": i + 1, "Prompt": prompts[i], "Game_Id": game_id, "User_Id": 1 + i % 7}
+                                               for i in range(low, min(low + 50_000, n))])
+                repo.insert_prompt_signatures(signature_rows(range(low + 1, min(low + 50_000, n) + 1),
+                                                             signature_matrix[low:low + 50_000]), conn)
+        print(f"indexed {n} prompts in {time.perf_counter() - start:.0f}s")
+        # Copies with one word swapped and a word appended, and unrelated prompts
+        picks = rng.integers(0, n, queries // 2)
+        copies = []
+        for p in picks.tolist():
+            prompt_words = prompts[p].split()
+            prompt_words[rng.integers(0, len(prompt_words))] = str(words[rng.integers(0, len(words))])
+            copies.append(" ".join(prompt_words + [str(words[rng.integers(0, len(words))])]))
+        fresh = [" ".join(words[rng.integers(0, len(words), rng.integers(6, 14))]) for _ in range(queries - len(copies))]
+        query_signatures = signatures(copies + fresh)
+        for threshold in (0.5, 0.7, 0.8):
+            start = time.perf_counter()
+            found = [find_copy(repo, signature, threshold) for signature in query_signatures]
+            per_query = (time.perf_counter() - start) / queries
+            hits = sum(match is not None for match in found[:len(copies)])
+            exact = [similarities(query_signatures[i], signature_matrix[p:p + 1])[0] for i, p in enumerate(picks.tolist())]
+            expected = sum(score >= threshold for score in exact)
+            flagged_fresh = sum(match is not None for match in found[len(copies):])
+            print(f"threshold {threshold}: {per_query * 1e3:.2f} ms/lookup, flagged {hits} copies "
+                  f"({expected} are at or above it), {flagged_fresh}/{len(fresh)} fresh prompts flagged")
+        repo.dispose()
+    start = time.perf_counter()
+    for signature in query_signatures[:20]:
+        similarities(signature, signature_matrix)
+    print(f"scan: {(time.perf_counter() - start) / 20 * 1e3:.0f} ms/lookup")
+
+if __name__ == "__main__":
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,165 @@
+import threading
+import time
+from functools import lru_cache
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+from logger import game_logger
+
+# 64-bit perceptual hashes. Near-identical images (re-encodes, small edits, the same prompt
+# generated twice) land within a few bits of each other, unlike a cryptographic hash.
+# - dHash: sign of the horizontal gradient of a 9x8 grayscale thumbnail
+# - pHash: sign of the 8x8 lowest DCT frequencies of a 32x32 thumbnail against their median
+HASH_SIZE = 8
+PHASH_SIZE = 32
+# Images whose pHashes differ in at most this many of the 64 bits count as near-duplicates
+DUPLICATE_DISTANCE = 6
+# Multi-index hashing splits a hash into this many 16-bit chunks, see HashIndex
+HASH_CHUNKS = 4
+
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel().astype(np.uint8)).tobytes(), "big")
+
+def _gray(img: Image.Image, width: int, height: int) -> np.ndarray:
+    return np.asarray(img.convert("L").resize((width, height), Image.LANCZOS), dtype=np.float32)
+
+def dhash(img: Image.Image) -> int:
+    pixels = _gray(img, HASH_SIZE + 1, HASH_SIZE)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+@lru_cache(maxsize=None)
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+def phash(img: Image.Image) -> int:
+    pixels = _gray(img, PHASH_SIZE, PHASH_SIZE)
+    dct = _dct_matrix(PHASH_SIZE)
+    low = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE]
+    # The DC term only measures brightness, leave it out of the median
+    return _bits_to_int(low > np.median(low.ravel()[1:]))
+
+def image_hashes(img: Image.Image) -> Tuple[int, int]:
+    """(dhash, phash) of an image."""
+    return dhash(img), phash(img)
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+def hamming_many(hashes: np.ndarray, query: int) -> np.ndarray:
+    """Bit distance of every uint64 hash to query, via a byte popcount table."""
+    xor = np.asarray(hashes, dtype=np.uint64) ^ np.uint64(query)
+    return _POPCOUNT[xor.view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.int64)
+
+# SQLite integers are signed 64-bit
+def to_signed(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+@lru_cache(maxsize=None)
+def _flip_masks(bits: int, radius: int) -> Tuple[int, ...]:
+    return tuple(sum(1 << bit for bit in flipped)
+                 for r in range(radius + 1) for flipped in combinations(range(bits), r))
+
+class HashIndex:
+    """Multi-index hashing over 64-bit hashes. Each hash is cut into HASH_CHUNKS chunks, and each
+    chunk position has a dict from chunk value to image IDs. Two hashes within distance d must
+    agree to within d // HASH_CHUNKS bits on at least one chunk (pigeonhole). A lookup therefore
+    probes a few dozen dict keys per chunk and popcounts only the hashes found there."""
+
+    def __init__(self, max_distance: int = DUPLICATE_DISTANCE, chunks: int = HASH_CHUNKS):
+        self.max_distance = max_distance
+        self.chunks = chunks
+        self.chunk_bits = 64 // chunks
+        # Chunk value -> positions in ids/values, one dict per chunk position
+        self.tables: List[Dict[int, List[int]]] = [{} for _ in range(chunks)]
+        # Growable arrays so candidates are checked with one vectorized popcount
+        self.ids = np.zeros(1024, dtype=np.int64)
+        self.values = np.zeros(1024, dtype=np.uint64)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _chunks(self, value: int) -> List[int]:
+        mask = (1 << self.chunk_bits) - 1
+        return [(value >> (i * self.chunk_bits)) & mask for i in range(self.chunks)]
+
+    def add(self, image_id: int, value: int) -> None:
+        self.add_many([image_id], [value])
+
+    def add_many(self, image_ids: Iterable[int], values: Iterable[int]) -> None:
+        image_ids, values = list(image_ids), list(values)
+        with self.lock:
+            needed = self.count + len(image_ids)
+            if needed > len(self.ids):
+                capacity = max(needed, 2 * len(self.ids))
+                self.ids = np.resize(self.ids, capacity)
+                self.values = np.resize(self.values, capacity)
+            self.ids[self.count:needed] = image_ids
+            self.values[self.count:needed] = values
+            for position, value in enumerate(values, start=self.count):
+                for table, chunk in zip(self.tables, self._chunks(value)):
+                    table.setdefault(chunk, []).append(position)
+            self.count = needed
+
+    def near(self, value: int, max_distance: Optional[int] = None) -> List[Tuple[int, int]]:
+        """(image_id, distance) of every indexed hash within max_distance bits, closest first."""
+        max_distance = self.max_distance if max_distance is None else max_distance
+        masks = _flip_masks(self.chunk_bits, max_distance // self.chunks)
+        positions: List[int] = []
+        with self.lock:
+            for table, chunk in zip(self.tables, self._chunks(value)):
+                for mask in masks:
+                    positions.extend(table.get(chunk ^ mask, ()))
+            if not positions:
+                return []
+            positions = np.fromiter(positions, dtype=np.int64, count=len(positions))
+            distances = hamming_many(self.values[positions], value)
+            close = distances <= max_distance
+            # A hash close on several chunks is a candidate several times; dedupe the few survivors
+            ids, first = np.unique(self.ids[positions[close]], return_index=True)
+            distances = distances[close][first]
+        order = np.lexsort((ids, distances))
+        return list(zip(ids[order].tolist(), distances[order].tolist()))
+
+    def load(self, repo) -> "HashIndex":
+        start = time.perf_counter()
+        ids, _, phashes = repo.load_image_hashes()
+        self.add_many(ids.tolist(), phashes.tolist())
+        game_logger.info(f"Loaded {len(ids)} image hashes in {time.perf_counter() - start:.2f}s")
+        return self
+
+def benchmark(n: int = 1_000_000, queries: int = 1000, seed: int = 0) -> None:
+    """Lookup latency of the index against a NumPy scan over n random hashes."""
+    rng = np.random.default_rng(seed)
+    hashes = rng.integers(0, 2 ** 63, n, dtype=np.int64).astype(np.uint64) * np.uint64(2) + rng.integers(0, 2, n).astype(np.uint64)
+    start = time.perf_counter()
+    index = HashIndex()
+    index.add_many(range(n), hashes.tolist())
+    print(f"indexed {n} hashes in {time.perf_counter() - start:.1f}s")
+    # Queries are stored hashes with up to DUPLICATE_DISTANCE bits flipped
+    picks = rng.integers(0, n, queries)
+    flips = [sum(1 << int(bit) for bit in rng.choice(64, rng.integers(0, DUPLICATE_DISTANCE + 1), replace=False))
+             for _ in range(queries)]
+    targets = [int(hashes[p]) ^ f for p, f in zip(picks.tolist(), flips)]
+    start = time.perf_counter()
+    hits = sum(any(image_id == p for image_id, _ in index.near(t)) for p, t in zip(picks.tolist(), targets))
+    per_query = (time.perf_counter() - start) / queries
+    print(f"index: {per_query * 1e6:.0f} us/query, found {hits}/{queries} planted duplicates")
+    start = time.perf_counter()
+    for t in targets[:20]:
+        np.flatnonzero(hamming_many(hashes, t) <= DUPLICATE_DISTANCE)
+    print(f"scan: {(time.perf_counter() - start) / 20 * 1000:.1f} ms/query")
+
+if __name__ == "__main__":
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,108 @@
+import atexit
+import queue
+import threading
+import time
+from typing import Callable, List
+from logger import game_logger
+
+# "batched": writes are queued and group-committed by a background thread; a crash can lose
+#            the last FLUSH_INTERVAL worth of events, but requests never wait for the disk.
+# "sync":    every write is committed on the caller's thread before submit() returns.
+DURABILITY_MODES = ("batched", "sync")
+DEFAULT_DURABILITY = "batched"
+MAX_QUEUE_SIZE = 10000
+MAX_BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.05  # seconds to keep collecting events into a batch
+
+# An event is a callable that performs its writes on the connection of the batch transaction
+Event = Callable
+_STOP = object()
+
+class PersistenceWriter:
+    def __init__(self, repo, durability: str = DEFAULT_DURABILITY, max_queue_size: int = MAX_QUEUE_SIZE,
+                 max_batch_size: int = MAX_BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.repo = repo
+        self.durability = durability
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.queue: "queue.Queue[Event]" = queue.Queue(maxsize=max_queue_size)
+        self.thread = None
+        if durability == "batched":
+            self.thread = threading.Thread(target=self._run, name="PersistenceWriter", daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+
+    def submit(self, event: Event) -> None:
+        if self.thread is None:
+            with self.repo.transaction() as conn:
+                event(conn)
+            return
+        if self.queue.full():
+            game_logger.warning("Persistence queue is full, blocking until the writer catches up")
+        self.queue.put(event)
+
+    def flush(self) -> None:
+        """Block until everything submitted so far has been committed."""
+        if self.thread is not None:
+            self.queue.join()
+
+    def close(self) -> None:
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self.thread.join()
+        game_logger.info("Persistence writer flushed and stopped")
+
+    def _commit(self, events: List[Event]) -> None:
+        start = time.perf_counter()
+        try:
+            with self.repo.transaction() as conn:
+                for event in events:
+                    event(conn)
+        except Exception as e:
+            # Retry one by one so a single bad event does not take the rest of the batch with it
+            game_logger.error(f"Batch of {len(events)} writes failed ({str(e)}), retrying individually")
+            for event in events:
+                try:
+                    with self.repo.transaction() as conn:
+                        event(conn)
+                except Exception as e:
+                    game_logger.error(f"Dropping write {event!r}: {str(e)}")
+        game_logger.debug(f"Committed {len(events)} writes in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def _run(self) -> None:
+        while True:
+            event = self.queue.get()
+            batch = [] if event is _STOP else [event]
+            stopping = event is _STOP
+            deadline = time.monotonic() + self.flush_interval
+            while not stopping and len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    event = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if event is _STOP:
+                    stopping = True
+                else:
+                    batch.append(event)
+            if batch:
+                self._commit(batch)
+            for _ in range(len(batch) + (1 if stopping else 0)):
+                self.queue.task_done()
+            if stopping:
+                # Drain anything that raced in behind the stop marker
+                remaining = []
+                while True:
+                    try:
+                        remaining.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                writes = [e for e in remaining if e is not _STOP]
+                if writes:
+                    self._commit(writes)
+                for _ in remaining:
+                    self.queue.task_done()
+                return
@@ -0,0 +1,262 @@
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from logger import game_logger
+
+# How close a player's prompt got to the round's hidden target prompt, as the cosine between
+# TF-IDF vectors of character n-grams. Deterministic and far cheaper than the image embeddings.
+# An n-gram is taken as the UTF-8 bytes of the normalized text packed into one uint64, so turning
+# a batch of prompts into sparse rows is a handful of NumPy passes instead of a dict lookup per n-gram.
+NGRAM_SIZES = (3, 4, 5)
+MAX_FEATURES = 1 << 18
+# Prompts per vectorized pass, bounds the temporary (row, n-gram) arrays
+CHUNK = 50_000
+VOCAB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Database", "tfidf_vocab.npz")
+VOCAB_FORMAT = 1
+
+# generate_prompt() wraps the scene description in instructions for the LLM; only the scene is compared
+_SCENE = re.compile(r"^Based on this description: '(.*)', create a creative prompt", re.S)
+_NON_WORD = re.compile(r"[\W_]+")
+
+def scene_text(prompt: str) -> str:
+    match = _SCENE.match(prompt)
+    return match.group(1) if match else prompt
+
+def _normalize(prompt: str) -> bytes:
+    # Lowercase words separated by single spaces, padded so word starts and ends form n-grams too.
+    # Never contains a zero byte, which keeps codes of different n-gram sizes distinct.
+    return f" {_NON_WORD.sub(' ', scene_text(prompt).lower()).strip()} ".encode()
+
+def ngram_codes(prompts: Sequence[str], sizes: Sequence[int] = NGRAM_SIZES) -> Tuple[np.ndarray, np.ndarray]:
+    """(row, code) of every n-gram occurrence in the prompts, code being its bytes as a big-endian
+    integer. Rows are grouped by n-gram size, and ascending within each size."""
+    docs = [_normalize(prompt) for prompt in prompts]
+    lengths = np.fromiter(map(len, docs), dtype=np.int64, count=len(docs))
+    buffer = np.frombuffer(b"".join(docs), dtype=np.uint8).astype(np.uint64)
+    ends = np.cumsum(lengths)
+    row_of = np.repeat(np.arange(len(docs)), lengths)
+    rows, codes = [], []
+    for n in sizes:
+        count = len(buffer) - n + 1
+        if count <= 0:
+            continue
+        # An n-gram may not run into the next prompt
+        valid = np.arange(count) + n <= ends[row_of[:count]]
+        code = np.zeros(count, dtype=np.uint64)
+        for k in range(n):
+            code = (code << np.uint64(8)) | buffer[k:k + count]
+        rows.append(row_of[:count][valid])
+        codes.append(code[valid])
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+    return np.concatenate(rows), np.concatenate(codes)
+
+@dataclass
+class SparseRows:
+    """Row-compressed (CSR) matrix: row i has columns indices[indptr[i]:indptr[i + 1]],
+    ascending, with weights in data."""
+    indptr: np.ndarray
+    indices: np.ndarray
+    data: np.ndarray
+    n_cols: int
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def row_ids(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self)), np.diff(self.indptr))
+
+    def keys(self) -> np.ndarray:
+        """row * n_cols + column of every entry, ascending."""
+        return self.row_ids() * self.n_cols + self.indices
+
+    def take(self, rows) -> "SparseRows":
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = self.indptr[rows + 1] - self.indptr[rows]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        positions = np.repeat(self.indptr[rows] - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return SparseRows(indptr, self.indices[positions], self.data[positions], self.n_cols)
+
+    @classmethod
+    def concatenate(cls, parts: List["SparseRows"], n_cols: int) -> "SparseRows":
+        if not parts:
+            return cls(np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32), n_cols)
+        offsets = np.cumsum([0] + [part.indptr[-1] for part in parts[:-1]])
+        indptr = np.concatenate([parts[0].indptr[:1]] + [part.indptr[1:] + offset for part, offset in zip(parts, offsets)])
+        return cls(indptr, np.concatenate([part.indices for part in parts]),
+                   np.concatenate([part.data for part in parts]), n_cols)
+
+def score_pairs(a: SparseRows, b: SparseRows) -> np.ndarray:
+    """Dot product of row i of a with row i of b for every i, in one pass over both matrices."""
+    if len(a) != len(b):
+        raise ValueError(f"Cannot pair {len(a)} rows with {len(b)} rows")
+    keys_a = a.keys()
+    _, in_a, in_b = np.intersect1d(keys_a, b.keys(), assume_unique=True, return_indices=True)
+    # float64 even when nothing matches: bincount of an empty array comes back as integers
+    return np.bincount(keys_a[in_a] // a.n_cols, weights=a.data[in_a] * b.data[in_b],
+                       minlength=len(a)).astype(np.float64, copy=False)
+
+class TfidfModel:
+    """Vocabulary (the MAX_FEATURES most common n-grams, as sorted codes) and smoothed IDF weights,
+    fitted on Images.Prompt. Rows are sublinear TF times IDF, unit length; n-grams outside the
+    vocabulary are dropped."""
+
+    def __init__(self, vocab: np.ndarray, idf: np.ndarray, documents: int):
+        self.vocab = np.asarray(vocab, dtype=np.uint64)
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.documents = documents
+
+    def __len__(self) -> int:
+        return len(self.vocab)
+
+    @classmethod
+    def fit(cls, prompts: Sequence[str], max_features: int = MAX_FEATURES) -> "TfidfModel":
+        codes, counts = [], []
+        for start in range(0, len(prompts), CHUNK):
+            rows, chunk_codes = ngram_codes(prompts[start:start + CHUNK])
+            # Document frequency: each n-gram once per prompt
+            order = np.lexsort((chunk_codes, rows))
+            rows, chunk_codes = rows[order], chunk_codes[order]
+            first = np.ones(len(rows), dtype=bool)
+            first[1:] = (rows[1:] != rows[:-1]) | (chunk_codes[1:] != chunk_codes[:-1])
+            unique, count = np.unique(chunk_codes[first], return_counts=True)
+            codes.append(unique)
+            counts.append(count)
+        if not codes:
+            return cls(np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.float32), 0)
+        vocab, inverse = np.unique(np.concatenate(codes), return_inverse=True)
+        df = np.bincount(inverse, weights=np.concatenate(counts))
+        if len(vocab) > max_features:
+            keep = np.sort(np.argsort(-df, kind="stable")[:max_features])
+            vocab, df = vocab[keep], df[keep]
+        return cls(vocab, np.log((1 + len(prompts)) / (1 + df)) + 1, len(prompts))
+
+    def transform(self, prompts: Sequence[str]) -> SparseRows:
+        n_cols = len(self.vocab)
+        parts = []
+        for start in range(0, len(prompts), CHUNK):
+            chunk = prompts[start:start + CHUNK]
+            rows, codes = ngram_codes(chunk)
+            cols = np.searchsorted(self.vocab, codes)
+            known = cols < n_cols
+            known[known] = self.vocab[cols[known]] == codes[known]
+            keys, tf = np.unique(rows[known] * n_cols + cols[known], return_counts=True)
+            rows, cols = keys // max(n_cols, 1), keys % max(n_cols, 1)
+            weights = ((1 + np.log(tf)) * self.idf[cols]).astype(np.float32)
+            norms = np.sqrt(np.bincount(rows, weights=weights.astype(np.float64) ** 2, minlength=len(chunk)))
+            weights /= norms[rows].astype(np.float32)
+            indptr = np.zeros(len(chunk) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(rows, minlength=len(chunk)), out=indptr[1:])
+            parts.append(SparseRows(indptr, cols.astype(np.int32), weights, n_cols))
+        return SparseRows.concatenate(parts, n_cols)
+
+    def score_round(self, target: str, prompts: Sequence[str]) -> np.ndarray:
+        """Cosine similarity of each prompt to the target prompt."""
+        matrix = self.transform([target, *prompts])
+        return score_pairs(matrix.take(np.arange(1, len(matrix))), matrix.take(np.zeros(len(prompts), dtype=np.int64)))
+
+    def save(self, path: str = VOCAB_PATH) -> None:
+        partial = path + ".partial.npz"
+        np.savez(partial, vocab=self.vocab, idf=self.idf, documents=np.array(self.documents),
+                 format=np.array(VOCAB_FORMAT), ngram_sizes=np.array(NGRAM_SIZES))
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path: str = VOCAB_PATH) -> Optional["TfidfModel"]:
+        """The saved model, or None when it was saved with another format or n-gram sizes."""
+        with np.load(path) as data:
+            if int(data["format"]) != VOCAB_FORMAT or tuple(data["ngram_sizes"].tolist()) != NGRAM_SIZES:
+                return None
+            return cls(data["vocab"], data["idf"], int(data["documents"]))
+
+def fit_from_repository(repo, path: str = VOCAB_PATH) -> TfidfModel:
+    start = time.perf_counter()
+    _, _, _, prompts = repo.list_prompts()
+    if not prompts:
+        raise ValueError("No prompts to fit a vocabulary on")
+    model = TfidfModel.fit(prompts)
+    model.save(path)
+    game_logger.info(f"Fitted TF-IDF vocabulary of {len(model)} n-grams on {len(prompts)} prompts "
+                     f"in {time.perf_counter() - start:.2f}s")
+    return model
+
+def load_or_fit(repo, path: str = VOCAB_PATH) -> Optional[TfidfModel]:
+    if os.path.exists(path):
+        model = TfidfModel.load(path)
+        if model is not None:
+            return model
+        game_logger.info("TF-IDF vocabulary has an old format, refitting")
+    try:
+        return fit_from_repository(repo, path)
+    except ValueError as e:
+        game_logger.info(f"Not fitting TF-IDF vocabulary: {str(e)}")
+        return None
+
+@dataclass
+class PromptScores:
+    game_ids: np.ndarray
+    target_ids: np.ndarray
+    image_ids: np.ndarray
+    user_ids: np.ndarray
+    scores: np.ndarray
+
+def score_history(model: TfidfModel, image_ids: np.ndarray, game_ids: np.ndarray, user_ids: np.ndarray,
+                  prompts: Sequence[str]) -> PromptScores:
+    """Score every player prompt against its round's target, rows ordered by (game, image ID) as
+    list_prompts returns them. A round starts at a target row (user 0) and runs until the next one;
+    a player's prompt row and generated image row of a round count once. Prompts are vectorized
+    CHUNK rounds' worth at a time, so memory stays bounded on a long history."""
+    positions = np.arange(len(image_ids))
+    is_target = user_ids == 0
+    target_of = np.maximum.accumulate(np.where(is_target, positions, -1)) if len(positions) else positions
+    in_round = ~is_target & (target_of >= 0)
+    in_round[in_round] = game_ids[target_of[in_round]] == game_ids[in_round]
+    players = positions[in_round]
+    _, first = np.unique(np.stack([target_of[players], user_ids[players]], axis=1), axis=0, return_index=True)
+    players = np.sort(players[first])
+    targets = target_of[players]
+    scores = np.zeros(len(players))
+    for start in range(0, len(players), CHUNK):
+        # Targets precede their players, so one window of rows covers both sides of the block
+        block_players, block_targets = players[start:start + CHUNK], targets[start:start + CHUNK]
+        low = block_targets[0]
+        matrix = model.transform(prompts[low:block_players[-1] + 1])
+        scores[start:start + CHUNK] = score_pairs(matrix.take(block_players - low), matrix.take(block_targets - low))
+    return PromptScores(game_ids[players], image_ids[targets], image_ids[players], user_ids[players], scores)
+
+def benchmark(n: int = 1_000_000, players: int = 4, seed: int = 0) -> None:
+    """Fit, transform and scoring times on n synthetic prompts in rounds of one target and `players` prompts."""
+    rng = np.random.default_rng(seed)
+    words = np.array(["cat", "robot", "dragon", "wizard", "dancing", "flying", "painting", "forest", "moon",
+                      "city", "volcano", "crystal", "cave", "cyberpunk", "baroque", "watercolor", "neon",
+                      "portal", "giant", "mushroom", "shadow", "floating", "island", "rainbow", "airship"])
+    prompts = [" ".join(words[rng.integers(0, len(words), rng.integers(4, 12))]) for _ in range(n)]
+    user_ids = np.where(np.arange(n) % (players + 1) == 0, 0, np.arange(n) % (players + 1))
+    game_ids = np.arange(n) // (10 * (players + 1))
+    start = time.perf_counter()
+    model = TfidfModel.fit(prompts)
+    print(f"fit: {len(model)} n-grams from {n} prompts in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    matrix = model.transform(prompts[:CHUNK])
+    print(f"transform: {(time.perf_counter() - start) / len(matrix) * 1e6:.1f} us/prompt, "
+          f"{matrix.indptr[-1] / len(matrix):.0f} entries per prompt")
+    targets = np.flatnonzero(user_ids[:len(matrix)] == 0)
+    round_players = np.minimum(targets[:, None] + np.arange(1, players + 1), len(matrix) - 1).ravel()
+    start = time.perf_counter()
+    score_pairs(matrix.take(round_players), matrix.take(np.repeat(targets, players)))
+    print(f"score_pairs: {(time.perf_counter() - start) / len(round_players) * 1e6:.1f} us/pair")
+    start = time.perf_counter()
+    for _ in range(100):
+        model.score_round(prompts[0], prompts[1:players + 1])
+    print(f"score_round: {(time.perf_counter() - start) * 10:.2f} ms")
+    start = time.perf_counter()
+    result = score_history(model, np.arange(n), game_ids, user_ids, prompts)
+    print(f"score_history incl. transform: {len(result.scores)} prompts in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,143 @@
+from typing import Callable, Dict, Type, Union
+import numpy as np
+
+# Codecs that compress embeddings for the ANN index. Each one is trained on a sample, encodes
+# rows to uint8 codes and scores codes against a float32 query without decoding them
+# (asymmetric distance computation): only the stored side is approximate, never the query.
+TRAIN_SAMPLE = 50_000
+# Int8 ranges are taken between these percentiles, so a few outliers don't waste the 256 levels
+INT8_CLIP_PERCENTILE = 0.1
+# 160 dimensions / 20 subspaces = 8 dimensions per byte
+PQ_SUBSPACES = 20
+PQ_CENTROIDS = 256
+PQ_ITERATIONS = 15
+_CHUNK = 16384
+
+# A scorer maps (n, code_size) codes to n approximate dot products with one query
+Scorer = Callable[[np.ndarray], np.ndarray]
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin |x - c|^2 == argmax (x.c - |c|^2 / 2)
+    half_norms = 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    return np.concatenate([np.argmax(vectors[i:i + _CHUNK] @ centroids.T - half_norms, axis=1)
+                           for i in range(0, len(vectors), _CHUNK)]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+def _kmeans(vectors: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """Plain Euclidean k-means, for the low-dimensional PQ subspaces."""
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest(vectors, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.stack([np.bincount(assignment, weights=column, minlength=k) for column in vectors.T], axis=1)
+        empty = counts == 0
+        centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+        centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+    return centroids
+
+class Int8Codec:
+    """Scalar quantization: every dimension is mapped linearly onto 0..255 over its trained range.
+    One byte per dimension, a quarter of float32."""
+    name = "int8"
+
+    def __init__(self, low: np.ndarray, step: np.ndarray):
+        self.low = np.asarray(low, dtype=np.float32)
+        self.step = np.asarray(step, dtype=np.float32)
+
+    @property
+    def dim(self) -> int:
+        return len(self.low)
+
+    @property
+    def code_size(self) -> int:
+        return self.dim
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, seed: int = 0) -> "Int8Codec":
+        low, high = np.percentile(vectors, [INT8_CLIP_PERCENTILE, 100 - INT8_CLIP_PERCENTILE], axis=0)
+        return cls(low, np.maximum(high - low, 1e-9) / 255)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint((vectors - self.low) / self.step), 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.low + codes.astype(np.float32) * self.step
+
+    def scorer(self, query: np.ndarray) -> Scorer:
+        # q . (low + code * step) == q . low + code . (q * step)
+        offset = float(query @ self.low)
+        weights = (query * self.step).astype(np.float32)
+        return lambda codes: codes @ weights + offset
+
+    def params(self) -> Dict[str, np.ndarray]:
+        return {"low": self.low, "step": self.step}
+
+class PQCodec:
+    """Product quantization: a vector is cut into `subspaces` slices and each slice is replaced by
+    the index of its nearest trained centroid, one byte per slice. A query computes a
+    (subspaces, centroids) table of dot products once; a code's score is then a sum of lookups."""
+    name = "pq"
+
+    def __init__(self, codebooks: np.ndarray):
+        # (subspaces, centroids, dimensions per subspace)
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)
+
+    @property
+    def dim(self) -> int:
+        return self.codebooks.shape[0] * self.codebooks.shape[2]
+
+    @property
+    def code_size(self) -> int:
+        return self.codebooks.shape[0]
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, seed: int = 0, subspaces: int = PQ_SUBSPACES) -> "PQCodec":
+        if vectors.shape[1] % subspaces:
+            raise ValueError(f"Dimension {vectors.shape[1]} is not divisible into {subspaces} subspaces")
+        rng = np.random.default_rng(seed)
+        width = vectors.shape[1] // subspaces
+        books = [_kmeans(np.ascontiguousarray(vectors[:, j * width:(j + 1) * width]), PQ_CENTROIDS, PQ_ITERATIONS, rng)
+                 for j in range(subspaces)]
+        # Subspaces with fewer training rows than centroids pad their codebook with copies
+        size = max(len(book) for book in books)
+        return cls(np.stack([np.resize(book, (size, width)) for book in books]))
+
+    def _slices(self, vectors: np.ndarray):
+        width = self.codebooks.shape[2]
+        return (vectors[:, j * width:(j + 1) * width] for j in range(len(self.codebooks)))
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.code_size), dtype=np.uint8)
+        for j, (part, book) in enumerate(zip(self._slices(vectors), self.codebooks)):
+            codes[:, j] = _nearest(part, book)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.concatenate([book[codes[:, j]] for j, book in enumerate(self.codebooks)], axis=1)
+
+    def scorer(self, query: np.ndarray) -> Scorer:
+        table = np.einsum("mkd,md->mk", self.codebooks, query.reshape(self.code_size, -1)).astype(np.float32)
+        flat = table.ravel()
+        offsets = (np.arange(self.code_size) * table.shape[1]).astype(np.uint16)
+        return lambda codes: flat[codes + offsets].sum(axis=1)
+
+    def params(self) -> Dict[str, np.ndarray]:
+        return {"codebooks": self.codebooks}
+
+Codec = Union[Int8Codec, PQCodec]
+CODECS: Dict[str, Type] = {"int8": Int8Codec, "pq": PQCodec}
+
+def _codec_class(name: str) -> Type:
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec {name!r}, expected one of {', '.join(CODECS)}")
+    return CODECS[name]
+
+def train_codec(name: str, vectors: np.ndarray, seed: int = 0) -> Codec:
+    """Train a codec on (a sample of) the given float32 vectors."""
+    codec_class = _codec_class(name)
+    if len(vectors) > TRAIN_SAMPLE:
+        vectors = vectors[np.sort(np.random.default_rng(seed).choice(len(vectors), TRAIN_SAMPLE, replace=False))]
+    return codec_class.train(np.asarray(vectors, dtype=np.float32), seed=seed)
+
+def load_codec(name: str, params: Dict[str, np.ndarray]) -> Codec:
+    return _codec_class(name)(**params)
@@ -0,0 +1,241 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from logger import game_logger
+
+# Multiplayer Elo. Within a round every player is compared with every other player on votes
+# received (win 1, tie 0.5, loss 0). A player's actual score for a game is the average of those
+# comparisons over all rounds; the expected score is the average Elo expectation against the
+# other players' ratings before the game. The rating moves by K * (actual - expected) once per game.
+INITIAL_RATING = 1500.0
+K_FACTOR = 32.0
+RATING_SCALE = 400.0
+
+# Matchmaking: players wait in buckets of this many rating points
+BUCKET_WIDTH = 100
+# How many neighbouring buckets a lobby may be filled from before giving up
+MAX_BUCKET_SPREAD = 3
+
+# An outcome row is (game_id, round, user_id, votes_received); RoundResults has exactly this shape
+Outcome = Tuple[int, int, int, int]
+
+def game_scores(outcomes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Actual scores from outcome rows, vectorized over every round of every game.
+
+    Returns (game_ids, user_ids, scores), one entry per player per game, sorted by game then user.
+    """
+    game, rnd, user, votes = (outcomes[:, i] for i in range(4))
+    order = np.lexsort((votes, rnd, game))
+    game, rnd, user, votes = game[order], rnd[order], user[order], votes[order]
+    n = len(order)
+    index = np.arange(n)
+    # Rows of one round are now contiguous and sorted by votes, so a row's position inside its
+    # round counts the players with fewer votes, and runs of equal votes are the ties
+    round_change = np.ones(n, dtype=bool)
+    round_change[1:] = (game[1:] != game[:-1]) | (rnd[1:] != rnd[:-1])
+    round_start = np.maximum.accumulate(np.where(round_change, index, 0))
+    round_id = np.cumsum(round_change) - 1
+    round_size = np.bincount(round_id)[round_id]
+    value_change = round_change.copy()
+    value_change[1:] |= votes[1:] != votes[:-1]
+    value_id = np.cumsum(value_change) - 1
+    value_start = np.flatnonzero(value_change)[value_id]
+    value_count = np.bincount(value_id)[value_id]
+    wins = (value_start - round_start) + 0.5 * (value_count - 1)
+    fraction = np.divide(wins, round_size - 1, out=np.full(n, 0.5), where=round_size > 1)
+
+    # Average over the rounds each player took part in
+    span = int(user.max()) + 1
+    keys, inverse = np.unique(game * span + user, return_inverse=True)
+    totals = np.bincount(inverse, weights=fraction)
+    rounds = np.bincount(inverse)
+    return keys // span, keys % span, totals / rounds
+
+def expected_scores(ratings: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Average Elo expectation of each player against the others in the same game.
+    ratings and mask are (games, players) with padding masked out."""
+    diff = ratings[:, None, :] - ratings[:, :, None]  # [g, i, j] = R_j - R_i
+    expectation = 1.0 / (1.0 + np.power(10.0, diff / RATING_SCALE))
+    pairs = mask[:, :, None] & mask[:, None, :]
+    pairs &= ~np.eye(ratings.shape[1], dtype=bool)[None, :, :]
+    opponents = pairs.sum(axis=2)
+    total = np.where(pairs, expectation, 0.0).sum(axis=2)
+    return np.divide(total, opponents, out=np.full(ratings.shape, 0.5), where=opponents > 0)
+
+def _pad_games(game_ids: np.ndarray, user_ids: np.ndarray, scores: np.ndarray):
+    """Lay the per-player rows out as (games, max players) matrices; padding has user -1."""
+    starts = np.flatnonzero(np.r_[True, game_ids[1:] != game_ids[:-1]])
+    sizes = np.diff(np.r_[starts, len(game_ids)])
+    width = int(sizes.max()) if len(sizes) else 0
+    column = np.arange(len(game_ids)) - np.repeat(starts, sizes)
+    row = np.repeat(np.arange(len(starts)), sizes)
+    users = np.full((len(starts), width), -1, dtype=np.int64)
+    actual = np.zeros((len(starts), width))
+    users[row, column] = user_ids
+    actual[row, column] = scores
+    return game_ids[starts], users, actual
+
+def _independent_batches(users: np.ndarray) -> List[Tuple[int, int]]:
+    """Split consecutive games into runs where no player appears twice, so a whole run can be
+    updated at once and still give the same result as replaying the games one by one."""
+    batches, start, seen = [], 0, set()
+    for index, row in enumerate(users.tolist()):
+        players = {user for user in row if user >= 0}
+        if seen & players:
+            batches.append((start, index))
+            start, seen = index, set()
+        seen |= players
+    if len(users):
+        batches.append((start, len(users)))
+    return batches
+
+def replay(outcomes: Iterable[Outcome], game_order: Optional[List[int]] = None,
+           ratings: Optional[Dict[int, float]] = None) -> Dict[int, Tuple[float, int]]:
+    """Ratings after replaying the given games in order; returns {user_id: (rating, games_played)}.
+
+    game_order lists game IDs chronologically (default: ascending ID). Starting ratings default
+    to INITIAL_RATING, pass `ratings` to continue from existing ones.
+    """
+    outcomes = np.asarray(outcomes if isinstance(outcomes, np.ndarray) else list(outcomes), dtype=np.int64).reshape(-1, 4)
+    if not len(outcomes):
+        return {}
+    game_ids, user_ids, scores = game_scores(outcomes)
+    game_ids, users, actual = _pad_games(game_ids, user_ids, scores)
+    if game_order is not None:
+        position = {game_id: index for index, game_id in enumerate(game_order)}
+        order = np.argsort([position.get(game_id, len(position)) for game_id in game_ids.tolist()], kind="stable")
+        users, actual = users[order], actual[order]
+
+    mask = users >= 0
+    known, dense = np.unique(users[mask], return_inverse=True)
+    index = np.zeros(users.shape, dtype=np.int64)
+    index[mask] = dense
+    current = np.full(len(known), INITIAL_RATING)
+    if ratings:
+        for position, user_id in enumerate(known.tolist()):
+            current[position] = ratings.get(user_id, INITIAL_RATING)
+
+    for start, end in _independent_batches(users):
+        batch_index, batch_mask = index[start:end], mask[start:end]
+        expected = expected_scores(current[batch_index], batch_mask)
+        delta = K_FACTOR * (actual[start:end] - expected)
+        current[batch_index[batch_mask]] += delta[batch_mask]
+
+    played = np.bincount(index[mask], minlength=len(known))
+    return {user_id: (float(rating), int(count)) for user_id, rating, count in zip(known.tolist(), current, played)}
+
+def update_game(ratings: Dict[int, float], rounds: List[Dict[int, int]]) -> Dict[int, float]:
+    """New ratings of the players of one finished game. rounds holds {user_id: votes} per round."""
+    outcomes = [(0, number, user_id, votes) for number, tallies in enumerate(rounds) for user_id, votes in tallies.items()]
+    return {user_id: rating for user_id, (rating, _) in replay(outcomes, ratings=ratings).items()}
+
+def recompute_ratings(repo) -> int:
+    """Replace every stored rating with a replay of the whole game history, e.g. after changing the formula."""
+    start = time.perf_counter()
+    game_order, outcomes = repo.get_game_outcomes()
+    all_ratings = replay(outcomes, game_order)
+    repo.replace_ratings(all_ratings)
+    game_logger.info(f"Recomputed ratings of {len(all_ratings)} users from {len(game_order)} games "
+                     f"in {time.perf_counter() - start:.2f}s")
+    return len(all_ratings)
+
+class MatchmakingQueue:
+    """Players waiting for a game, bucketed by rating. A lobby is filled from the newest player's
+    bucket first, then from ever wider neighbouring buckets, so players with similar ratings meet
+    and joining never scans the whole queue."""
+
+    def __init__(self, lobby_size: int, bucket_width: int = BUCKET_WIDTH, max_spread: int = MAX_BUCKET_SPREAD):
+        self.lobby_size = lobby_size
+        self.bucket_width = bucket_width
+        self.max_spread = max_spread
+        self.buckets: Dict[int, Deque[int]] = {}
+        self.waiting: Dict[int, int] = {}
+        # Last lobby formed with each player, so the members who did not trigger it can look it up
+        self.lobbies: Dict[int, List[int]] = {}
+        self.lock = threading.Lock()
+
+    def join(self, user_id: int, rating: float) -> Optional[List[int]]:
+        """Queue a player; returns a lobby (user IDs) as soon as one can be formed around them."""
+        with self.lock:
+            if user_id not in self.waiting:
+                self.lobbies.pop(user_id, None)
+                bucket = int(rating // self.bucket_width)
+                self.waiting[user_id] = bucket
+                self.buckets.setdefault(bucket, deque()).append(user_id)
+            return self._form_lobby(self.waiting[user_id])
+
+    def leave(self, user_id: int) -> bool:
+        """Take a player out of the queue and forget their last lobby; False if they were not queued."""
+        with self.lock:
+            self.lobbies.pop(user_id, None)
+            bucket = self.waiting.pop(user_id, None)
+            if bucket is None:
+                return False
+            self.buckets[bucket].remove(user_id)
+            if not self.buckets[bucket]:
+                del self.buckets[bucket]
+            return True
+
+    def status(self, user_id: int) -> Tuple[bool, Optional[List[int]]]:
+        """(queued, lobby): whether the player is waiting, and the last lobby formed with them."""
+        with self.lock:
+            return user_id in self.waiting, self.lobbies.get(user_id)
+
+    def __len__(self) -> int:
+        return len(self.waiting)
+
+    def _form_lobby(self, bucket: int) -> Optional[List[int]]:
+        for spread in range(self.max_spread + 1):
+            candidates = [b for b in range(bucket - spread, bucket + spread + 1) if b in self.buckets]
+            # Closest buckets first, oldest players first within a bucket
+            candidates.sort(key=lambda b: abs(b - bucket))
+            if sum(len(self.buckets[b]) for b in candidates) < self.lobby_size:
+                continue
+            lobby = []
+            for b in candidates:
+                queue = self.buckets[b]
+                while queue and len(lobby) < self.lobby_size:
+                    user_id = queue.popleft()
+                    del self.waiting[user_id]
+                    lobby.append(user_id)
+                if not queue:
+                    del self.buckets[b]
+            for user_id in lobby:
+                self.lobbies[user_id] = lobby
+            return lobby
+        return None
+
+def benchmark(n_games: int = 200_000, n_users: int = 5_000, players: int = 3, rounds: int = 5, seed: int = 0) -> None:
+    """Replay a synthetic history and compare with a game-by-game loop on a prefix of it."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for game_id in range(n_games):
+        lineup = rng.choice(n_users, size=players, replace=False)
+        votes = rng.multinomial(players, [1 / players] * players, size=rounds)
+        for number in range(rounds):
+            rows.extend((game_id, number, int(user), int(v)) for user, v in zip(lineup, votes[number]))
+    start = time.perf_counter()
+    replay(rows)
+    elapsed = time.perf_counter() - start
+    print(f"vectorized replay: {n_games} games in {elapsed:.2f}s")
+
+    prefix = min(n_games, 2_000)
+    prefix_rows = [row for row in rows[: prefix * players * rounds]]
+    start = time.perf_counter()
+    ratings: Dict[int, float] = {}
+    for game_id in range(prefix):
+        game_rows = prefix_rows[game_id * players * rounds:(game_id + 1) * players * rounds]
+        tallies = [{} for _ in range(rounds)]
+        for _, number, user, v in game_rows:
+            tallies[number][user] = v
+        ratings.update(update_game(ratings, tallies))
+    per_game = (time.perf_counter() - start) / prefix
+    print(f"game-by-game: {per_game * 1e6:.0f} us/game, {per_game * n_games:.1f}s projected for {n_games} games")
+    check = replay(prefix_rows)
+    worst = max(abs(check[user][0] - ratings[user]) for user in check)
+    print(f"max difference between the two on the prefix: {worst:.2e}")
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,645 @@
+import os
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import (BigInteger, Column, Float, ForeignKey, Index, Integer, LargeBinary, MetaData, Table, Text, case, create_engine,
+                        event, exists, func, select, tuple_, update)
+from sqlalchemy.engine import Connection, Engine, make_url
+from sqlalchemy.exc import IntegrityError
+import numpy as np
+from db import PRAGMAS, STATEMENT_CACHE_SIZE, WRITER_POOL_SIZE, READER_POOL_SIZE
+import migrations
+from embeddings import stack_blobs
+from perceptual_hash import to_signed
+
+metadata = MetaData()
+
+# Mirrors Database/migrations; on SQLite the migrations own the schema, elsewhere create_all does
+users = Table(
+    "Users", metadata,
+    Column("Id", Integer, primary_key=True),
+    Column("Name", Text, nullable=False, unique=True),
+    Column("Password", Text, nullable=False),
+    sqlite_autoincrement=True,
+)
+
+games = Table(
+    "Game", metadata,
+    Column("Id", Integer, primary_key=True),
+    Column("Winner_Id", Integer, ForeignKey("Users.Id")),
+    Column("Finished_At", Text, index=True),
+    sqlite_autoincrement=True,
+)
+
+archived_games = Table(
+    "ArchivedGames", metadata,
+    Column("Game_Id", Integer, primary_key=True),
+    Column("Month", Text, nullable=False, index=True),
+    Column("Archived_At", Text, nullable=False),
+)
+
+images = Table(
+    "Images", metadata,
+    Column("Id", Integer, primary_key=True),
+    Column("Prompt", Text, nullable=False),
+    Column("Game_Id", Integer, ForeignKey("Game.Id"), nullable=False, index=True),
+    # No foreign keys here: the initial image is stored under User_Id 0, which is not a user,
+    # and Vector_Id would make Images and VectorIndex reference each other
+    Column("User_Id", Integer, nullable=False, index=True),
+    Column("Vector_Id", Integer),
+    # Perceptual hashes of the generated image as signed 64-bit integers, see perceptual_hash.py
+    Column("DHash", BigInteger),
+    Column("PHash", BigInteger),
+    Index("idx_images_prompt", "Prompt"),
+    sqlite_autoincrement=True,
+)
+
+vector_index = Table(
+    "VectorIndex", metadata,
+    Column("Id", Integer, primary_key=True),
+    # Little-endian float32 values, see embeddings.py
+    Column("Vector_embeddings", LargeBinary, nullable=False),
+    Column("Image_Id", Integer, ForeignKey("Images.Id"), nullable=False, index=True),
+    Column("Dim", Integer),
+    Column("Version", Text),
+    Index("idx_vectorindex_version", "Version", "Image_Id"),
+    sqlite_autoincrement=True,
+)
+
+prompt_vectors = Table(
+    "PromptVectors", metadata,
+    Column("Image_Id", Integer, ForeignKey("Images.Id"), primary_key=True),
+    # Little-endian float32 text embedding of the image's prompt, see text_embeddings.py
+    Column("Vector", LargeBinary, nullable=False),
+    Column("Dim", Integer, nullable=False),
+    Column("Version", Text, nullable=False),
+    Index("idx_promptvectors_version", "Version", "Image_Id"),
+)
+
+prompt_signatures = Table(
+    "PromptSignatures", metadata,
+    Column("Image_Id", Integer, ForeignKey("Images.Id"), primary_key=True),
+    # Little-endian uint32 MinHash signature of the prompt, see minhash.py
+    Column("Signature", LargeBinary, nullable=False),
+)
+
+prompt_buckets = Table(
+    "PromptBuckets", metadata,
+    # One row per LSH band of the signature
+    Column("Bucket", BigInteger, primary_key=True),
+    Column("Image_Id", Integer, ForeignKey("Images.Id"), primary_key=True),
+)
+
+game_participants = Table(
+    "GameParticipants", metadata,
+    Column("Game_Id", Integer, ForeignKey("Game.Id"), primary_key=True),
+    Column("User_Id", Integer, ForeignKey("Users.Id"), primary_key=True, index=True),
+)
+
+votes = Table(
+    "Votes", metadata,
+    Column("Id", Integer, primary_key=True),
+    Column("Game_Id", Integer, ForeignKey("Game.Id"), nullable=False),
+    Column("Round", Integer, nullable=False),
+    Column("Voter_Id", Integer, ForeignKey("Users.Id"), nullable=False),
+    Column("Voted_For_Id", Integer, ForeignKey("Users.Id"), nullable=False),
+    Index("idx_votes_voter_id", "Voter_Id", "Game_Id", "Round"),
+    Index("idx_votes_game_round", "Game_Id", "Round"),
+    sqlite_autoincrement=True,
+)
+
+round_results = Table(
+    "RoundResults", metadata,
+    Column("Game_Id", Integer, ForeignKey("Game.Id"), primary_key=True),
+    Column("Round", Integer, primary_key=True),
+    Column("User_Id", Integer, ForeignKey("Users.Id"), primary_key=True),
+    Column("Votes", Integer, nullable=False),
+    Column("Won", Integer, nullable=False, default=0),
+    Index("idx_roundresults_user_id", "User_Id", "Game_Id"),
+)
+
+user_stats = Table(
+    "UserStats", metadata,
+    Column("User_Id", Integer, ForeignKey("Users.Id"), primary_key=True),
+    Column("Games_Played", Integer, nullable=False, default=0),
+    Column("Wins", Integer, nullable=False, default=0),
+    Column("Rounds_Played", Integer, nullable=False, default=0),
+    Column("Rounds_Won", Integer, nullable=False, default=0),
+    Column("Votes_Received", Integer, nullable=False, default=0),
+    Index("idx_userstats_leaderboard", "Wins", "Votes_Received", "User_Id"),
+)
+STAT_COLUMNS = ("Games_Played", "Wins", "Rounds_Played", "Rounds_Won", "Votes_Received")
+
+ratings = Table(
+    "Ratings", metadata,
+    Column("User_Id", Integer, ForeignKey("Users.Id"), primary_key=True),
+    Column("Rating", Float, nullable=False),
+    Column("Games", Integer, nullable=False, default=0),
+    Index("idx_ratings_rating", "Rating"),
+)
+
+# Same text format as SQLite's CURRENT_TIMESTAMP, so timestamps compare as strings
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def utc_timestamp() -> str:
+    return datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+LEADERBOARD_PAGE_SIZE = 20
+LEADERBOARD_MAX_PAGE_SIZE = 100
+
+def parse_leaderboard_cursor(cursor: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    """A cursor is "wins.votes_received.user_id" of the last entry on the previous page."""
+    if not cursor:
+        return None
+    try:
+        wins, votes_received, user_id = (int(part) for part in cursor.split("."))
+    except ValueError:
+        raise ValueError(f"Invalid leaderboard cursor: {cursor}")
+    return wins, votes_received, user_id
+
+def _upsert(conn: Connection, table: Table, key: str, rows: List[Dict[str, any]], increment=()) -> None:
+    """Insert rows; on a key conflict overwrite the existing row's columns, except those named
+    in `increment`, which are added onto the stored value instead."""
+    if not rows:
+        return
+    if conn.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    statement = insert(table)
+    updates = {name: table.c[name] + statement.excluded[name] if name in increment else statement.excluded[name]
+               for name in rows[0] if name != key}
+    conn.execute(statement.on_conflict_do_update(index_elements=[key], set_=updates), rows)
+
+def _insert_ignore(conn: Connection, table: Table, rows: List[Dict[str, any]]) -> None:
+    """Insert rows, skipping those whose key is already stored."""
+    if not rows:
+        return
+    if conn.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    conn.execute(insert(table).on_conflict_do_nothing(), rows)
+
+POSTGRES_POOL_SIZE = 10
+POSTGRES_MAX_OVERFLOW = 20
+
+def _set_sqlite_pragmas(dbapi_conn, connection_record) -> None:
+    cursor = dbapi_conn.cursor()
+    for name, value in PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+def make_engine(url: str, read_only: bool = False) -> Engine:
+    """Pooled engine for a database URL. SQLite connections get the same pragmas as db.py."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        if read_only:
+            path = os.path.abspath(parsed.database)
+            url = f"sqlite:///file:{path}?mode=ro&uri=true"
+        engine = create_engine(
+            url,
+            pool_size=READER_POOL_SIZE if read_only else WRITER_POOL_SIZE,
+            max_overflow=READER_POOL_SIZE,
+            connect_args={"check_same_thread": False, "cached_statements": STATEMENT_CACHE_SIZE},
+        )
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+        if not read_only:
+            with engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA journal_mode = WAL")
+        return engine
+    return create_engine(url, pool_size=POSTGRES_POOL_SIZE, max_overflow=POSTGRES_MAX_OVERFLOW, pool_pre_ping=True)
+
+class GameRepository:
+    """All game data access. Write methods accept an open connection so callers can batch
+    several of them into one transaction; without one they run in their own."""
+
+    def __init__(self, engine: Engine, read_engine: Optional[Engine] = None):
+        self.engine = engine
+        self.read_engine = read_engine or engine
+
+    @classmethod
+    def from_url(cls, url: str) -> "GameRepository":
+        engine = make_engine(url)
+        read_engine = make_engine(url, read_only=True) if engine.dialect.name == "sqlite" else None
+        return cls(engine, read_engine)
+
+    @property
+    def is_sqlite(self) -> bool:
+        return self.engine.dialect.name == "sqlite"
+
+    def migrate(self) -> List[int]:
+        if not self.is_sqlite:
+            metadata.create_all(self.engine)
+            return []
+        raw = self.engine.raw_connection()
+        try:
+            return migrations.migrate(raw.driver_connection)
+        finally:
+            raw.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[Connection]:
+        with self.engine.begin() as conn:
+            yield conn
+
+    @contextmanager
+    def _read(self, conn: Optional[Connection]) -> Iterator[Connection]:
+        if conn is not None:
+            yield conn
+        else:
+            with self.read_engine.connect() as conn:
+                yield conn
+
+    @contextmanager
+    def _write(self, conn: Optional[Connection]) -> Iterator[Connection]:
+        if conn is not None:
+            yield conn
+        else:
+            with self.engine.begin() as conn:
+                yield conn
+
+    def dispose(self) -> None:
+        self.engine.dispose()
+        if self.read_engine is not self.engine:
+            self.read_engine.dispose()
+
+    # Users
+
+    def create_user(self, name: str, password: str) -> int:
+        try:
+            with self.engine.begin() as conn:
+                result = conn.execute(users.insert().values(Name=name, Password=password))
+                return result.inserted_primary_key[0]
+        except IntegrityError:
+            raise ValueError("Username already taken")
+
+    def rename_user(self, user_id: int, name: str) -> None:
+        # Checked by hand too: before migration 0002 there is no unique index to raise IntegrityError
+        with self.engine.begin() as conn:
+            if conn.execute(select(users.c.Id).where(users.c.Name == name, users.c.Id != user_id)).first():
+                raise ValueError("Username already taken")
+            if not conn.execute(update(users).where(users.c.Id == user_id).values(Name=name)).rowcount:
+                raise ValueError(f"No user with ID {user_id}")
+
+    def find_user(self, name: str, password: str) -> Optional[int]:
+        with self.read_engine.connect() as conn:
+            return conn.execute(
+                select(users.c.Id).where(users.c.Name == name, users.c.Password == password)
+            ).scalar()
+
+    def get_user_name(self, user_id: int) -> Optional[str]:
+        with self.read_engine.connect() as conn:
+            return conn.execute(select(users.c.Name).where(users.c.Id == user_id)).scalar()
+
+    def user_exists(self, user_id: int) -> bool:
+        with self.read_engine.connect() as conn:
+            return conn.execute(select(exists().where(users.c.Id == user_id))).scalar()
+
+    def get_user_names(self, user_ids) -> Dict[int, str]:
+        user_ids = list(set(user_ids))
+        if not user_ids:
+            return {}
+        with self.read_engine.connect() as conn:
+            return dict(conn.execute(select(users.c.Id, users.c.Name).where(users.c.Id.in_(user_ids))).all())
+
+    def list_users(self) -> List[Tuple[int, str]]:
+        with self.read_engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(select(users.c.Id, users.c.Name).order_by(users.c.Id))]
+
+    # Games
+
+    def create_game(self) -> int:
+        with self.engine.begin() as conn:
+            return conn.execute(games.insert().values(Winner_Id=None)).inserted_primary_key[0]
+
+    def add_participant(self, game_id: int, user_id: int, conn: Optional[Connection] = None) -> None:
+        with self._write(conn) as conn:
+            conn.execute(game_participants.insert().values(Game_Id=game_id, User_Id=user_id))
+
+    def set_winner(self, game_id: int, winner_id: int, conn: Optional[Connection] = None) -> None:
+        with self._write(conn) as conn:
+            conn.execute(update(games).where(games.c.Id == game_id)
+                         .values(Winner_Id=winner_id, Finished_At=utc_timestamp()))
+
+    def list_games(self) -> List[Tuple[int, Optional[str]]]:
+        query = (select(games.c.Id, users.c.Name)
+                 .select_from(games.outerjoin(users, games.c.Winner_Id == users.c.Id))
+                 .order_by(games.c.Id))
+        with self.read_engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+
+    def get_game(self, game_id: int) -> Optional[Tuple[int, Optional[str]]]:
+        query = (select(games.c.Id, users.c.Name)
+                 .select_from(games.outerjoin(users, games.c.Winner_Id == users.c.Id))
+                 .where(games.c.Id == game_id))
+        with self.read_engine.connect() as conn:
+            row = conn.execute(query).first()
+            return tuple(row) if row else None
+
+    def get_participant_names(self, game_id: int) -> List[str]:
+        query = (select(users.c.Name)
+                 .select_from(game_participants.join(users, game_participants.c.User_Id == users.c.Id))
+                 .where(game_participants.c.Game_Id == game_id))
+        with self.read_engine.connect() as conn:
+            return list(conn.execute(query).scalars())
+
+    # Votes
+
+    def record_round(self, game_id: int, round_number: int, ballots: List[Tuple[int, int]],
+                     tallies: Dict[int, int], winner_id: int, conn: Optional[Connection] = None) -> None:
+        """Store a decided round: one Votes row per (voter, voted_for) ballot and one RoundResults row per player."""
+        with self._write(conn) as conn:
+            if ballots:
+                conn.execute(votes.insert(), [
+                    {"Game_Id": game_id, "Round": round_number, "Voter_Id": voter_id, "Voted_For_Id": voted_for_id}
+                    for voter_id, voted_for_id in ballots])
+            if tallies:
+                conn.execute(round_results.insert(), [
+                    {"Game_Id": game_id, "Round": round_number, "User_Id": user_id, "Votes": count,
+                     "Won": int(user_id == winner_id)}
+                    for user_id, count in tallies.items()])
+
+    def get_user_votes(self, user_id: int) -> List[Tuple[int, int, int]]:
+        """(game_id, round, voted_for_id) for every ballot the user cast."""
+        query = (select(votes.c.Game_Id, votes.c.Round, votes.c.Voted_For_Id)
+                 .where(votes.c.Voter_Id == user_id)
+                 .order_by(votes.c.Game_Id.desc(), votes.c.Round))
+        with self.read_engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+
+    def get_round_results(self, game_id: int) -> List[Tuple[int, int, int, bool]]:
+        """(round, user_id, votes, won) for every player in every decided round of a game."""
+        query = (select(round_results.c.Round, round_results.c.User_Id, round_results.c.Votes, round_results.c.Won)
+                 .where(round_results.c.Game_Id == game_id)
+                 .order_by(round_results.c.Round, round_results.c.Votes.desc()))
+        with self.read_engine.connect() as conn:
+            return [(rnd, user_id, count, bool(won)) for rnd, user_id, count, won in conn.execute(query)]
+
+    # Stats
+
+    def add_round_stats(self, tallies: Dict[int, int], winner_id: int, conn: Optional[Connection] = None) -> None:
+        with self._write(conn) as conn:
+            _upsert(conn, user_stats, "User_Id", [
+                {"User_Id": user_id, "Rounds_Played": 1, "Rounds_Won": int(user_id == winner_id), "Votes_Received": count}
+                for user_id, count in tallies.items()], increment=STAT_COLUMNS)
+
+    def add_game_stats(self, player_ids: List[int], winner_id: int, conn: Optional[Connection] = None) -> None:
+        with self._write(conn) as conn:
+            _upsert(conn, user_stats, "User_Id", [
+                {"User_Id": user_id, "Games_Played": 1, "Wins": int(user_id == winner_id)} for user_id in player_ids],
+                increment=STAT_COLUMNS)
+
+    def get_leaderboard(self, limit: int = LEADERBOARD_PAGE_SIZE,
+                        after: Optional[Tuple[int, int, int]] = None) -> List[Dict[str, any]]:
+        """One page of users by wins, then votes received. Keyset pagination: `after` is the sort key of
+        the previous page's last entry, so every page is a range scan of idx_userstats_leaderboard."""
+        sort_key = tuple_(user_stats.c.Wins, user_stats.c.Votes_Received, user_stats.c.User_Id)
+        query = (select(user_stats, users.c.Name)
+                 .select_from(user_stats.join(users, user_stats.c.User_Id == users.c.Id))
+                 .order_by(user_stats.c.Wins.desc(), user_stats.c.Votes_Received.desc(), user_stats.c.User_Id.desc())
+                 .limit(limit))
+        if after is not None:
+            query = query.where(sort_key < tuple_(*after))
+        with self.read_engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(query)]
+
+    def collect_user_stats(self) -> Dict[int, Dict[str, int]]:
+        """Recount every user's stats from RoundResults and the finished games in this database."""
+        stats: Dict[int, Dict[str, int]] = {}
+        def entry(user_id):
+            return stats.setdefault(user_id, dict.fromkeys(STAT_COLUMNS, 0))
+        rounds = (select(round_results.c.User_Id, func.count(), func.sum(round_results.c.Won),
+                         func.sum(round_results.c.Votes))
+                  .group_by(round_results.c.User_Id))
+        finished = (select(game_participants.c.User_Id, func.count(),
+                           func.sum(case((games.c.Winner_Id == game_participants.c.User_Id, 1), else_=0)))
+                    .select_from(game_participants.join(games, game_participants.c.Game_Id == games.c.Id))
+                    .where(games.c.Winner_Id.is_not(None))
+                    .group_by(game_participants.c.User_Id))
+        with self.read_engine.connect() as conn:
+            for user_id, played, won, received in conn.execute(rounds):
+                entry(user_id).update(Rounds_Played=played, Rounds_Won=won, Votes_Received=received)
+            for user_id, played, won in conn.execute(finished):
+                entry(user_id).update(Games_Played=played, Wins=won)
+        return stats
+
+    def replace_user_stats(self, stats: Dict[int, Dict[str, int]]) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(user_stats.delete())
+            if stats:
+                conn.execute(user_stats.insert(), [{"User_Id": user_id, **counters} for user_id, counters in stats.items()])
+
+    def rebuild_user_stats(self) -> int:
+        """Full recount for backfills. Games that have been archived are no longer counted."""
+        stats = self.collect_user_stats()
+        self.replace_user_stats(stats)
+        return len(stats)
+
+    # Ratings
+
+    def get_ratings(self, user_ids, conn: Optional[Connection] = None) -> Dict[int, Tuple[float, int]]:
+        """{user_id: (rating, games)} for the users that have a rating. Pass the writer's connection
+        to read inside the transaction that will store the update."""
+        user_ids = list(set(user_ids))
+        if not user_ids:
+            return {}
+        query = select(ratings.c.User_Id, ratings.c.Rating, ratings.c.Games).where(ratings.c.User_Id.in_(user_ids))
+        with self._read(conn) as conn:
+            return {user_id: (rating, played) for user_id, rating, played in conn.execute(query)}
+
+    def save_game_ratings(self, new_ratings: Dict[int, float], conn: Optional[Connection] = None) -> None:
+        """Store the ratings after one more game for each of these users."""
+        with self._write(conn) as conn:
+            _upsert(conn, ratings, "User_Id", [{"User_Id": user_id, "Rating": rating, "Games": 1}
+                                               for user_id, rating in new_ratings.items()], increment=("Games",))
+
+    def replace_ratings(self, all_ratings: Dict[int, Tuple[float, int]]) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(ratings.delete())
+            if all_ratings:
+                conn.execute(ratings.insert(), [{"User_Id": user_id, "Rating": rating, "Games": played}
+                                                for user_id, (rating, played) in all_ratings.items()])
+
+    def get_game_outcomes(self) -> Tuple[List[int], List[Tuple[int, int, int, int]]]:
+        """Finished games in the order they ended, and their (game_id, round, user_id, votes) outcome rows."""
+        finished = (select(games.c.Id).where(games.c.Winner_Id.is_not(None))
+                    .order_by(games.c.Finished_At, games.c.Id))
+        outcomes = (select(round_results.c.Game_Id, round_results.c.Round, round_results.c.User_Id, round_results.c.Votes)
+                    .select_from(round_results.join(games, round_results.c.Game_Id == games.c.Id))
+                    .where(games.c.Winner_Id.is_not(None)))
+        with self.read_engine.connect() as conn:
+            return list(conn.execute(finished).scalars()), [tuple(row) for row in conn.execute(outcomes)]
+
+    # Images
+
+    def insert_image(self, prompt: str, game_id: int, user_id: int, conn: Optional[Connection] = None) -> int:
+        with self._write(conn) as conn:
+            result = conn.execute(images.insert().values(Prompt=prompt, Game_Id=game_id, User_Id=user_id))
+            return result.inserted_primary_key[0]
+
+    def insert_vector(self, image_id: int, vector: bytes, dim: int, version: str,
+                      conn: Optional[Connection] = None) -> int:
+        with self._write(conn) as conn:
+            vector_id = conn.execute(
+                vector_index.insert().values(Vector_embeddings=vector, Image_Id=image_id, Dim=dim, Version=version)
+            ).inserted_primary_key[0]
+            conn.execute(update(images).where(images.c.Id == image_id).values(Vector_Id=vector_id))
+            return vector_id
+
+    def set_image_hashes(self, image_id: int, dhash: int, phash: int, conn: Optional[Connection] = None) -> None:
+        with self._write(conn) as conn:
+            conn.execute(update(images).where(images.c.Id == image_id)
+                         .values(DHash=to_signed(dhash), PHash=to_signed(phash)))
+
+    def load_image_hashes(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(image_ids, dhashes, phashes) of every hashed image; hashes as uint64."""
+        query = select(images.c.Id, images.c.DHash, images.c.PHash).where(images.c.PHash.is_not(None))
+        with self.read_engine.connect() as conn:
+            rows = conn.execute(query).all()
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        # Signed int64 -> uint64 is a reinterpretation of the same bits
+        dhashes = np.array([row[1] for row in rows], dtype=np.int64).view(np.uint64)
+        phashes = np.array([row[2] for row in rows], dtype=np.int64).view(np.uint64)
+        return ids, dhashes, phashes
+
+    def find_image_by_prompt(self, prompt: str) -> Optional[int]:
+        """The latest generated image (one with hashes, not a prompt-only row) for exactly this prompt."""
+        query = (select(images.c.Id)
+                 .where(images.c.Prompt == prompt, images.c.PHash.is_not(None))
+                 .order_by(images.c.Id.desc())
+                 .limit(1))
+        with self.read_engine.connect() as conn:
+            return conn.execute(query).scalar()
+
+    def insert_prompt_vectors(self, rows: List[Tuple[int, bytes, int, str]], conn: Optional[Connection] = None) -> None:
+        """Store (image_id, blob, dim, version) prompt embeddings, replacing earlier ones."""
+        with self._write(conn) as conn:
+            _upsert(conn, prompt_vectors, "Image_Id",
+                    [{"Image_Id": image_id, "Vector": blob, "Dim": dim, "Version": version}
+                     for image_id, blob, dim, version in rows])
+
+    def list_prompts_to_embed(self, version: str, after_id: int = 0, limit: int = 256) -> List[Tuple[int, str]]:
+        """(image_id, prompt) above after_id, ascending, of prompts without an embedding of this version."""
+        query = (select(images.c.Id, images.c.Prompt)
+                 .select_from(images.outerjoin(prompt_vectors, images.c.Id == prompt_vectors.c.Image_Id))
+                 .where(images.c.Id > after_id, prompt_vectors.c.Version.is_distinct_from(version))
+                 .order_by(images.c.Id)
+                 .limit(limit))
+        with self.read_engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+
+    def load_prompt_vectors(self, version: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(image_ids, matrix) of every prompt embedded with this text model version."""
+        query = (select(prompt_vectors.c.Image_Id, prompt_vectors.c.Vector, prompt_vectors.c.Dim)
+                 .where(prompt_vectors.c.Version == version)
+                 .order_by(prompt_vectors.c.Image_Id))
+        with self.read_engine.connect() as conn:
+            rows = conn.execute(query).all()
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+        return np.array([row[0] for row in rows], dtype=np.int64), stack_blobs((row[1] for row in rows), rows[0][2])
+
+    def list_prompts(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]:
+        """(image_ids, game_ids, user_ids, prompts) of every Images row, ordered by game and image ID."""
+        query = select(images.c.Id, images.c.Game_Id, images.c.User_Id, images.c.Prompt).order_by(images.c.Game_Id, images.c.Id)
+        with self.read_engine.connect() as conn:
+            rows = conn.execute(query).all()
+        return (np.array([row[0] for row in rows], dtype=np.int64), np.array([row[1] for row in rows], dtype=np.int64),
+                np.array([row[2] for row in rows], dtype=np.int64), [row[3] for row in rows])
+
+    def insert_prompt_signatures(self, rows: List[Tuple[int, bytes, List[int]]], conn: Optional[Connection] = None) -> None:
+        """Store (image_id, signature, buckets) MinHash rows."""
+        with self._write(conn) as conn:
+            _upsert(conn, prompt_signatures, "Image_Id",
+                    [{"Image_Id": image_id, "Signature": signature} for image_id, signature, _ in rows])
+            _insert_ignore(conn, prompt_buckets, [{"Bucket": bucket, "Image_Id": image_id}
+                                                  for image_id, _, buckets in rows for bucket in buckets])
+
+    def find_prompt_candidates(self, buckets: List[int], limit: int) -> List[Tuple[int, int, bytes]]:
+        """(image_id, user_id, signature) of up to `limit` indexed prompts sharing a bucket, those
+        sharing the most buckets (the likeliest near-duplicates) first."""
+        matches = (select(prompt_buckets.c.Image_Id).where(prompt_buckets.c.Bucket.in_(buckets))
+                   .group_by(prompt_buckets.c.Image_Id)
+                   .order_by(func.count().desc(), prompt_buckets.c.Image_Id.desc())
+                   .limit(limit).subquery())
+        query = (select(images.c.Id, images.c.User_Id, prompt_signatures.c.Signature)
+                 .join(prompt_signatures, prompt_signatures.c.Image_Id == images.c.Id)
+                 .where(images.c.Id.in_(select(matches.c.Image_Id))))
+        with self.read_engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+
+    def list_prompts_to_sign(self, after_id: int = 0, limit: int = 1000) -> List[Tuple[int, str]]:
+        """(image_id, prompt) above after_id, ascending, of player prompts without a MinHash signature."""
+        query = (select(images.c.Id, images.c.Prompt)
+                 .select_from(images.outerjoin(prompt_signatures, images.c.Id == prompt_signatures.c.Image_Id))
+                 .where(images.c.Id > after_id, images.c.User_Id != 0, prompt_signatures.c.Image_Id.is_(None))
+                 .order_by(images.c.Id)
+                 .limit(limit))
+        with self.read_engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+
+    def get_prompts(self, image_ids) -> Dict[int, str]:
+        image_ids = list(set(image_ids))
+        if not image_ids:
+            return {}
+        with self.read_engine.connect() as conn:
+            return dict(conn.execute(select(images.c.Id, images.c.Prompt).where(images.c.Id.in_(image_ids))).all())
+
+    def get_vectors(self, image_ids) -> Dict[int, Tuple[bytes, int, str]]:
+        """{image_id: (blob, dim, version)} of the current vector of each image that has one."""
+        image_ids = list(set(image_ids))
+        if not image_ids:
+            return {}
+        query = (select(images.c.Id, vector_index.c.Vector_embeddings, vector_index.c.Dim, vector_index.c.Version)
+                 .select_from(images.join(vector_index, images.c.Vector_Id == vector_index.c.Id))
+                 .where(images.c.Id.in_(image_ids)))
+        with self.read_engine.connect() as conn:
+            return {image_id: (blob, dim, version) for image_id, blob, dim, version in conn.execute(query)}
+
+    def list_vector_image_ids(self, version: str) -> List[int]:
+        query = (select(images.c.Id)
+                 .select_from(images.join(vector_index, images.c.Vector_Id == vector_index.c.Id))
+                 .where(vector_index.c.Version == version))
+        with self.read_engine.connect() as conn:
+            return list(conn.execute(query).scalars())
+
+    def list_images_to_embed(self, version: str, after_id: int = 0, limit: int = 256) -> List[int]:
+        """IDs above after_id, ascending, of images without a vector of this model version."""
+        query = (select(images.c.Id)
+                 .select_from(images.outerjoin(vector_index, images.c.Vector_Id == vector_index.c.Id))
+                 .where(images.c.Id > after_id, vector_index.c.Version.is_distinct_from(version))
+                 .order_by(images.c.Id)
+                 .limit(limit))
+        with self.read_engine.connect() as conn:
+            return list(conn.execute(query).scalars())
+
+    def load_vectors(self, version: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(image_ids, matrix) of the current vector of every image embedded with this model version."""
+        query = (select(images.c.Id, vector_index.c.Vector_embeddings, vector_index.c.Dim)
+                 .select_from(images.join(vector_index, images.c.Vector_Id == vector_index.c.Id))
+                 .where(vector_index.c.Version == version)
+                 .order_by(images.c.Id))
+        with self.read_engine.connect() as conn:
+            rows = conn.execute(query).all()
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+        return np.array([row[0] for row in rows], dtype=np.int64), stack_blobs((row[1] for row in rows), rows[0][2])
+
+    def get_game_images(self, game_id: int) -> List[Tuple[int, str, str]]:
+        query = (select(images.c.Id, images.c.Prompt, users.c.Name)
+                 .select_from(images.join(users, images.c.User_Id == users.c.Id))
+                 .where(images.c.Game_Id == game_id))
+        with self.read_engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+
+    def get_image_details(self, image_id: int) -> Optional[Tuple[int, str, str, int, Optional[int]]]:
+        query = (select(images.c.Id, images.c.Prompt, users.c.Name, games.c.Id, vector_index.c.Id)
+                 .select_from(images
+                              .join(users, images.c.User_Id == users.c.Id)
+                              .join(games, images.c.Game_Id == games.c.Id)
+                              .outerjoin(vector_index, images.c.Vector_Id == vector_index.c.Id))
+                 .where(images.c.Id == image_id))
+        with self.read_engine.connect() as conn:
+            row = conn.execute(query).first()
+            return tuple(row) if row else None
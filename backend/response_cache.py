@@ -0,0 +1,53 @@
+import threading
+from typing import Callable, Dict, Hashable, Optional, Tuple
+import orjson
+from flask import Response
+
+CachedBody = Tuple[bytes, int]
+# Bound on the entries kept. Endpoints are fixed and per-player keys only exist for the players of
+# the game, so this is a backstop against a caller keying on unchecked client input.
+MAX_ENTRIES = 256
+
+class ResponseCache:
+    """Pre-serialized JSON responses, one entry per (game_id, endpoint) tagged with the game version.
+
+    Reads are lock-free: a hit only needs the current version number. A newer version
+    replaces the old entry, so the cache never holds more than one body per endpoint.
+    The server runs one game at a time, so caching for a new game drops the finished one's entries.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.entries: Dict[Tuple[Optional[int], Hashable], Tuple[int, CachedBody]] = {}
+        self.max_entries = max_entries
+        self.game_id: Optional[int] = None
+        self.lock = threading.Lock()
+
+    def get(self, key: Tuple[Optional[int], Hashable], version: int) -> Optional[CachedBody]:
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        return None
+
+    def put(self, key: Tuple[Optional[int], Hashable], version: int, body: CachedBody) -> None:
+        with self.lock:
+            if key[0] != self.game_id:
+                self.entries.clear()
+                self.game_id = key[0]
+            entry = self.entries.get(key)
+            if entry is None and len(self.entries) >= self.max_entries:
+                # Dicts keep insertion order: drop the oldest entry
+                del self.entries[next(iter(self.entries))]
+            if entry is None or entry[0] <= version:
+                self.entries[key] = (version, body)
+
+    def respond(self, game, endpoint: Hashable, build: Callable[[], Tuple[dict, int]]) -> Response:
+        key = (game.game_id, endpoint)
+        version = game.version
+        body = self.get(key, version)
+        if body is None:
+            payload, status_code = build()
+            body = (orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS), status_code)
+            # Only cache if no state change happened while the payload was being built
+            if game.version == version:
+                self.put(key, version, body)
+        return Response(body[0], status=body[1], mimetype="application/json")
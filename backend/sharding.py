@@ -0,0 +1,379 @@
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.engine import Connection, make_url
+from repository import (GameRepository, games, images, game_participants, vector_index, votes, STAT_COLUMNS,
+                        LEADERBOARD_PAGE_SIZE)
+
+# Game and image IDs carry their shard: global_id = local_id * shard_count + shard.
+# Routing is then a plain modulo, and IDs (and image file names) stay unique across shards.
+
+def split_id(global_id: int, shard_count: int) -> Tuple[int, int]:
+    local_id, shard = divmod(global_id, shard_count)
+    return shard, local_id
+
+def join_id(local_id: int, shard: int, shard_count: int) -> int:
+    return local_id * shard_count + shard
+
+def shard_url(catalog_url: str, shard: int) -> str:
+    url = make_url(catalog_url)
+    root, ext = os.path.splitext(url.database)
+    return str(url.set(database=f"{root}_shard{shard}{ext or '.db'}"))
+
+def sqlite_paths(database_url: str, shard_count: int = 0) -> List[str]:
+    """Database files behind a SQLite URL, catalog first; empty for other backends."""
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite":
+        return []
+    urls = [database_url] + [shard_url(database_url, shard) for shard in range(shard_count if shard_count > 1 else 0)]
+    return [make_url(u).database for u in urls]
+
+def open_repository(database_url: str, shard_count: int = 0):
+    """GameRepository for a single database, or a ShardedGameRepository when shard_count > 1."""
+    if shard_count > 1:
+        return ShardedGameRepository.from_url(database_url, shard_count)
+    return GameRepository.from_url(database_url)
+
+class ShardedTransaction:
+    """Opens one transaction per shard the first time that shard is written to.
+    Shards commit independently when the block exits; there is no cross-shard atomicity."""
+
+    def __init__(self, repo: "ShardedGameRepository", stack: ExitStack):
+        self.repo = repo
+        self.stack = stack
+        self.connections = {}
+
+    def connection(self, shard: int) -> Connection:
+        if shard not in self.connections:
+            self.connections[shard] = self.stack.enter_context(self.repo.shards[shard].transaction())
+        return self.connections[shard]
+
+    def catalog_connection(self) -> Connection:
+        if "catalog" not in self.connections:
+            self.connections["catalog"] = self.stack.enter_context(self.repo.catalog.transaction())
+        return self.connections["catalog"]
+
+class ShardedGameRepository:
+    """Same API as GameRepository. Users live in the catalog database; Game, Images,
+    GameParticipants and VectorIndex rows live in the shard chosen by their game ID."""
+
+    def __init__(self, catalog: GameRepository, shards: List[GameRepository]):
+        self.catalog = catalog
+        self.shards = shards
+        self.shard_count = len(shards)
+        self.next_shard = itertools.cycle(range(self.shard_count))
+        self.next_shard_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.shard_count, thread_name_prefix="shard")
+
+    @classmethod
+    def from_url(cls, catalog_url: str, shard_count: int) -> "ShardedGameRepository":
+        shards = [GameRepository.from_url(shard_url(catalog_url, shard)) for shard in range(shard_count)]
+        return cls(GameRepository.from_url(catalog_url), shards)
+
+    @property
+    def is_sqlite(self) -> bool:
+        return self.catalog.is_sqlite
+
+    def migrate(self) -> List[int]:
+        applied = self.catalog.migrate()
+        for shard in self.shards:
+            shard.migrate()
+        return applied
+
+    @contextmanager
+    def transaction(self) -> Iterator[ShardedTransaction]:
+        with ExitStack() as stack:
+            yield ShardedTransaction(self, stack)
+
+    def dispose(self) -> None:
+        self.catalog.dispose()
+        for shard in self.shards:
+            shard.dispose()
+        self.executor.shutdown()
+
+    def _route(self, global_id: int, conn: Optional[ShardedTransaction]) -> Tuple[int, int, GameRepository, Optional[Connection]]:
+        shard, local_id = split_id(global_id, self.shard_count)
+        return shard, local_id, self.shards[shard], conn.connection(shard) if conn is not None else None
+
+    # Cross-shard helpers
+
+    def map_shards(self, fn: Callable[[int, GameRepository], list]) -> List[list]:
+        """Run fn(shard_index, shard_repo) on every shard in parallel and return the results in shard order."""
+        return list(self.executor.map(lambda shard: fn(shard, self.shards[shard]), range(self.shard_count)))
+
+    def query_all_shards(self, statement) -> List[Tuple[int, tuple]]:
+        """Execute the same Core statement on every shard; returns (shard, row) pairs.
+        IDs in the rows are shard-local, translate them with join_id()."""
+        def run(shard, repo):
+            with repo.read_engine.connect() as conn:
+                return [(shard, tuple(row)) for row in conn.execute(statement)]
+        return [row for rows in self.map_shards(run) for row in rows]
+
+    # Users
+
+    def create_user(self, name: str, password: str) -> int:
+        return self.catalog.create_user(name, password)
+
+    def rename_user(self, user_id: int, name: str) -> None:
+        self.catalog.rename_user(user_id, name)
+
+    def find_user(self, name: str, password: str) -> Optional[int]:
+        return self.catalog.find_user(name, password)
+
+    def get_user_name(self, user_id: int) -> Optional[str]:
+        return self.catalog.get_user_name(user_id)
+
+    def get_user_names(self, user_ids):
+        return self.catalog.get_user_names(user_ids)
+
+    def user_exists(self, user_id: int) -> bool:
+        return self.catalog.user_exists(user_id)
+
+    def list_users(self) -> List[Tuple[int, str]]:
+        return self.catalog.list_users()
+
+    # Games
+
+    def create_game(self) -> int:
+        with self.next_shard_lock:
+            shard = next(self.next_shard)
+        return join_id(self.shards[shard].create_game(), shard, self.shard_count)
+
+    def add_participant(self, game_id: int, user_id: int, conn: Optional[ShardedTransaction] = None) -> None:
+        _, local_id, repo, shard_conn = self._route(game_id, conn)
+        repo.add_participant(local_id, user_id, shard_conn)
+
+    def set_winner(self, game_id: int, winner_id: int, conn: Optional[ShardedTransaction] = None) -> None:
+        _, local_id, repo, shard_conn = self._route(game_id, conn)
+        repo.set_winner(local_id, winner_id, shard_conn)
+
+    def list_games(self) -> List[Tuple[int, Optional[str]]]:
+        rows = [(join_id(game_id, shard, self.shard_count), winner_id)
+                for shard, (game_id, winner_id) in self.query_all_shards(select(games.c.Id, games.c.Winner_Id))]
+        names = self.catalog.get_user_names(winner_id for _, winner_id in rows if winner_id is not None)
+        return sorted((game_id, names.get(winner_id)) for game_id, winner_id in rows)
+
+    def get_game(self, game_id: int) -> Optional[Tuple[int, Optional[str]]]:
+        _, local_id, repo, _ = self._route(game_id, None)
+        with repo.read_engine.connect() as conn:
+            winner_id = conn.execute(select(games.c.Winner_Id).where(games.c.Id == local_id)).first()
+        if winner_id is None:
+            return None
+        return game_id, self.catalog.get_user_name(winner_id[0]) if winner_id[0] is not None else None
+
+    def get_participant_names(self, game_id: int) -> List[str]:
+        _, local_id, repo, _ = self._route(game_id, None)
+        with repo.read_engine.connect() as conn:
+            user_ids = list(conn.execute(
+                select(game_participants.c.User_Id).where(game_participants.c.Game_Id == local_id)).scalars())
+        names = self.catalog.get_user_names(user_ids)
+        return [names[user_id] for user_id in user_ids if user_id in names]
+
+    # Votes
+
+    def record_round(self, game_id: int, round_number: int, ballots, tallies, winner_id: int,
+                     conn: Optional[ShardedTransaction] = None) -> None:
+        _, local_id, repo, shard_conn = self._route(game_id, conn)
+        repo.record_round(local_id, round_number, ballots, tallies, winner_id, shard_conn)
+
+    def get_user_votes(self, user_id: int) -> List[Tuple[int, int, int]]:
+        statement = select(votes.c.Game_Id, votes.c.Round, votes.c.Voted_For_Id).where(votes.c.Voter_Id == user_id)
+        rows = [(join_id(game_id, shard, self.shard_count), rnd, voted_for_id)
+                for shard, (game_id, rnd, voted_for_id) in self.query_all_shards(statement)]
+        return sorted(rows, key=lambda row: (-row[0], row[1]))
+
+    def get_round_results(self, game_id: int) -> List[Tuple[int, int, int, bool]]:
+        _, local_id, repo, _ = self._route(game_id, None)
+        return repo.get_round_results(local_id)
+
+    # Stats (kept in the catalog next to Users)
+
+    def add_round_stats(self, tallies, winner_id: int, conn: Optional[ShardedTransaction] = None) -> None:
+        self.catalog.add_round_stats(tallies, winner_id, conn.catalog_connection() if conn is not None else None)
+
+    def add_game_stats(self, player_ids, winner_id: int, conn: Optional[ShardedTransaction] = None) -> None:
+        self.catalog.add_game_stats(player_ids, winner_id, conn.catalog_connection() if conn is not None else None)
+
+    def get_leaderboard(self, limit: int = LEADERBOARD_PAGE_SIZE, after=None):
+        return self.catalog.get_leaderboard(limit, after)
+
+    def rebuild_user_stats(self) -> int:
+        stats = {}
+        for shard_stats in self.map_shards(lambda shard, repo: repo.collect_user_stats()):
+            for user_id, counters in shard_stats.items():
+                total = stats.setdefault(user_id, dict.fromkeys(STAT_COLUMNS, 0))
+                for name, value in counters.items():
+                    total[name] += value
+        self.catalog.replace_user_stats(stats)
+        return len(stats)
+
+    # Ratings (kept in the catalog next to Users)
+
+    def get_ratings(self, user_ids, conn: Optional[ShardedTransaction] = None):
+        return self.catalog.get_ratings(user_ids, conn.catalog_connection() if conn is not None else None)
+
+    def save_game_ratings(self, new_ratings, conn: Optional[ShardedTransaction] = None) -> None:
+        self.catalog.save_game_ratings(new_ratings, conn.catalog_connection() if conn is not None else None)
+
+    def replace_ratings(self, all_ratings) -> None:
+        self.catalog.replace_ratings(all_ratings)
+
+    def get_game_outcomes(self):
+        finished = (select(games.c.Finished_At, games.c.Id).where(games.c.Winner_Id.is_not(None)))
+        order = sorted((finished_at, join_id(game_id, shard, self.shard_count))
+                       for shard, (finished_at, game_id) in self.query_all_shards(finished))
+        outcomes = []
+        for shard, (_, outcome) in enumerate(self.map_shards(lambda shard, repo: repo.get_game_outcomes())):
+            outcomes.extend((join_id(game_id, shard, self.shard_count), rnd, user_id, votes)
+                            for game_id, rnd, user_id, votes in outcome)
+        return [game_id for _, game_id in order], outcomes
+
+    # Images
+
+    def insert_image(self, prompt: str, game_id: int, user_id: int, conn: Optional[ShardedTransaction] = None) -> int:
+        shard, local_id, repo, shard_conn = self._route(game_id, conn)
+        return join_id(repo.insert_image(prompt, local_id, user_id, shard_conn), shard, self.shard_count)
+
+    def insert_vector(self, image_id: int, vector: bytes, dim: int, version: str,
+                      conn: Optional[ShardedTransaction] = None) -> int:
+        _, local_id, repo, shard_conn = self._route(image_id, conn)
+        return repo.insert_vector(local_id, vector, dim, version, shard_conn)
+
+    def set_image_hashes(self, image_id: int, dhash: int, phash: int, conn: Optional[ShardedTransaction] = None) -> None:
+        _, local_id, repo, shard_conn = self._route(image_id, conn)
+        repo.set_image_hashes(local_id, dhash, phash, shard_conn)
+
+    def load_image_hashes(self):
+        parts = self.map_shards(lambda shard, repo: repo.load_image_hashes())
+        ids = np.concatenate([local_ids * self.shard_count + shard for shard, (local_ids, _, _) in enumerate(parts)])
+        return ids, np.concatenate([part[1] for part in parts]), np.concatenate([part[2] for part in parts])
+
+    def find_image_by_prompt(self, prompt: str) -> Optional[int]:
+        found = [join_id(local_id, shard, self.shard_count)
+                 for shard, local_id in enumerate(self.map_shards(lambda shard, repo: repo.find_image_by_prompt(prompt)))
+                 if local_id is not None]
+        return max(found) if found else None
+
+    def insert_prompt_vectors(self, rows, conn: Optional[ShardedTransaction] = None) -> None:
+        by_shard = {}
+        for image_id, blob, dim, version in rows:
+            shard, local_id = split_id(image_id, self.shard_count)
+            by_shard.setdefault(shard, []).append((local_id, blob, dim, version))
+        for shard, shard_rows in by_shard.items():
+            self.shards[shard].insert_prompt_vectors(shard_rows, conn.connection(shard) if conn is not None else None)
+
+    def list_prompts_to_embed(self, version: str, after_id: int = 0, limit: int = 256) -> List[Tuple[int, str]]:
+        def first_local(shard: int) -> int:
+            return max((after_id - shard) // self.shard_count, -1)
+        found = self.map_shards(lambda shard, repo: [(join_id(local_id, shard, self.shard_count), prompt)
+                                                     for local_id, prompt in repo.list_prompts_to_embed(version, first_local(shard), limit)])
+        return sorted(itertools.chain.from_iterable(found))[:limit]
+
+    def load_prompt_vectors(self, version: str):
+        parts = [(join_id(ids, shard, self.shard_count), matrix)
+                 for shard, (ids, matrix) in enumerate(self.map_shards(lambda shard, repo: repo.load_prompt_vectors(version)))
+                 if len(ids)]
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate([ids for ids, _ in parts]), np.concatenate([matrix for _, matrix in parts])
+
+    def list_prompts(self):
+        parts = self.map_shards(lambda shard, repo: repo.list_prompts())
+        image_ids = np.concatenate([join_id(part[0], shard, self.shard_count) for shard, part in enumerate(parts)])
+        game_ids = np.concatenate([join_id(part[1], shard, self.shard_count) for shard, part in enumerate(parts)])
+        user_ids = np.concatenate([part[2] for part in parts])
+        prompts = list(itertools.chain.from_iterable(part[3] for part in parts))
+        # A game's images all live on its shard, so image ID order within a game survives the merge
+        order = np.lexsort((image_ids, game_ids))
+        return image_ids[order], game_ids[order], user_ids[order], [prompts[i] for i in order]
+
+    def insert_prompt_signatures(self, rows, conn: Optional[ShardedTransaction] = None) -> None:
+        by_shard = {}
+        for image_id, signature, buckets in rows:
+            shard, local_id = split_id(image_id, self.shard_count)
+            by_shard.setdefault(shard, []).append((local_id, signature, buckets))
+        for shard, shard_rows in by_shard.items():
+            self.shards[shard].insert_prompt_signatures(shard_rows, conn.connection(shard) if conn is not None else None)
+
+    def find_prompt_candidates(self, buckets: List[int], limit: int) -> List[Tuple[int, int, bytes]]:
+        found = self.map_shards(lambda shard, repo: [(join_id(local_id, shard, self.shard_count), user_id, signature)
+                                                     for local_id, user_id, signature in repo.find_prompt_candidates(buckets, limit)])
+        # Each shard sends its best `limit`; find_copy scores them all
+        return list(itertools.chain.from_iterable(found))
+
+    def list_prompts_to_sign(self, after_id: int = 0, limit: int = 1000) -> List[Tuple[int, str]]:
+        def first_local(shard: int) -> int:
+            return max((after_id - shard) // self.shard_count, -1)
+        found = self.map_shards(lambda shard, repo: [(join_id(local_id, shard, self.shard_count), prompt)
+                                                     for local_id, prompt in repo.list_prompts_to_sign(first_local(shard), limit)])
+        return sorted(itertools.chain.from_iterable(found))[:limit]
+
+    def get_prompts(self, image_ids):
+        by_shard = {}
+        for image_id in set(image_ids):
+            shard, local_id = split_id(image_id, self.shard_count)
+            by_shard.setdefault(shard, []).append(local_id)
+        return {join_id(local_id, shard, self.shard_count): prompt
+                for shard, local_ids in by_shard.items()
+                for local_id, prompt in self.shards[shard].get_prompts(local_ids).items()}
+
+    def get_vectors(self, image_ids):
+        by_shard = {}
+        for image_id in set(image_ids):
+            shard, local_id = split_id(image_id, self.shard_count)
+            by_shard.setdefault(shard, []).append(local_id)
+        vectors = {}
+        for shard, local_ids in by_shard.items():
+            for local_id, row in self.shards[shard].get_vectors(local_ids).items():
+                vectors[join_id(local_id, shard, self.shard_count)] = row
+        return vectors
+
+    def list_vector_image_ids(self, version: str) -> List[int]:
+        return [join_id(image_id, shard, self.shard_count)
+                for shard, ids in enumerate(self.map_shards(lambda shard, repo: repo.list_vector_image_ids(version)))
+                for image_id in ids]
+
+    def list_images_to_embed(self, version: str, after_id: int = 0, limit: int = 256) -> List[int]:
+        # Local IDs above after_id on shard s are the ones with local * N + s > after_id
+        def first_local(shard: int) -> int:
+            return max((after_id - shard) // self.shard_count, -1)
+        found = self.map_shards(lambda shard, repo: [join_id(local_id, shard, self.shard_count)
+                                                     for local_id in repo.list_images_to_embed(version, first_local(shard), limit)])
+        return sorted(itertools.chain.from_iterable(found))[:limit]
+
+    def load_vectors(self, version: str):
+        parts = [(join_id(ids, shard, self.shard_count), matrix)
+                 for shard, (ids, matrix) in enumerate(self.map_shards(lambda shard, repo: repo.load_vectors(version)))
+                 if len(ids)]
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate([ids for ids, _ in parts]), np.concatenate([matrix for _, matrix in parts])
+
+    def get_game_images(self, game_id: int) -> List[Tuple[int, str, str]]:
+        shard, local_id, repo, _ = self._route(game_id, None)
+        with repo.read_engine.connect() as conn:
+            rows = conn.execute(select(images.c.Id, images.c.Prompt, images.c.User_Id)
+                                .where(images.c.Game_Id == local_id)).all()
+        names = self.catalog.get_user_names(user_id for _, _, user_id in rows)
+        return [(join_id(image_id, shard, self.shard_count), prompt, names[user_id])
+                for image_id, prompt, user_id in rows if user_id in names]
+
+    def get_image_details(self, image_id: int) -> Optional[Tuple[int, str, str, int, Optional[int]]]:
+        shard, local_id, repo, _ = self._route(image_id, None)
+        with repo.read_engine.connect() as conn:
+            row = conn.execute(
+                select(images.c.Prompt, images.c.User_Id, images.c.Game_Id, vector_index.c.Id)
+                .select_from(images.outerjoin(vector_index, images.c.Vector_Id == vector_index.c.Id))
+                .where(images.c.Id == local_id)).first()
+        if row is None:
+            return None
+        prompt, user_id, game_id, vector_id = row
+        name = self.catalog.get_user_name(user_id)
+        if name is None:
+            return None
+        return image_id, prompt, name, join_id(game_id, shard, self.shard_count), vector_id
@@ -0,0 +1,69 @@
+import numpy as np
+
+import ann
+from ann import SimilarImages, _clustered_data
+
+
+class FakeStore:
+    """The parts of vector_store.VectorStore that SimilarImages uses, over in-memory arrays."""
+
+    def __init__(self, ids, vectors):
+        self.ids, self.vectors = list(ids), list(vectors)
+
+    def snapshot(self):
+        return np.array(self.ids, dtype=np.int64), np.array(self.vectors)
+
+    def get(self, image_ids):
+        rows = {image_id: row for row, image_id in enumerate(self.ids)}
+        found = np.array([image_id in rows for image_id in image_ids])
+        return found, np.array([self.vectors[rows[image_id]] if image_id in rows else np.zeros(len(self.vectors[0]))
+                                for image_id in image_ids])
+
+    def sync(self, repo):
+        pass
+
+
+VECTORS = _clustered_data(600, 16, 12, seed=0)
+IDS = np.arange(1, 601)
+
+
+def test_saved_index_gets_the_vectors_written_after_it(tmp_path):
+    path = str(tmp_path / "index.npz")
+    store = FakeStore(IDS[:400], VECTORS[:400])
+    ann.build_from_repository(None, "v1", path, store)
+    store.ids += IDS[400:].tolist()
+    store.vectors += list(VECTORS[400:])
+
+    index = ann.load_or_build(None, "v1", path, store)
+    assert len(index) == 600
+    assert index.contains(IDS).all()
+
+
+def test_vectors_added_while_loading_are_kept(tmp_path):
+    path = str(tmp_path / "index.npz")
+    store = FakeStore(IDS, VECTORS)
+    ann.build_from_repository(None, "v1", path, store)
+    images = SimilarImages(None, "v1", path, store)
+    images.add(1000, VECTORS[0])
+    images.add(1, VECTORS[0])
+    images._load()
+    assert len(images.index) == 601
+    assert images.index.contains(np.array([1000])).all()
+
+
+def test_vectors_added_during_a_rebuild_are_kept(tmp_path, monkeypatch):
+    path = str(tmp_path / "index.npz")
+    store = FakeStore(IDS[:500], VECTORS[:500])
+    images = SimilarImages(None, "v1", path, store)
+    images._load()
+    build = ann.build_from_repository
+
+    def build_while_adding(*args, **kwargs):
+        index = build(*args, **kwargs)
+        images.add(501, VECTORS[500])
+        return index
+
+    monkeypatch.setattr(ann, "build_from_repository", build_while_adding)
+    images._rebuild()
+    assert images.added is None
+    assert images.index.contains(np.array([501])).all()
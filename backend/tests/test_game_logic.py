@@ -0,0 +1,62 @@
+import pytest
+
+# game_logic imports the image generation clients from requirements.txt
+pytest.importorskip("langchain_ollama")
+
+from game_logic import Game, GameStatus, ImgPrompt  # noqa: E402
+
+
+@pytest.fixture
+def game(tmp_path):
+    game = Game(3, f"sqlite:///{tmp_path / 'game.db'}", durability="sync")
+    for name in ("ana", "mai", "domzi"):
+        game.add_player(game.register_user(name, "secret"))
+    game.status = GameStatus.VOTING
+    yield game
+    game.repo.dispose()
+
+
+def vote_round(game, ballots):
+    for voter_id, voted_for_id in ballots:
+        assert game.cast_vote(voter_id, voted_for_id)
+    return game.tally_votes()
+
+
+def test_a_tied_round_still_has_a_winner_and_the_game_moves_on(game):
+    first, second, third = game.players
+    game.players[third].similarity = 0.8
+    game.players[second].similarity = 0.3
+
+    assert vote_round(game, [(first, second), (second, third), (third, first)]) == third
+    assert game.status == GameStatus.GENERATING_INITIAL_IMAGE
+    assert game.votes == {} and all(player.vote is None for player in game.players.values())
+    assert game.round_results[-1]["tie"] is True
+    # The tied round and its ballots are in the ledger like any other
+    assert sorted(game.repo.get_round_results(game.game_id)) == [
+        (0, player_id, 1, player_id == third) for player_id in sorted((first, second, third))]
+    assert sorted(game.repo.get_user_votes(first)) == [(game.game_id, 0, second)]
+
+    game.status = GameStatus.VOTING
+    assert game.cast_vote(first, third)
+
+
+def test_a_tie_without_similarities_goes_to_the_first_player_to_join(game):
+    first, second, third = game.players
+    assert vote_round(game, [(first, second), (second, third), (third, first)]) == first
+
+
+def test_round_images_are_checked_against_past_images(game):
+    first, second, third = game.players
+    past_image = 7
+    game.hash_index.add(past_image, 0b1011)
+    for player_id, (image_id, phash) in zip((first, second, third), [(11, 0b1001), (12, 0xFFFF0000), (13, 0xFFFF0001)]):
+        game.players[player_id].imgP = ImgPrompt("a prompt", image_id)
+        game.image_phashes[image_id] = phash
+        game.hash_index.add(image_id, phash)
+
+    game.flag_duplicates()
+    assert game.players[first].repeats_image == past_image
+    # Near-duplicates within the round are reported as duplicate_of, not as repeats of each other
+    assert game.players[second].repeats_image is None and game.players[third].repeats_image is None
+    assert game.players[third].duplicate_of == second
+    assert game.get_player_state()["repeated_images"] == {first: past_image}
@@ -0,0 +1,46 @@
+import sqlite3
+from contextlib import closing
+import pytest
+from migrations import (HOT_QUERIES, MigrationError, available_migrations, check_query_plans, current_version,
+                        migrate)
+
+@pytest.fixture
+def conn(tmp_path):
+    with closing(sqlite3.connect(tmp_path / "game.db")) as conn:
+        yield conn
+
+def test_migrate_applies_every_migration(conn):
+    numbers = [number for number, _, _ in available_migrations()]
+    assert migrate(conn) == numbers
+    assert current_version(conn) == numbers[-1]
+
+def test_migrate_is_idempotent(conn):
+    migrate(conn)
+    before = conn.execute("SELECT Version, Name, Applied_At FROM schema_version ORDER BY Version").fetchall()
+    assert migrate(conn) == []
+    assert conn.execute("SELECT Version, Name, Applied_At FROM schema_version ORDER BY Version").fetchall() == before
+
+def test_hot_queries_use_an_index(conn):
+    migrate(conn)
+    assert check_query_plans(conn) == []
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_each_hot_query_searches_its_table(conn, name):
+    migrate(conn)
+    table, sql = HOT_QUERIES[name]
+    plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", (None,) * sql.count("?"))]
+    assert any(detail.startswith(f"SEARCH {table} USING") for detail in plan), plan
+
+def test_shared_user_names_stop_the_unique_name_migration(conn):
+    first, name, path = available_migrations()[0]
+    with open(path) as f:
+        conn.executescript(f.read())
+    conn.execute("CREATE TABLE schema_version (Version INTEGER PRIMARY KEY, Name TEXT NOT NULL, "
+                 "Applied_At TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)")
+    conn.execute("INSERT INTO schema_version (Version, Name) VALUES (?, ?)", (first, name))
+    conn.executemany("INSERT INTO Users (Name, Password) VALUES (?, ?)", [("Ana", "a"), ("Ana", "b"), ("Mai", "c")])
+    conn.commit()
+    with pytest.raises(MigrationError, match=r"'Ana' \(user IDs 1, 2\)"):
+        migrate(conn)
+    assert current_version(conn) == first
+    assert [row[0] for row in conn.execute("SELECT Name FROM Users ORDER BY Id")] == ["Ana", "Ana", "Mai"]
@@ -0,0 +1,25 @@
+from ratings import MatchmakingQueue
+
+
+def test_every_lobby_member_can_look_up_the_lobby():
+    queue = MatchmakingQueue(3)
+    assert queue.join(1, 1500) is None
+    assert queue.join(2, 1520) is None
+    assert queue.status(1) == (True, None)
+    lobby = queue.join(3, 1480)
+    assert sorted(lobby) == [1, 2, 3]
+    for user_id in (1, 2, 3):
+        assert queue.status(user_id) == (False, lobby)
+    assert len(queue) == 0
+
+
+def test_leaving_or_joining_again_forgets_the_last_lobby():
+    queue = MatchmakingQueue(2)
+    queue.join(1, 1500)
+    queue.join(2, 1500)
+    assert queue.leave(1) is False
+    assert queue.status(1) == (False, None)
+    assert queue.join(2, 1500) is None
+    assert queue.status(2) == (True, None)
+    assert queue.leave(2) is True
+    assert queue.status(2) == (False, None)
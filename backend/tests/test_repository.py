@@ -0,0 +1,103 @@
+import os
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+from repository import GameRepository, _insert_ignore, _upsert, parse_leaderboard_cursor, ratings, user_stats
+
+
+# A temp SQLite file always; the database in DATABASE_URL too when it is set, e.g. a scratch Postgres.
+# That one is shared between runs, so the tests create their own users and only look at those.
+@pytest.fixture(params=["sqlite", "database_url"])
+def repo(request, tmp_path):
+    if request.param == "sqlite":
+        url = f"sqlite:///{tmp_path / 'game.db'}"
+    else:
+        url = os.environ.get("DATABASE_URL")
+        if not url:
+            pytest.skip("DATABASE_URL is not set")
+    repo = GameRepository.from_url(url)
+    repo.migrate()
+    yield repo
+    repo.dispose()
+
+
+def unique_name(prefix="player"):
+    return f"{prefix}-{uuid.uuid4().hex[:12]}"
+
+
+def test_create_user_and_login(repo):
+    name = unique_name()
+    user_id = repo.create_user(name, "secret")
+    assert repo.find_user(name, "secret") == user_id
+    assert repo.find_user(name, "wrong") is None
+    assert repo.get_user_name(user_id) == name
+    assert repo.user_exists(user_id)
+
+
+def test_create_user_rejects_a_taken_name(repo):
+    name = unique_name()
+    repo.create_user(name, "secret")
+    with pytest.raises(ValueError, match="Username already taken"):
+        repo.create_user(name, "other")
+
+
+def test_rename_user(repo):
+    first, second = unique_name(), unique_name()
+    user_id = repo.create_user(first, "secret")
+    repo.create_user(second, "secret")
+    with pytest.raises(ValueError, match="Username already taken"):
+        repo.rename_user(user_id, second)
+    renamed = unique_name()
+    repo.rename_user(user_id, renamed)
+    assert repo.get_user_name(user_id) == renamed
+
+
+def test_record_round(repo):
+    alice, bob, cara = (repo.create_user(unique_name(), "secret") for _ in range(3))
+    game_id = repo.create_game()
+    for user_id in (alice, bob, cara):
+        repo.add_participant(game_id, user_id)
+    repo.record_round(game_id, 1, [(alice, bob), (bob, cara), (cara, bob)], {alice: 0, bob: 2, cara: 1}, bob)
+    assert repo.get_round_results(game_id) == [(1, bob, 2, True), (1, cara, 1, False), (1, alice, 0, False)]
+    assert repo.get_user_votes(alice) == [(game_id, 1, bob)]
+
+
+def test_leaderboard_pages_follow_the_cursor(repo):
+    players = [repo.create_user(unique_name(), "secret") for _ in range(3)]
+    mine = set(players)
+    repo.add_round_stats({players[0]: 1, players[1]: 3, players[2]: 2}, players[1])
+    repo.add_game_stats(players, players[1])
+    repo.add_round_stats({players[0]: 4, players[1]: 0, players[2]: 2}, players[0])
+
+    entries, after = [], None
+    while True:
+        page = repo.get_leaderboard(limit=2, after=after)
+        if not page:
+            break
+        entries += [entry for entry in page if entry["User_Id"] in mine]
+        last = page[-1]
+        after = parse_leaderboard_cursor(f"{last['Wins']}.{last['Votes_Received']}.{last['User_Id']}")
+    # Neither of the others won the game, so they are ordered by votes received
+    assert [entry["User_Id"] for entry in entries] == [players[1], players[0], players[2]]
+    assert {entry["User_Id"]: (entry["Wins"], entry["Votes_Received"], entry["Rounds_Played"]) for entry in entries} == {
+        players[0]: (0, 5, 2), players[1]: (1, 3, 2), players[2]: (0, 4, 2)}
+
+
+def test_upsert_overwrites_and_increments(repo):
+    user_id = repo.create_user(unique_name(), "secret")
+    with repo.transaction() as conn:
+        _upsert(conn, ratings, "User_Id", [{"User_Id": user_id, "Rating": 1510.0, "Games": 1}], increment=("Games",))
+        _upsert(conn, ratings, "User_Id", [{"User_Id": user_id, "Rating": 1495.5, "Games": 1}], increment=("Games",))
+        _upsert(conn, ratings, "User_Id", [])
+    assert repo.get_ratings([user_id]) == {user_id: (1495.5, 2)}
+
+
+def test_insert_ignore_keeps_the_stored_row(repo):
+    user_id = repo.create_user(unique_name(), "secret")
+    with repo.transaction() as conn:
+        _insert_ignore(conn, user_stats, [{"User_Id": user_id, "Wins": 2}])
+        _insert_ignore(conn, user_stats, [{"User_Id": user_id, "Wins": 5}])
+        _insert_ignore(conn, user_stats, [])
+        assert conn.execute(select(user_stats.c.Wins).where(user_stats.c.User_Id == user_id)).scalar() == 2
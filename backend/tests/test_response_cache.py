@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+from response_cache import ResponseCache
+
+
+def make_game(game_id=1, version=0):
+    return SimpleNamespace(game_id=game_id, version=version)
+
+
+def test_a_new_version_rebuilds_the_response():
+    cache, game, builds = ResponseCache(), make_game(), []
+
+    def build():
+        builds.append(game.version)
+        return {"version": game.version}, 200
+
+    assert cache.respond(game, "game_status", build).get_data() == b'{"version":0}'
+    cache.respond(game, "game_status", build)
+    game.version += 1
+    assert cache.respond(game, "game_status", build).get_data() == b'{"version":1}'
+    assert builds == [0, 1]
+
+
+def test_entries_are_bounded():
+    cache, game = ResponseCache(max_entries=3), make_game()
+    for player_id in range(10):
+        cache.respond(game, ("state", player_id), lambda: ({}, 200))
+    assert list(cache.entries) == [(1, ("state", 7)), (1, ("state", 8)), (1, ("state", 9))]
+
+
+def test_a_new_game_drops_the_finished_games_entries():
+    cache = ResponseCache()
+    cache.respond(make_game(1), "game_status", lambda: ({}, 200))
+    cache.respond(make_game(1), ("state", 5), lambda: ({}, 200))
+    cache.respond(make_game(2), "game_status", lambda: ({}, 200))
+    assert list(cache.entries) == [(2, "game_status")]
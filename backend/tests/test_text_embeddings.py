@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+import text_embeddings
+from text_embeddings import TEXT_BATCH, HashingEmbeddings, PromptCache, embed_prompts, get_text_model, set_text_model
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    """HashingEmbeddings that records every batch it is asked to embed."""
+
+    def __init__(self):
+        self.batches = []
+
+    def embed_batch(self, texts):
+        self.batches.append(list(texts))
+        return super().embed_batch(texts)
+
+
+@pytest.fixture
+def model():
+    previous = get_text_model()
+    model = CountingEmbeddings()
+    set_text_model(model)
+    yield model
+    set_text_model(previous)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PromptCache(str(tmp_path / "prompt_cache.db"))
+
+
+def test_each_distinct_prompt_is_embedded_once(model, cache):
+    first = embed_prompts(["a red fox", "a blue whale", "a red fox"], cache)
+    again = embed_prompts(["a blue whale", "a green frog", "a red fox"], cache)
+    assert sorted(prompt for batch in model.batches for prompt in batch) == ["a blue whale", "a green frog", "a red fox"]
+    assert np.array_equal(first[0], first[2])
+    assert np.array_equal(again[2], first[0])
+
+
+def test_large_inputs_are_split_into_batches(model, cache):
+    prompts = [f"prompt number {i}" for i in range(2 * TEXT_BATCH + 5)]
+    embed_prompts(prompts, cache)
+    assert [len(batch) for batch in model.batches] == [TEXT_BATCH, TEXT_BATCH, 5]
+
+
+def test_vectors_are_unit_length_and_in_input_order(model, cache):
+    prompts = ["a castle on a hill", "two cats playing chess", "a castle on a hill at night"]
+    embed_prompts(prompts[1:], cache)
+    vectors = embed_prompts(prompts, cache)
+    assert vectors.shape == (3, text_embeddings.HASHING_DIM)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-6)
+    expected = HashingEmbeddings().embed_batch(prompts)
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    assert np.allclose(vectors, expected, atol=1e-6)
+
+
+def test_no_prompts_give_an_empty_matrix(model, cache):
+    vectors = embed_prompts([], cache)
+    assert vectors.shape == (0, model.dim)
+    assert model.batches == []
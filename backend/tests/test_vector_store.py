@@ -0,0 +1,20 @@
+import numpy as np
+
+from repository import GameRepository
+from vector_store import VectorStore
+
+
+def test_sync_keeps_vectors_whose_row_is_not_committed_yet(tmp_path):
+    repo = GameRepository.from_url(f"sqlite:///{tmp_path / 'game.db'}")
+    repo.migrate()
+    game_id = repo.create_game()
+    user_id = repo.create_user("ana", "secret")
+    queued = repo.insert_image("a red fox", game_id, user_id)
+    store = VectorStore("test-model", 4, str(tmp_path / "vectors"))
+    # The image row exists, its VectorIndex row is still in the write-behind queue; 999 was deleted
+    store.append([queued, 999], np.eye(2, 4, dtype=np.float32))
+
+    assert store.sync(repo) == (0, 1)
+    ids, _ = store.snapshot()
+    assert ids.tolist() == [queued]
+    repo.dispose()
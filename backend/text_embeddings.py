@@ -0,0 +1,165 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing
+from typing import Dict, List, Optional, Protocol, Sequence
+import numpy as np
+import requests
+from embeddings import VECTOR_DTYPE, from_blob, to_blob
+from logger import ai_logger
+
+# Prompt text embeddings. A backend embeds a batch of prompts per call; vectors are unit length
+# float32 like the image embeddings, cached on disk by a hash of (model version, prompt) so the
+# same prompt is never embedded twice, and stored per image in PromptVectors.
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+OLLAMA_EMBED_MODEL = os.environ.get("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+OLLAMA_TIMEOUT = 30
+# Prompts per backend request
+TEXT_BATCH = 64
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Database", "prompt_cache.db")
+HASHING_DIM = 256
+
+class TextEmbeddingModel(Protocol):
+    name: str
+    version: int
+    dim: int
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray: ...
+
+class OllamaEmbeddings:
+    """Embeddings from a local Ollama server (POST /api/embed takes a list of inputs)."""
+    version = 1
+
+    def __init__(self, model: str = OLLAMA_EMBED_MODEL, url: str = OLLAMA_URL, dim: int = 768):
+        self.name = f"ollama-{model}"
+        self.model = model
+        self.url = url
+        self.dim = dim
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        response = requests.post(f"{self.url}/api/embed", json={"model": self.model, "input": list(texts)},
+                                 timeout=OLLAMA_TIMEOUT)
+        response.raise_for_status()
+        vectors = np.asarray(response.json()["embeddings"], dtype=np.float32)
+        if vectors.shape != (len(texts), self.dim):
+            raise ValueError(f"{self.name} returned shape {vectors.shape}, expected ({len(texts)}, {self.dim})")
+        return vectors
+
+class HashingEmbeddings:
+    """Deterministic local stand-in: word and character-trigram counts hashed into HASHING_DIM
+    signed buckets. No server needed, e.g. for tests and offline development."""
+    name = "hashing"
+    version = 1
+    dim = HASHING_DIM
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = text.lower()
+            features = re.findall(r"\w+", text) + [text[i:i + 3] for i in range(len(text) - 2)]
+            for feature in features:
+                digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+                vectors[row, digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        return vectors
+
+TEXT_MODELS = {"ollama": OllamaEmbeddings, "hashing": HashingEmbeddings}
+_text_model: TextEmbeddingModel = TEXT_MODELS[os.environ.get("TEXT_EMBEDDINGS", "ollama")]()
+
+def set_text_model(model: TextEmbeddingModel) -> None:
+    global _text_model
+    _text_model = model
+
+def get_text_model() -> TextEmbeddingModel:
+    return _text_model
+
+def text_model_version(model: Optional[TextEmbeddingModel] = None) -> str:
+    model = model or _text_model
+    return f"{model.name}/{model.version}"
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+class PromptCache:
+    """On-disk {sha256(version, prompt): vector} in a small SQLite file of its own."""
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        with closing(self._connect()) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS PromptCache (Key TEXT PRIMARY KEY, Vector BLOB NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        return conn
+
+    @staticmethod
+    def key(version: str, prompt: str) -> str:
+        return hashlib.sha256(f"{version}\0{prompt}".encode()).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        found = {}
+        with closing(self._connect()) as conn:
+            # Stay below SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(conn.execute(f"SELECT Key, Vector FROM PromptCache WHERE Key IN ({placeholders})", chunk))
+        return found
+
+    def put_many(self, items: Dict[str, bytes]) -> None:
+        with self.lock, closing(self._connect()) as conn:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT OR REPLACE INTO PromptCache (Key, Vector) VALUES (?, ?)", items.items())
+            conn.execute("COMMIT")
+
+_cache: Optional[PromptCache] = None
+
+def get_cache() -> PromptCache:
+    global _cache
+    if _cache is None:
+        _cache = PromptCache()
+    return _cache
+
+def embed_prompts(prompts: Sequence[str], cache: Optional[PromptCache] = None) -> np.ndarray:
+    """(len(prompts), dim) unit-length vectors; only prompts missing from the cache reach the
+    backend, deduplicated and TEXT_BATCH at a time."""
+    model, version = _text_model, text_model_version()
+    cache = cache or get_cache()
+    keys = [PromptCache.key(version, prompt) for prompt in prompts]
+    cached = cache.get_many(list(set(keys)))
+    missing = {key: prompt for key, prompt in zip(keys, prompts) if key not in cached}
+    if missing:
+        missing_keys = list(missing)
+        computed = {}
+        for i in range(0, len(missing_keys), TEXT_BATCH):
+            batch = missing_keys[i:i + TEXT_BATCH]
+            vectors = _normalize_rows(model.embed_batch([missing[key] for key in batch]))
+            computed.update((key, to_blob(vector)) for key, vector in zip(batch, vectors))
+        cache.put_many(computed)
+        cached.update(computed)
+        ai_logger.info(f"Embedded {len(missing)} prompts with {version}, {len(prompts) - len(missing)} from cache")
+    if not prompts:
+        return np.zeros((0, model.dim), dtype=VECTOR_DTYPE)
+    return np.stack([from_blob(cached[key], model.dim) for key in keys])
+
+def backfill_prompt_vectors(repo, batch_size: int = TEXT_BATCH * 4) -> int:
+    """Embed every stored prompt that has no vector of the current text model; returns the count."""
+    version, after_id, total = text_model_version(), 0, 0
+    while True:
+        rows = repo.list_prompts_to_embed(version, after_id, batch_size)
+        if not rows:
+            return total
+        vectors = embed_prompts([prompt for _, prompt in rows])
+        repo.insert_prompt_vectors([(image_id, to_blob(vector), vectors.shape[1], version)
+                                    for (image_id, _), vector in zip(rows, vectors)])
+        after_id, total = rows[-1][0], total + len(rows)
+        ai_logger.info(f"Embedded prompts through image {after_id} ({total} so far)")
+
+def cross_similarities(queries: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """(len(queries), len(candidates)) cosine similarities as one matrix product. Prompt and image
+    vectors are only comparable when they come from a joint text/image model (same version)."""
+    return _normalize_rows(np.asarray(queries, dtype=np.float32)) @ _normalize_rows(np.asarray(candidates, dtype=np.float32)).T
@@ -0,0 +1,223 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Iterable, Optional, Tuple
+import numpy as np
+from embeddings import VECTOR_DTYPE, stack_blobs
+from logger import game_logger
+
+# Append-only sidecar copy of VectorIndex for one model version: a raw little-endian float32
+# matrix (<name>_g<generation>.f32) and the Image_Id of each row (<name>_g<generation>.ids, int64).
+# Readers get np.memmap views of both, so loading every vector costs no database round trip and
+# no copy. A small JSON manifest names the dimension and the current generation of the files.
+STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Database", "vectors")
+ID_DTYPE = np.dtype("<i8")
+# Removed rows keep their place until compaction with this ID
+TOMBSTONE = -1
+SYNC_BATCH = 5000
+# get() binary-searches a sorted copy of the IDs and scans rows appended after it was made;
+# it is re-sorted once that tail grows past this many rows
+LOOKUP_TAIL = 10000
+
+def store_name(version: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", version).strip("_")
+
+class VectorStore:
+    def __init__(self, version: str, dim: int, directory: str = STORE_DIR):
+        self.version = version
+        self.dim = dim
+        self.directory = directory
+        self.name = store_name(version)
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        manifest = self._read_manifest()
+        if manifest is not None and manifest["dim"] != dim:
+            raise ValueError(f"Vector store {self.name} has dimension {manifest['dim']}, expected {dim}")
+        self.generation = manifest["generation"] if manifest else 0
+        if manifest is None:
+            self._write_manifest()
+        self.count = self._recover()
+        # (rows covered, sorted live IDs, their rows) for get(); dropped on remove/compact
+        self._lookup: Optional[Tuple[int, np.ndarray, np.ndarray]] = None
+
+    # Files
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, f"{self.name}.json")
+
+    def _paths(self, generation: Optional[int] = None) -> Tuple[str, str]:
+        generation = self.generation if generation is None else generation
+        base = os.path.join(self.directory, f"{self.name}_g{generation}")
+        return base + ".f32", base + ".ids"
+
+    def _read_manifest(self) -> Optional[dict]:
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def _write_manifest(self) -> None:
+        partial = self.manifest_path + ".partial"
+        with open(partial, "w") as f:
+            json.dump({"version": self.version, "dim": self.dim, "generation": self.generation}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, self.manifest_path)
+
+    def _recover(self) -> int:
+        """Rows are appended vector first, then ID. After a crash, trim both files to the rows that are complete in both."""
+        vectors_path, ids_path = self._paths()
+        for path in (vectors_path, ids_path):
+            if not os.path.exists(path):
+                open(path, "wb").close()
+        row_bytes = self.dim * VECTOR_DTYPE.itemsize
+        count = min(os.path.getsize(vectors_path) // row_bytes, os.path.getsize(ids_path) // ID_DTYPE.itemsize)
+        for path, size in ((vectors_path, count * row_bytes), (ids_path, count * ID_DTYPE.itemsize)):
+            if os.path.getsize(path) != size:
+                game_logger.warning(f"Trimming torn tail of {path} to {count} rows")
+                os.truncate(path, size)
+        return count
+
+    # Writes
+
+    def append(self, image_ids: Iterable[int], vectors: np.ndarray) -> None:
+        ids = np.asarray(list(image_ids), dtype=ID_DTYPE)
+        vectors = np.ascontiguousarray(vectors, dtype=VECTOR_DTYPE).reshape(len(ids), self.dim)
+        if not len(ids):
+            return
+        vectors_path, ids_path = self._paths()
+        with self.lock:
+            for path, data in ((vectors_path, vectors), (ids_path, ids)):
+                with open(path, "ab") as f:
+                    f.write(data.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.count += len(ids)
+
+    def add(self, image_id: int, vector: np.ndarray) -> None:
+        self.append([image_id], np.asarray(vector).reshape(1, -1))
+
+    def remove(self, image_ids: Iterable[int]) -> int:
+        """Tombstone every row of these images; the space comes back on compact()."""
+        remove = np.asarray(list(image_ids), dtype=ID_DTYPE)
+        with self.lock:
+            ids = self._ids_view(writable=True)
+            hits = np.isin(ids, remove)
+            ids[hits] = TOMBSTONE
+            ids.flush()
+            del ids
+            self._lookup = None
+        return int(hits.sum())
+
+    def compact(self) -> None:
+        """Rewrite the live rows (latest row per image, no tombstones) into a new generation."""
+        start = time.perf_counter()
+        with self.lock:
+            ids, vectors = self._live(self._ids_view(), self._vectors_view())
+            old_generation = self.generation
+            self.generation += 1
+            vectors_path, ids_path = self._paths()
+            for path, data in ((vectors_path, vectors), (ids_path, ids)):
+                with open(path, "wb") as f:
+                    f.write(np.ascontiguousarray(data).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            # The manifest switch is the commit point; until then readers and restarts use the old files
+            self._write_manifest()
+            self.count = len(ids)
+            self._lookup = None
+            for path in self._paths(old_generation):
+                os.remove(path)
+        game_logger.info(f"Compacted vector store {self.name} to {len(ids)} rows in {time.perf_counter() - start:.2f}s")
+
+    # Reads
+
+    def _ids_view(self, writable: bool = False) -> np.ndarray:
+        if not self.count:
+            return np.zeros(0, dtype=ID_DTYPE)
+        return np.memmap(self._paths()[1], dtype=ID_DTYPE, mode="r+" if writable else "r", shape=(self.count,))
+
+    def _vectors_view(self) -> np.ndarray:
+        if not self.count:
+            return np.zeros((0, self.dim), dtype=VECTOR_DTYPE)
+        return np.memmap(self._paths()[0], dtype=VECTOR_DTYPE, mode="r", shape=(self.count, self.dim))
+
+    @staticmethod
+    def _live_rows(ids: np.ndarray) -> np.ndarray:
+        # Latest row per image wins; np.unique on the reversed IDs finds each image's last row
+        _, first = np.unique(ids[::-1], return_index=True)
+        rows = np.sort(len(ids) - 1 - first)
+        return rows[ids[rows] != TOMBSTONE]
+
+    @classmethod
+    def _live(cls, ids: np.ndarray, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rows = cls._live_rows(ids)
+        if len(rows) == len(ids):
+            return ids, vectors
+        return ids[rows], vectors[rows]
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(image_ids, vectors) of every live row. Zero-copy memmap views unless rows were
+        replaced or removed since the last compaction."""
+        with self.lock:
+            return self._live(self._ids_view(), self._vectors_view())
+
+    def get(self, image_ids: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """(found, vectors): the latest vector of each image, a zero row where there is none.
+        Reads only the requested rows from the memmap, e.g. to re-rank ANN candidates."""
+        image_ids = np.asarray(list(image_ids) if not isinstance(image_ids, np.ndarray) else image_ids, dtype=ID_DTYPE)
+        with self.lock:
+            if self._lookup is None or self.count - self._lookup[0] > LOOKUP_TAIL:
+                ids = np.asarray(self._ids_view())
+                rows = self._live_rows(ids)
+                order = np.argsort(ids[rows], kind="stable")
+                self._lookup = (self.count, ids[rows][order], rows[order])
+            covered, sorted_ids, sorted_rows = self._lookup
+            tail = np.asarray(self._ids_view()[covered:])
+            vectors_view = self._vectors_view()
+        rows = np.full(len(image_ids), -1, dtype=np.int64)
+        if len(sorted_ids):
+            position = np.minimum(np.searchsorted(sorted_ids, image_ids), len(sorted_ids) - 1)
+            hit = sorted_ids[position] == image_ids
+            rows[hit] = sorted_rows[position[hit]]
+        if len(tail):
+            # The newest matching row of the tail overrides the sorted part
+            matches = image_ids[:, None] == tail[None, ::-1]
+            in_tail = matches.any(axis=1)
+            rows[in_tail] = covered + len(tail) - 1 - np.argmax(matches[in_tail], axis=1)
+        found = rows >= 0
+        vectors = np.zeros((len(image_ids), self.dim), dtype=VECTOR_DTYPE)
+        vectors[found] = vectors_view[rows[found]]
+        return found, vectors
+
+    def __len__(self) -> int:
+        return self.count
+
+    # Keeping in step with VectorIndex
+
+    def sync(self, repo) -> Tuple[int, int]:
+        """Append vectors that are in VectorIndex but not here, tombstone rows whose image is gone from Images.
+        Returns (added, removed)."""
+        start = time.perf_counter()
+        stored, _ = self.snapshot()
+        stored = set(stored.tolist())
+        current = set(repo.list_vector_image_ids(self.version))
+        missing = sorted(current - stored)
+        for i in range(0, len(missing), SYNC_BATCH):
+            rows = repo.get_vectors(missing[i:i + SYNC_BATCH])
+            batch = [image_id for image_id in missing[i:i + SYNC_BATCH] if rows.get(image_id, (None, None, None))[2] == self.version]
+            self.append(batch, stack_blobs((rows[image_id][0] for image_id in batch), self.dim))
+        # Images.Id is written right away but the VectorIndex row goes through the write-behind queue,
+        # so a row missing there may just not be committed yet: only images that are gone lose theirs
+        absent, gone = sorted(stored - current), []
+        for i in range(0, len(absent), SYNC_BATCH):
+            batch = absent[i:i + SYNC_BATCH]
+            existing = repo.get_prompts(batch)
+            gone += [image_id for image_id in batch if image_id not in existing]
+        removed = self.remove(gone) if gone else 0
+        game_logger.info(f"Synced vector store {self.name}: {len(missing)} added, {removed} removed "
+                         f"in {time.perf_counter() - start:.2f}s")
+        return len(missing), removed
@@ -2,7 +2,6 @@ import streamlit as st
 import io
 import time
 import requests
-import base64
 from PIL import Image
 from io import BytesIO
 
@@ -19,6 +18,8 @@ if 'user_id' not in st.session_state:
     st.session_state['user_id'] = None
 if 'player_id' not in st.session_state:
     st.session_state['player_id'] = None
+if 'game_id' not in st.session_state:
+    st.session_state['game_id'] = None
 if 'last_status_check' not in st.session_state:
     st.session_state['last_status_check'] = 0
 
@@ -50,26 +51,26 @@ def add_player(user_id):
     if response.status_code == 200:
         data = response.json()
         if data.get("success"):
+            st.session_state['game_id'] = data.get("gameId")
             return data.get("playerId")
     return None
 
-def get_player_images():
-    response = requests.get(f"{BACKEND_URL}/get_player_images")
+def fetch_image(image_ref, params=None):
+    response = requests.get(f"{BACKEND_URL}{image_ref['url']}", params=params)
+    response.raise_for_status()
+    return Image.open(BytesIO(response.content))
+
+def get_contact_sheet_images():
+    response = requests.get(f"{BACKEND_URL}/contact_sheet")
     if response.status_code == 200:
-        data = response.json()
-        images = data.get("images")
-        if images:
-            decoded_images = {}
-            for player_id, image_data in images.items():
-                try:
-                    image_bytes = base64.b64decode(image_data)
-                    image = Image.open(BytesIO(image_bytes))
-                    decoded_images[player_id] = image
-                except Exception as e:
-                    st.error(f"Error decoding image for player {player_id}: {str(e)}")
-            return decoded_images
-        else:
-            st.warning("No player images received.")
+        layout = response.json()
+        try:
+            sheet = fetch_image(layout)
+            sheet.load()
+            return {tile["player_id"]: sheet.crop((tile["x"], tile["y"], tile["x"] + tile["w"], tile["y"] + tile["h"]))
+                    for tile in layout["tiles"]}
+        except Exception as e:
+            st.error(f"Error loading contact sheet: {str(e)}")
     elif response.status_code == 400:
         st.warning("Player images not ready yet. Please wait.")
     else:
@@ -83,7 +84,12 @@ def send_vote(voter_id, voted_for_id):
     return None
 
 def get_game_status():
-    response = requests.get(f"{BACKEND_URL}/game_status")
+    # Once we know our game, one state request covers status, images and our own progress
+    if st.session_state['game_id'] is not None:
+        response = requests.get(f"{BACKEND_URL}/games/{st.session_state['game_id']}/state",
+                                params={"player_id": st.session_state['player_id']})
+    else:
+        response = requests.get(f"{BACKEND_URL}/game_status")
     if response.status_code == 200:
         return response.json()
     return None
@@ -92,14 +98,12 @@ def get_initial_image():
     response = requests.get(f"{BACKEND_URL}/get_initial_image")
     if response.status_code == 200:
         data = response.json()
-        image_data = data.get("image")
-        if image_data:
+        image_ref = data.get("image")
+        if image_ref:
             try:
-                image_bytes = base64.b64decode(image_data)
-                image = Image.open(BytesIO(image_bytes))
-                return image
+                return fetch_image(image_ref)
             except Exception as e:
-                st.error(f"Error decoding image: {str(e)}")
+                st.error(f"Error loading image: {str(e)}")
         else:
             st.warning("No image data received.")
     elif response.status_code == 400:
@@ -230,7 +234,7 @@ elif st.session_state['current_screen'] == 'waiting_for_generation':
 
 elif st.session_state['current_screen'] == 'voting':
     header()
-    player_images = get_player_images()
+    player_images = get_contact_sheet_images()
     if player_images:
         st.write("Vote for the best image (excluding your own):")
         cols = st.columns(len(player_images))